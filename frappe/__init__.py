@@ -8,6 +8,7 @@ from __future__ import unicode_literals
 
 from werkzeug.local import Local, release_local
 from functools import wraps
+from contextlib import contextmanager
 import os, importlib, inspect, logging, json
 
 # public
@@ -132,6 +133,7 @@ def init(site, sites_path=None, new_site=False):
 	local.user = None
 	local.user_obj = None
 	local.session = None
+	local.replica_db = None
 	local.role_permissions = {}
 	local.valid_columns = {}
 	local.new_doc_templates = {}
@@ -139,6 +141,8 @@ def init(site, sites_path=None, new_site=False):
 	local.jenv = None
 	local.jloader =None
 	local.cache = {}
+	local.document_cache_touched = set()
+	local.meta_cache = None
 
 	setup_module_map()
 
@@ -179,11 +183,50 @@ def get_site_config(sites_path=None, site_path=None):
 
 	return _dict(config)
 
+def get_replica_db():
+	"""Returns the read replica connection set as `read_from_replica` in `site_config.json`.
+
+	`read_from_replica` is a dict with the replica's `host` and (optional) `password`. The database
+	name and user are the same as the master."""
+	replica_db = getattr(local, "replica_db", None)
+	if not replica_db or replica_db.primary is not local.db:
+		from database import Database
+		replica = _dict(local.conf.read_from_replica)
+		local.replica_db = Database(host=replica.host, user=local.conf.db_name,
+			password=replica.password, primary=local.db)
+
+	return local.replica_db
+
+@contextmanager
+def read_from_replica():
+	"""Run read queries inside this block on the read replica, if `read_from_replica` is set in
+	`site_config.json`. Stays on the master inside a write transaction. Any write inside the block,
+	and all queries after it, are sent to the master.
+
+	Example:
+
+		with frappe.read_from_replica():
+			invoices = frappe.get_list("Sales Invoice", fields=["*"], limit_page_length=0)
+	"""
+	if not local.conf.read_from_replica or not db or db.primary or db.transaction_writes:
+		# no replica, already using the replica or in a write transaction
+		yield
+
+	else:
+		local.db = get_replica_db()
+		try:
+			yield
+		finally:
+			local.db = local.db.primary
+
 def destroy():
 	"""Closes connection and releases werkzeug local."""
 	if db:
 		db.close()
 
+	if getattr(local, "replica_db", None):
+		local.replica_db.close()
+
 	release_local(local)
 
 # memcache
@@ -514,11 +557,13 @@ def set_value(doctype, docname, fieldname, value):
 	import frappe.client
 	return frappe.client.set_value(doctype, docname, fieldname, value)
 
-def get_doc(arg1, arg2=None):
+def get_doc(arg1, arg2=None, lazy=False, fields=None):
 	"""Return a `frappe.model.document.Document` object of the given type and name.
 
 	:param arg1: DocType name as string **or** document JSON.
 	:param arg2: [optional] Document name as string.
+	:param lazy: [optional] Load large text fields (`Long Text`, `Code`, `Text Editor`) on first access.
+	:param fields: [optional] Load only these fields (and standard fields), the document cannot be saved.
 
 	Examples:
 
@@ -529,9 +574,48 @@ def get_doc(arg1, arg2=None):
 		# open an existing document
 		todo = frappe.get_doc("ToDo", "TD0001")
 
+		# read only the status and subject of a communication
+		communication = frappe.get_doc("Communication", "COMM-00001", fields=["status", "subject"])
+
+	"""
+	import frappe.model.document
+	return frappe.model.document.get_doc(arg1, arg2, lazy=lazy, fields=fields)
+
+def get_docs(doctype, names):
+	"""Return a list of `frappe.model.document.Document` objects of the given type and names.
+	Loads all parents in one query and children in one query per child DocType.
+
+	:param doctype: DocType name as string.
+	:param names: List of document names.
+
+	Example:
+
+		todos = frappe.get_docs("ToDo", ["TD0001", "TD0002"])
+
 	"""
 	import frappe.model.document
-	return frappe.model.document.get_doc(arg1, arg2)
+	return frappe.model.document.get_docs(doctype, names)
+
+def get_cached_doc(doctype, name=None):
+	"""Return a `frappe.model.document.Document` object from the document cache (redis),
+	loading it from the database if it is not cached. The cache is cleared when the document
+	is saved, deleted, renamed or updated via `db_set`.
+
+	:param doctype: DocType name as string.
+	:param name: [optional] Document name as string, not required for single DocTypes.
+
+	Example:
+
+		company = frappe.get_cached_doc("Company", "Wind Power LLC")
+
+	"""
+	import frappe.model.document
+	return frappe.model.document.get_cached_doc(doctype, name)
+
+def clear_document_cache(doctype, name):
+	"""Remove document from the document cache."""
+	import frappe.model.document
+	frappe.model.document.clear_document_cache(doctype, name)
 
 def get_last_doc(doctype):
 	"""Get last created document of this type."""
@@ -926,6 +1010,29 @@ def get_list(doctype, *args, **kwargs):
 	import frappe.model.db_query
 	return frappe.model.db_query.DatabaseQuery(doctype).execute(None, *args, **kwargs)
 
+def get_list_page(doctype, cursor=None, **kwargs):
+	"""Returns a page of `frappe.get_list` using keyset pagination: rows after the `cursor`,
+	in the sort order, instead of `limit_start`. The cost of a page does not depend on how
+	deep it is, and inserts do not shift the pages.
+
+	Returns `{"data": [rows], "next_cursor": cursor}`. `next_cursor` is None on the last page.
+
+	:param doctype: DocType on which query is to be made.
+	:param cursor: `next_cursor` of the previous page. Not set for the first page.
+	:param kwargs: Same as `frappe.get_list`, except `limit_start`.
+
+	Example:
+
+		page = frappe.get_list_page("ToDo", fields=["name", "description"], limit_page_length=100)
+		while page.next_cursor:
+			page = frappe.get_list_page("ToDo", cursor=page.next_cursor, fields=["name", "description"],
+				limit_page_length=100)
+	"""
+	import frappe.model.db_query
+	query = frappe.model.db_query.DatabaseQuery(doctype)
+	data = query.execute(None, cursor=cursor or "", **kwargs)
+	return _dict({"data": data, "next_cursor": query.next_cursor})
+
 def get_all(doctype, *args, **kwargs):
 	"""List database query via `frappe.model.db_query`. Will **not** check for conditions.
 	Parameters are same as `frappe.get_list`
@@ -24,6 +24,7 @@ def handle():
 		- `?filters=[["Task", "name", "like", "%005"]]`
 		- `?limit_start=0`
 		- `?limit_page_length=20`
+		- `?cursor=` to page by cursor, returns `next_cursor` to be passed for the next page
 
 	`/api/resource/{doctype}/{name}` will point to a resource
 		`GET` will return doclist
@@ -103,9 +104,14 @@ def handle():
 					if frappe.local.form_dict.get('fields'):
 						frappe.local.form_dict['fields'] = json.loads(frappe.local.form_dict['fields'])
 					frappe.local.form_dict.setdefault('limit_page_length', 20)
-					frappe.local.response.update({
-						"data":  frappe.call(frappe.client.get_list,
-							doctype, **frappe.local.form_dict)})
+					with frappe.read_from_replica():
+						if "cursor" in frappe.local.form_dict:
+							frappe.local.response.update(frappe.call(frappe.client.get_list_page,
+								doctype, **frappe.local.form_dict))
+						else:
+							frappe.local.response.update({
+								"data":  frappe.call(frappe.client.get_list,
+									doctype, **frappe.local.form_dict)})
 
 				if frappe.local.request.method=="POST":
 					data = json.loads(frappe.local.form_dict.data)
@@ -19,6 +19,7 @@ import frappe.auth
 import frappe.api
 import frappe.async
 import frappe.utils.response
+import frappe.utils.query_profiler
 import frappe.website.render
 from frappe.utils import get_site_name, get_site_path
 from frappe.middlewares import StaticDataMiddleware
@@ -92,6 +93,9 @@ def application(request):
 		if response and hasattr(frappe.local, 'cookie_manager'):
 			frappe.local.cookie_manager.flush_cookies(response=response)
 
+		if response:
+			frappe.utils.query_profiler.set_response_headers(response)
+
 		frappe.destroy()
 
 	return response
@@ -14,6 +14,12 @@ def get_list(doctype, fields=None, filters=None, order_by=None,
 	return frappe.get_list(doctype, fields=fields, filters=filters, order_by=order_by,
 		limit_start=limit_start, limit_page_length=limit_page_length, ignore_permissions=False)
 
+@frappe.whitelist()
+def get_list_page(doctype, fields=None, filters=None, order_by=None, cursor=None,
+	limit_page_length=20):
+	return frappe.get_list_page(doctype, cursor=cursor, fields=fields, filters=filters,
+		order_by=order_by, limit_page_length=limit_page_length, ignore_permissions=False)
+
 @frappe.whitelist()
 def get(doctype, name=None, filters=None):
 	if filters and not name:
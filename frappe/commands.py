@@ -197,6 +197,7 @@ def migrate(context, rebuild_website=False):
 	"Run patches, sync schema and rebuild files/translations"
 	import frappe.modules.patch_handler
 	import frappe.model.sync
+	from frappe.model.db_schema import sync_search_indexes
 	from frappe.utils.fixtures import sync_fixtures
 	import frappe.translate
 	from frappe.desk.notifications import clear_notifications
@@ -213,6 +214,7 @@ def migrate(context, rebuild_website=False):
 			frappe.modules.patch_handler.run_all()
 			# sync
 			frappe.model.sync.sync_all(verbose=context.verbose)
+			sync_search_indexes()
 			frappe.translate.clear_cache()
 			sync_fixtures()
 
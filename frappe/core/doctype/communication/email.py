@@ -104,7 +104,7 @@ def notify(doc, print_html=None, print_format=None, attachments=None,
 		doc._notify(print_html=print_html, print_format=print_format, attachments=attachments,
 			recipients=recipients, cc=cc)
 	else:
-		check_bulk_limit(list(set(doc.sent_email_addresses)))
+		check_bulk_limit(list(set(doc.sent_email_addresses)), doc.reference_doctype, doc.reference_name)
 
 		from frappe.tasks import sendmail
 		sendmail.delay(frappe.local.site, doc.name,
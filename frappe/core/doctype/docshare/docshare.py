@@ -3,6 +3,7 @@
 
 from __future__ import unicode_literals
 import frappe
+import frappe.share
 from frappe.model.document import Document
 from frappe import _
 from frappe.utils import get_fullname
@@ -41,6 +42,9 @@ class DocShare(Document):
 
 			frappe.throw(_('You need to have "Share" permission'), frappe.PermissionError)
 
+	def on_update(self):
+		frappe.share.clear_cache(self.share_doctype, self.user, self.everyone)
+
 	def after_insert(self):
 		doc = self.get_doc()
 		owner = get_fullname(self.owner)
@@ -57,6 +61,8 @@ class DocShare(Document):
 		self.get_doc().add_comment("Unshared",
 			_("{0} un-shared this document with {1}").format(get_fullname(self.owner), get_fullname(self.user)))
 
+		frappe.share.clear_cache(self.share_doctype, self.user, self.everyone)
+
 def on_doctype_update():
 	"""Add index in `tabDocShare` for `(user, share_doctype)`"""
 	frappe.db.add_index("DocShare", ["user", "share_doctype"])
@@ -90,3 +90,34 @@ class TestDocShare(unittest.TestCase):
 		self.assertTrue(self.event.name not in frappe.share.get_shared("Event", self.user))
 		self.assertTrue(self.event.name not in frappe.share.get_shared("Event", "test1@example.com"))
 		self.assertTrue(self.event.name not in frappe.share.get_shared("Event", "Guest"))
+
+	def test_shared_cache(self):
+		# not cached in a write transaction
+		frappe.share.get_shared("Event", self.user)
+		self.assertEquals(frappe.cache().hget("shared_doctypes", self.user), None)
+
+		frappe.db.commit()
+		frappe.share.get_shared("Event", self.user)
+
+		# not queried again
+		count = frappe.db.query_count
+		self.assertTrue(self.event.name not in frappe.share.get_shared("Event", self.user))
+		self.assertEquals(frappe.share.get_shared("ToDo", self.user), [])
+		self.assertEquals(frappe.db.query_count, count)
+
+		# cleared on share
+		frappe.share.add("Event", self.event.name, self.user)
+		self.assertTrue(self.event.name in frappe.share.get_shared("Event", self.user))
+		self.assertTrue(self.event.name in frappe.share.get_shared("Event", self.user, ["read"]))
+		self.assertTrue(self.event.name not in frappe.share.get_shared("Event", self.user, ["write"]))
+
+		frappe.share.set_permission("Event", self.event.name, self.user, "write")
+		self.assertTrue(self.event.name in frappe.share.get_shared("Event", self.user, ["write"]))
+
+		frappe.share.remove("Event", self.event.name, self.user)
+		self.assertTrue(self.event.name not in frappe.share.get_shared("Event", self.user))
+
+		# cleared again on commit, values cached by other requests before the commit are stale
+		frappe.cache().hset("shared_names:Event", self.user + "::read", [self.event.name])
+		frappe.db.commit()
+		self.assertEquals(frappe.cache().hget("shared_names:Event", self.user + "::read"), None)
@@ -7,25 +7,33 @@
 from __future__ import unicode_literals
 import MySQLdb
 from MySQLdb.times import DateTimeDeltaType
+from MySQLdb.cursors import SSCursor
 from markdown2 import UnicodeWithAttrs
 import warnings
 import datetime
+import time
+import os
+import threading
 import frappe
 import frappe.defaults
 import frappe.async
 import re
 import frappe.model.meta
-from frappe.utils import now, get_datetime, cstr
+from frappe.utils import now, get_datetime, cstr, cint
+from frappe.utils.query_profiler import normalize_query, log_slow_query, get_summary
 from frappe import _
 from types import StringType, UnicodeType
 
+# doctypes (tables) referred to in a query
+table_name_pattern = re.compile(r"`tab([^`]+)`|\btab(\w+)")
+
 class Database:
 	"""
 	   Open a database connection with the given parmeters, if use_default is True, use the
 	   login details from `conf.py`. This is called by the request handler and is accessible using
 	   the `db` global variable. the `sql` method is also global to run queries
 	"""
-	def __init__(self, host=None, user=None, password=None, ac_name=None, use_default = 0):
+	def __init__(self, host=None, user=None, password=None, ac_name=None, use_default = 0, primary=None):
 		self.host = host or frappe.conf.db_host or 'localhost'
 		self.user = user or frappe.conf.db_name
 		self._conn = None
@@ -42,26 +50,49 @@ class Database:
 		self.password = password or frappe.conf.db_password
 		self.value_cache = {}
 
+		# read-through cache of `get_value` by name for the current transaction, see `get_values`
+		self.name_value_cache = {}
+		self.name_value_cache_hits = 0
+		self.name_value_cache_misses = 0
+
+		# if set, this is a read replica and writes are sent to the primary (master) connection
+		self.primary = primary
+		self.max_allowed_packet = None
+
+		# query profile for this request / job, see `frappe.utils.query_profiler`
+		self.query_count = 0
+		self.query_time = 0.0
+		self.query_stats = {}
+
 	def get_db_login(self, ac_name):
 		return ac_name
 
 	def connect(self):
-		"""Connects to a database as set in `site_config.json`."""
+		"""Connects to a database as set in `site_config.json`. If `db_connection_pool` is set,
+		an idle connection from the process' connection pool is reused."""
 		warnings.filterwarnings('ignore', category=MySQLdb.Warning)
-		self._conn = MySQLdb.connect(user=self.user, host=self.host, passwd=self.password,
-			use_unicode=True, charset='utf8')
-		self._conn.converter[246]=float
-		self._conn.converter[12]=get_datetime
-		self._conn.encoders[UnicodeWithAttrs] = self._conn.encoders[UnicodeType]
-		self._conn.encoders[DateTimeDeltaType] = self._conn.encoders[StringType]
 
-		MYSQL_OPTION_MULTI_STATEMENTS_OFF = 1
-		self._conn.set_server_option(MYSQL_OPTION_MULTI_STATEMENTS_OFF)
+		if frappe.conf.db_connection_pool:
+			self._conn = connection_pool.get(self.get_pool_key(),
+				max_idle=frappe.conf.db_connection_max_idle or 300)
+
+		if not self._conn:
+			self._conn = MySQLdb.connect(user=self.user, host=self.host, passwd=self.password,
+				use_unicode=True, charset='utf8')
+			self._conn.converter[246]=float
+			self._conn.converter[12]=get_datetime
+			self._conn.encoders[UnicodeWithAttrs] = self._conn.encoders[UnicodeType]
+			self._conn.encoders[DateTimeDeltaType] = self._conn.encoders[StringType]
+
+			MYSQL_OPTION_MULTI_STATEMENTS_OFF = 1
+			self._conn.set_server_option(MYSQL_OPTION_MULTI_STATEMENTS_OFF)
 
 		self._cursor = self._conn.cursor()
 		if self.user != 'root':
 			self.use(self.user)
-		frappe.local.rollback_observers = []
+
+		if not self.primary:
+			frappe.local.rollback_observers = []
 
 	def use(self, db_name):
 		"""`USE` db_name."""
@@ -75,7 +106,7 @@ class Database:
 			frappe.throw(_("Not permitted"), frappe.PermissionError)
 
 	def sql(self, query, values=(), as_dict = 0, as_list = 0, formatted = 0,
-		debug=0, ignore_ddl=0, as_utf8=0, auto_commit=0, update=None):
+		debug=0, ignore_ddl=0, as_utf8=0, auto_commit=0, update=None, iterate=0):
 		"""Execute a SQL query and fetch all rows.
 
 		:param query: SQL query.
@@ -88,6 +119,7 @@ class Database:
 		:param as_utf8: Encode values as UTF 8.
 		:param auto_commit: Commit after executing the query.
 		:param update: Update this dict to all rows (if returned `as_dict`).
+		:param iterate: Return a generator that streams rows from an unbuffered server side cursor. See `sql_iter`.
 
 		Examples:
 
@@ -102,6 +134,15 @@ class Database:
 				{"name": "a%", "owner":"test@example.com"})
 
 		"""
+		if iterate and (formatted or update or ignore_ddl):
+			raise ValueError("formatted, update and ignore_ddl are not supported with iterate")
+
+		if self.primary and (auto_commit or self.primary.transaction_writes or not self.is_read_query(query)):
+			# read replica: writes and anything after a write go to the master
+			return self.primary.sql(query, values, as_dict=as_dict, as_list=as_list, formatted=formatted,
+				debug=debug, ignore_ddl=ignore_ddl, as_utf8=as_utf8, auto_commit=auto_commit, update=update,
+				iterate=iterate)
+
 		if not self._conn:
 			self.connect()
 
@@ -111,40 +152,12 @@ class Database:
 		# autocommit
 		if auto_commit: self.commit()
 
+		if iterate:
+			return self._iterate(query, values, as_dict=as_dict, as_utf8=as_utf8, debug=debug)
+
 		# execute
 		try:
-			if values!=():
-				if isinstance(values, dict):
-					values = dict(values)
-
-				# MySQL-python==1.2.5 hack!
-				if not isinstance(values, (dict, tuple, list)):
-					values = (values,)
-
-				if debug:
-					try:
-						self.explain_query(query, values)
-						frappe.errprint(query % values)
-					except TypeError:
-						frappe.errprint([query, values])
-				if (frappe.conf.get("logging") or False)==2:
-					frappe.log("<<<< query")
-					frappe.log(query)
-					frappe.log("with values:")
-					frappe.log(values)
-					frappe.log(">>>>")
-				self._cursor.execute(query, values)
-
-			else:
-				if debug:
-					self.explain_query(query)
-					frappe.errprint(query)
-				if (frappe.conf.get("logging") or False)==2:
-					frappe.log("<<<< query")
-					frappe.log(query)
-					frappe.log(">>>>")
-
-				self._cursor.execute(query)
+			self.execute_query(self._cursor, query, values, debug=debug)
 		except Exception, e:
 			# ignore data definition errors
 			if ignore_ddl and e.args[0] in (1146,1054,1091):
@@ -168,6 +181,126 @@ class Database:
 		else:
 			return self._cursor.fetchall()
 
+	def is_read_query(self, query):
+		"""Returns True if query is a `SELECT`, `SHOW`, `DESC` or `EXPLAIN` that does not lock rows."""
+		query = query.strip().lower()
+		return (query.split(None, 1)[:1] in (["select"], ["show"], ["desc"], ["describe"], ["explain"])
+			and "for update" not in query and "lock in share mode" not in query)
+
+	def execute_query(self, cursor, query, values=(), debug=0):
+		"""Execute query on the given cursor (internal). Handles debug, query logging and profiling."""
+		if self.name_value_cache and not self.is_read_query(query):
+			self.clear_name_value_cache_for_query(query)
+
+		start = time.time()
+		try:
+			self._execute_query(cursor, query, values, debug)
+		finally:
+			self.profile_query(query, time.time() - start)
+
+	def clear_name_value_cache_for_query(self, query):
+		"""Clear `name_value_cache` of the doctypes written to by the query. Since all writes
+		(`set_value`, `db_insert`, `db_update`, `delete_doc`, raw sql) go through here, the cache
+		can never return a value older than the last write in this transaction."""
+		doctypes = [a or b for a, b in table_name_pattern.findall(query)]
+		if doctypes:
+			for doctype in doctypes:
+				self.name_value_cache.pop(doctype, None)
+		else:
+			# commit, rollback, savepoints etc.
+			self.name_value_cache = {}
+
+	def _execute_query(self, cursor, query, values=(), debug=0):
+		if values!=():
+			if isinstance(values, dict):
+				values = dict(values)
+
+			# MySQL-python==1.2.5 hack!
+			if not isinstance(values, (dict, tuple, list)):
+				values = (values,)
+
+			if debug:
+				try:
+					self.explain_query(query, values)
+					frappe.errprint(query % values)
+				except TypeError:
+					frappe.errprint([query, values])
+			if (frappe.conf.get("logging") or False)==2:
+				frappe.log("<<<< query")
+				frappe.log(query)
+				frappe.log("with values:")
+				frappe.log(values)
+				frappe.log(">>>>")
+			cursor.execute(query, values)
+
+		else:
+			if debug:
+				self.explain_query(query)
+				frappe.errprint(query)
+			if (frappe.conf.get("logging") or False)==2:
+				frappe.log("<<<< query")
+				frappe.log(query)
+				frappe.log(">>>>")
+
+			cursor.execute(query)
+
+	def profile_query(self, query, duration):
+		"""Add query to the profile of this request / job and log it if it is slow."""
+		self.query_count += 1
+		self.query_time += duration
+
+		stats = self.query_stats.setdefault(normalize_query(query), [0, 0.0, 0.0])
+		stats[0] += 1
+		stats[1] += duration
+		stats[2] = max(stats[2], duration)
+
+		log_slow_query(query, duration)
+
+	def get_query_profile(self, top_n=None):
+		"""Returns query count, total time and the slowest query shapes of this request / job."""
+		return get_summary(self, top_n=top_n)
+
+	def sql_iter(self, query, values=(), as_dict=0, as_utf8=0, debug=0):
+		"""Execute a SQL query and return a generator that yields rows one at a time.
+
+		Rows are streamed from an unbuffered server side cursor in chunks, so the full result set
+		is never held in memory. The query is executed when the first row is requested.
+
+		**Warning:** no other query can be run on this connection until the generator is exhausted
+		or closed.
+
+		Example:
+
+			for d in frappe.db.sql_iter("select name, subject from tabEvent", as_dict=True):
+				writer.writerow([d.name, d.subject])
+		"""
+		return self.sql(query, values, as_dict=as_dict, as_utf8=as_utf8, debug=debug, iterate=True)
+
+	def _iterate(self, query, values=(), as_dict=0, as_utf8=0, debug=0, chunk_size=1000):
+		"""Generator that executes query on an unbuffered `SSCursor` and yields rows (internal)."""
+		cursor = self._conn.cursor(SSCursor)
+		try:
+			self.execute_query(cursor, query, values, debug=debug)
+			columns = [d[0] for d in cursor.description or []]
+
+			while True:
+				rows = cursor.fetchmany(chunk_size)
+				if not rows:
+					break
+
+				for r in rows:
+					if as_utf8:
+						r = [val.encode('utf-8') if type(val) is unicode else val for val in r]
+
+					if as_dict:
+						yield frappe._dict(zip(columns, r))
+					else:
+						yield r
+
+		finally:
+			# reads any pending rows, so that the connection can be used again
+			cursor.close()
+
 	def explain_query(self, query, values=None):
 		"""Print `EXPLAIN` in error log."""
 		try:
@@ -409,6 +542,9 @@ class Database:
 		:param as_dict: Return values as dict.
 		:param debug: Print query in error log.
 
+		Lookups by document name are cached for the rest of the transaction. The cache of a DocType
+		is cleared whenever a query writes to its table, and the whole cache on commit / rollback.
+
 		Example:
 
 			# return first customer starting with a
@@ -417,11 +553,28 @@ class Database:
 			# return last login of **User** `test@example.com`
 			user = frappe.db.get_values("User", "test@example.com", "*")[0]
 		"""
+		if self.primary and self.primary.transaction_writes:
+			# read replica after a write: read (and cache) on the master, see `sql`
+			return self.primary.get_values(doctype, filters, fieldname, ignore, as_dict, debug,
+				order_by, update, cache)
+
 		out = None
 		if cache and isinstance(filters, basestring) and \
 			(doctype, filters, fieldname) in self.value_cache:
 			return self.value_cache[(doctype, filters, fieldname)]
 
+		# lookups by name are cached till the doctype is written to or the transaction ends
+		cache_key = None
+		if isinstance(filters, basestring) and filters!=doctype and not (order_by or update or debug):
+			cache_key = (filters, fieldname if isinstance(fieldname, basestring) else tuple(fieldname),
+				as_dict)
+			doctype_cache = self.name_value_cache.get(doctype)
+			if doctype_cache and cache_key in doctype_cache:
+				self.name_value_cache_hits += 1
+				return copy_rows(doctype_cache[cache_key])
+
+			self.name_value_cache_misses += 1
+
 		if isinstance(filters, list):
 			out = self._get_value_for_many_names(doctype, filters, fieldname, debug=debug)
 
@@ -451,6 +604,9 @@ class Database:
 		if cache and isinstance(filters, basestring):
 			self.value_cache[(doctype, filters, fieldname)] = out
 
+		if cache_key:
+			self.name_value_cache.setdefault(doctype, {})[cache_key] = copy_rows(out)
+
 		return out
 
 	def get_values_from_single(self, fields, filters, doctype, as_dict=False, debug=False, update=None):
@@ -508,6 +664,9 @@ class Database:
 
 	def get_single_value(self, doctype, fieldname, cache=False):
 		"""Get property of Single DocType. Cache locally by default"""
+		if self.primary and self.primary.transaction_writes:
+			return self.primary.get_single_value(doctype, fieldname, cache)
+
 		value = self.value_cache.setdefault(doctype, {}).get(fieldname)
 		if value:
 			return value
@@ -611,6 +770,57 @@ class Database:
 		if dt in self.value_cache:
 			del self.value_cache[dt]
 
+	def bulk_insert(self, doctype, fields, values, chunk_size=1000, debug=False):
+		"""Insert many rows in a table using multi-row `INSERT ... VALUES (...), (...)` statements.
+		Rows are split into statements so that each one fits within the server's `max_allowed_packet`.
+
+		**Warning:** this function will not call Document events, naming or validations.
+
+		:param doctype: DocType name.
+		:param fields: List of column names.
+		:param values: List of rows, each a list / tuple of values in the order of `fields`.
+		:param chunk_size: Maximum number of rows in one statement.
+		:param debug: Print the query in the developer / js console.
+
+		Example:
+
+			frappe.db.bulk_insert("ToDo", ["name", "description"],
+				[["TD0001", "first"], ["TD0002", "second"]])
+		"""
+		if not values:
+			return
+
+		query = "insert into `tab{doctype}` ({columns}) values ".format(doctype=doctype,
+			columns=", ".join(["`"+f+"`" for f in fields]))
+		row_placeholder = "(" + ", ".join(["%s"] * len(fields)) + ")"
+
+		# leave room for escaping and the query itself
+		max_size = self.get_max_allowed_packet() / 2
+
+		def _insert(rows):
+			self.sql(query + ", ".join([row_placeholder] * len(rows)),
+				[v for row in rows for v in row], debug=debug)
+
+		rows, size = [], len(query)
+		for row in values:
+			row_size = len(row_placeholder) + sum(len(cstr(v)) for v in row)
+			if rows and (size + row_size > max_size or len(rows) >= chunk_size):
+				_insert(rows)
+				rows, size = [], len(query)
+
+			rows.append(row)
+			size += row_size
+
+		if rows:
+			_insert(rows)
+
+	def get_max_allowed_packet(self):
+		"""Returns `max_allowed_packet` (in bytes) of the current connection."""
+		if not self.max_allowed_packet:
+			self.max_allowed_packet = int(self.sql("select @@max_allowed_packet")[0][0])
+
+		return self.max_allowed_packet
+
 	def set(self, doc, field, val):
 		"""Set value in document. **Avoid**"""
 		doc.db_set(field, val)
@@ -672,7 +882,13 @@ class Database:
 	def commit(self):
 		"""Commit current transaction. Calls SQL `COMMIT`."""
 		self.sql("commit")
-		frappe.local.rollback_observers = []
+
+		# observers with `on_commit` run after the commit, like clearing caches of changed data
+		observers, frappe.local.rollback_observers = frappe.local.rollback_observers, []
+		for obj in observers:
+			if hasattr(obj, "on_commit"):
+				obj.on_commit()
+
 		self.flush_realtime_log()
 
 	def flush_realtime_log(self):
@@ -739,6 +955,13 @@ class Database:
 			return frappe.db.sql("""select count(*)
 				from `tab%s`""" % (dt,))[0][0]
 
+	def estimate_count(self, dt):
+		"""Returns the estimated number of rows of the table, from table statistics
+		in `information_schema` (InnoDB estimates can be off by 40-50%)."""
+		count = self.sql("""select table_rows from information_schema.tables
+			where table_schema=database() and table_name=%s""", ("tab" + dt,))
+		return cint(count[0][0]) if count else 0
+
 
 	def get_creation_count(self, doctype, minutes):
 		"""Get count of records created in the last x minutes"""
@@ -790,13 +1013,21 @@ class Database:
 		return frappe.cache().get_value("system_settings", _load_system_settings).get(key)
 
 	def close(self):
-		"""Close database connection."""
+		"""Close database connection. If `db_connection_pool` is set, the connection is
+		rolled back and returned to the pool instead."""
 		if self._conn:
 			self._cursor.close()
-			self._conn.close()
+			if frappe.conf.db_connection_pool:
+				connection_pool.put(self.get_pool_key(), self._conn,
+					size=frappe.conf.db_connection_pool_size or 5)
+			else:
+				self._conn.close()
 			self._cursor = None
 			self._conn = None
 
+	def get_pool_key(self):
+		return (self.host, self.user)
+
 	def escape(self, s, percent=True):
 		"""Excape quotes and percent in given string."""
 		if isinstance(s, unicode):
@@ -813,3 +1044,91 @@ class Database:
 			s = s.replace("%", "%%")
 
 		return s
+
+class ConnectionPool(object):
+	"""Per process pool of idle MySQLdb connections, keyed by (host, user).
+
+	Connections are rolled back and their session variables reset when returned, checked with `ping`
+	when taken out and closed if they have been idle for more than `max_idle` seconds."""
+
+	# session variables set by frappe (e.g. while altering tables), reset to the server defaults
+	reset_session = "set session foreign_key_checks=default, unique_checks=default, sql_mode=default"
+
+	def __init__(self):
+		self.pid = os.getpid()
+		self.idle = {}
+		self.lock = threading.Lock()
+
+	def get(self, key, max_idle=300):
+		"""Returns a healthy idle connection for key or None."""
+		with self.lock:
+			self.check_pid()
+			connections = self.idle.get(key) or []
+
+			while connections:
+				conn, idle_since = connections.pop()
+
+				if time.time() - idle_since > max_idle:
+					self.close(conn)
+					continue
+
+				try:
+					conn.ping()
+				except MySQLdb.Error:
+					self.close(conn)
+					continue
+
+				return conn
+
+	def put(self, key, conn, size=5):
+		"""Reset connection and add it to the pool. Closes it if the pool for key is full."""
+		try:
+			conn.rollback()
+			conn.autocommit(False)
+
+			cursor = conn.cursor()
+			cursor.execute(self.reset_session)
+			cursor.close()
+		except MySQLdb.Error:
+			self.close(conn)
+			return
+
+		with self.lock:
+			self.check_pid()
+			connections = self.idle.setdefault(key, [])
+			if len(connections) < size:
+				connections.append((conn, time.time()))
+			else:
+				self.close(conn)
+
+	def clear(self):
+		"""Close all idle connections."""
+		with self.lock:
+			for connections in self.idle.values():
+				for conn, idle_since in connections:
+					self.close(conn)
+			self.idle = {}
+
+	def check_pid(self):
+		# connections inherited from a parent process (after fork) must not be shared
+		if self.pid != os.getpid():
+			self.pid = os.getpid()
+			self.idle = {}
+
+	def close(self, conn):
+		try:
+			conn.close()
+		except MySQLdb.Error:
+			pass
+
+connection_pool = ConnectionPool()
+
+def copy_rows(rows):
+	"""Returns a copy of the result rows, so that changes made by the caller to
+	cached dict rows do not change the cache."""
+	if not rows:
+		return rows
+
+	copied = [frappe._dict(row) if isinstance(row, dict) else (list(row) if isinstance(row, list) else row)
+		for row in rows]
+	return tuple(copied) if isinstance(rows, tuple) else copied
@@ -3,7 +3,9 @@
 
 from __future__ import unicode_literals
 import frappe
-from frappe.utils import time_diff_in_seconds, now, now_datetime, DATETIME_FORMAT
+import redis
+from frappe.utils import time_diff_in_seconds, now, now_datetime, DATETIME_FORMAT, cint
+from frappe.permissions import get_role_permissions
 from dateutil.relativedelta import relativedelta
 
 @frappe.whitelist()
@@ -86,7 +88,11 @@ def get_notifications_for_doctypes(config, notification_count):
 				open_count_doctype[d] = notification_count[d]
 			else:
 				try:
-					if isinstance(condition, dict):
+					if isinstance(condition, dict) and uses_shared_count(d, config, frappe.session.user):
+						open_count_doctype[d] = get_shared_notification_count(d, condition)
+						continue
+
+					elif isinstance(condition, dict):
 						result = frappe.get_list(d, fields=["count(*)"],
 							filters=condition, as_list=True)[0][0]
 					else:
@@ -122,12 +128,118 @@ def clear_doctype_notifications(doc, method=None, *args, **kwargs):
 	doctype = doc.doctype
 
 	if doctype in config.for_doctype:
+		if uses_shared_count(doctype, config):
+			update_shared_notification_count(doc, method, config)
+
+		# counts of users who do not share the counter
 		delete_notification_count_for(doctype)
 		return
 
 	if doctype in config.for_module_doctypes:
 		delete_notification_count_for(config.for_module_doctypes[doctype])
 
+def uses_shared_count(doctype, config, user=None):
+	"""Returns True if notifications for this DocType are counted incrementally (`incremental_notifications`
+	in site config) and, if `user` is given, if the user can read all its documents.
+
+	Users who can read all documents see the same count, so they share one counter per DocType that is
+	updated on every save, submit, cancel and delete of the document, instead of being recounted for each
+	user after every change."""
+	if not (frappe.conf.get("incremental_notifications") and isinstance(config.for_doctype.get(doctype), dict)):
+		return False
+
+	if user:
+		if frappe.get_hooks("permission_query_conditions", {}).get(doctype):
+			return False
+
+		role_permissions = get_role_permissions(frappe.get_meta(doctype), user=user)
+		if (not role_permissions.get("read") or role_permissions.get("apply_user_permissions", {}).get("read")
+			or role_permissions.get("if_owner", {}).get("read")):
+			return False
+
+	return True
+
+def get_shared_notification_count(doctype, condition):
+	"""Returns the shared count of open documents, counted once if not set"""
+	cache = frappe.cache()
+	key = cache.make_key("notification_count_shared")
+
+	try:
+		count = super(redis.Redis, cache).hget(key, doctype)
+	except redis.exceptions.ConnectionError:
+		count = None
+
+	if count is None:
+		count = frappe.get_all(doctype, fields=["count(*)"], filters=condition, as_list=True)[0][0]
+		set_shared_notification_count(doctype, count)
+
+	return cint(count)
+
+def set_shared_notification_count(doctype, count):
+	cache = frappe.cache()
+	try:
+		super(redis.Redis, cache).hset(cache.make_key("notification_count_shared"), doctype, count)
+	except redis.exceptions.ConnectionError:
+		pass
+
+def increment_shared_notification_count(doctype, delta):
+	"""Atomically add `delta` to the shared count, if it is set"""
+	cache = frappe.cache()
+	key = cache.make_key("notification_count_shared")
+	try:
+		if super(redis.Redis, cache).hexists(key, doctype):
+			super(redis.Redis, cache).hincrby(key, doctype, delta)
+	except redis.exceptions.ConnectionError:
+		pass
+
+def set_notification_match(doc, method=None, *args, **kwargs):
+	"""Remember whether the saved document was counted as open before it is changed
+	(`validate`, `before_cancel` and `before_update_after_submit` hooks)"""
+	config = get_notification_config()
+	if uses_shared_count(doc.doctype, config):
+		doc.flags.notification_match = (not doc.is_new()) and matches_notification_condition(doc, config)
+
+def matches_notification_condition(doc, config):
+	"""Returns True if the document, as saved in the database, matches the notification condition"""
+	filters = dict(config.for_doctype[doc.doctype])
+	filters["name"] = doc.name
+	return bool(frappe.get_all(doc.doctype, filters=filters, limit_page_length=1))
+
+def update_shared_notification_count(doc, method, config):
+	if method=="on_trash":
+		# still in the database
+		delta = -cint(matches_notification_condition(doc, config))
+
+	elif doc.flags.notification_match is not None:
+		delta = cint(matches_notification_condition(doc, config)) - cint(doc.flags.notification_match)
+		doc.flags.notification_match = None
+
+	else:
+		# e.g. after_rename, does not change the count
+		return
+
+	if delta:
+		increment_shared_notification_count(doc.doctype, delta)
+		frappe.local.rollback_observers.append(NotificationCountChange(doc.doctype, delta))
+
+class NotificationCountChange(object):
+	"""Reverts the change in the shared count if the transaction is rolled back"""
+	def __init__(self, doctype, delta):
+		self.doctype = doctype
+		self.delta = delta
+
+	def on_rollback(self):
+		increment_shared_notification_count(self.doctype, -self.delta)
+
+def reconcile_notification_counts():
+	"""Recount shared notification counts, to correct changes that do not run document hooks
+	(like `db_set` or direct updates). Runs hourly."""
+	config = get_notification_config()
+	for doctype, condition in config.for_doctype.iteritems():
+		if uses_shared_count(doctype, config):
+			set_shared_notification_count(doctype, frappe.get_all(doctype, fields=["count(*)"],
+				filters=condition, as_list=True)[0][0])
+
 def get_notification_info_for_boot():
 	out = get_notifications()
 	config = get_notification_config()
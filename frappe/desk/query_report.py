@@ -71,21 +71,23 @@ def run(report_name, filters=()):
 			raise_exception=True)
 
 	columns, result = [], []
-	if report.report_type=="Query Report":
-		if not report.query:
-			frappe.msgprint(_("Must specify a Query to run"), raise_exception=True)
 
+	with frappe.read_from_replica():
+		if report.report_type=="Query Report":
+			if not report.query:
+				frappe.msgprint(_("Must specify a Query to run"), raise_exception=True)
 
-		if not report.query.lower().startswith("select"):
-			frappe.msgprint(_("Query must be a SELECT"), raise_exception=True)
 
-		result = [list(t) for t in frappe.db.sql(report.query, filters)]
-		columns = [cstr(c[0]) for c in frappe.db.get_description()]
-	else:
-		module = report.module or frappe.db.get_value("DocType", report.ref_doctype, "module")
-		if report.is_standard=="Yes":
-			method_name = get_report_module_dotted_path(module, report.name) + ".execute"
-			columns, result = frappe.get_attr(method_name)(frappe._dict(filters))
+			if not report.query.lower().startswith("select"):
+				frappe.msgprint(_("Query must be a SELECT"), raise_exception=True)
+
+			result = [list(t) for t in frappe.db.sql(report.query, filters)]
+			columns = [cstr(c[0]) for c in frappe.db.get_description()]
+		else:
+			module = report.module or frappe.db.get_value("DocType", report.ref_doctype, "module")
+			if report.is_standard=="Yes":
+				method_name = get_report_module_dotted_path(module, report.name) + ".execute"
+				columns, result = frappe.get_attr(method_name)(frappe._dict(filters))
 
 	if report.apply_user_permissions and result:
 		result = get_filtered_data(report.ref_doctype, columns, result)
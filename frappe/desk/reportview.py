@@ -4,14 +4,24 @@
 from __future__ import unicode_literals
 """build query for doclistview and return results"""
 
-import frappe, json
+import frappe, json, hashlib
 import frappe.permissions
 from frappe.model.db_query import DatabaseQuery
+from frappe.utils import cint
 from frappe import _
 
 @frappe.whitelist()
 def get():
-	return compress(execute(**get_form_params()))
+	args = get_form_params()
+	with frappe.read_from_replica():
+		if args.get("cursor") is None:
+			return compress(execute(**args))
+
+		# keyset pagination, see `DatabaseQuery.execute`
+		query = DatabaseQuery(args.pop("doctype"))
+		out = compress(query.execute(**args)) or {"keys": [], "values": []}
+		out["next_cursor"] = query.next_cursor
+		return out
 
 def execute(doctype, *args, **kwargs):
 	return DatabaseQuery(doctype).execute(*args, **kwargs)
@@ -32,6 +42,9 @@ def get_form_params():
 	# queries must always be server side
 	data.query = None
 
+	# results are always returned as a list, streaming is only used in export
+	data.iterate = None
+
 	return data
 
 def compress(data):
@@ -80,25 +93,31 @@ def export_query():
 
 	frappe.permissions.can_export(doctype, raise_exception=True)
 
-	db_query = DatabaseQuery(doctype)
-	ret = db_query.execute(**form_params)
-
-	data = [['Sr'] + get_labels(db_query.fields, doctype)]
-	for i, row in enumerate(ret):
-		data.append([i+1] + list(row))
+	# stream rows from the database instead of loading the full result
+	form_params["iterate"] = True
 
-	# convert to csv
-	from cStringIO import StringIO
+	# convert to csv, in a temporary file that is streamed in the response
+	import tempfile
 	import csv
 
-	f = StringIO()
+	f = tempfile.TemporaryFile()
 	writer = csv.writer(f)
-	for r in data:
+
+	def write_row(r):
 		# encode only unicode type strings and not int, floats etc.
 		writer.writerow(map(lambda v: isinstance(v, unicode) and v.encode('utf-8') or v, r))
 
+	with frappe.read_from_replica():
+		db_query = DatabaseQuery(doctype)
+		ret = db_query.execute(**form_params)
+
+		# labels are built before rows are fetched, no other query can run while streaming
+		write_row(['Sr'] + get_labels(db_query.fields, doctype))
+		for i, row in enumerate(ret):
+			write_row([i+1] + list(row))
+
 	f.seek(0)
-	frappe.response['result'] = unicode(f.read(), 'utf-8')
+	frappe.response['result_file'] = f
 	frappe.response['type'] = 'csv'
 	frappe.response['doctype'] = doctype
 
@@ -133,6 +152,56 @@ def delete_items():
 	for d in il:
 		frappe.delete_doc(doctype, d)
 
+@frappe.whitelist()
+def get_count(doctype, filters=None):
+	"""Returns `{"count": n, "estimated": 0}` for documents of the DocType the user can read.
+
+	Unfiltered counts of tables with more rows than `count_estimate_threshold` in site config
+	(by table statistics) are estimated, with `"estimated": 1`. Counts are cached,
+	see `get_cached_count`."""
+	if isinstance(filters, basestring):
+		filters = json.loads(filters)
+
+	def _get(conditions):
+		if not filters and not conditions and frappe.conf.get("count_estimate_threshold"):
+			estimate = frappe.db.estimate_count(doctype)
+			if estimate > cint(frappe.conf.count_estimate_threshold):
+				return {"count": estimate, "estimated": 1}
+
+		return {"count": execute(doctype, fields=["count(*)"], filters=filters, as_list=True)[0][0],
+			"estimated": 0}
+
+	with frappe.read_from_replica():
+		return get_cached_count(doctype, ["count", filters], _get)
+
+def get_cached_count(doctype, args, generator):
+	"""Returns counts from `generator(conditions)`, cached for `count_cache_ttl` seconds
+	(site config, default 30) by DocType, `args` and all of the user's permission conditions
+	(user permissions, owner, shared documents and permission query conditions), so that
+	users with the same permissions share the cached counts."""
+	if not frappe.has_permission(doctype, "read"):
+		frappe.throw(_("No permission to read {0}").format(doctype), frappe.PermissionError)
+
+	query = DatabaseQuery(doctype)
+	query.user = frappe.session.user
+
+	# the share condition of users who can read only shared documents is added to `conditions`
+	match_conditions = query.build_match_conditions()
+	conditions = query.conditions + ([match_conditions] if match_conditions else [])
+
+	key = "count:{0}:{1}".format(doctype,
+		hashlib.md5(frappe.as_json([args, conditions]).encode("utf-8")).hexdigest())
+
+	count = frappe.cache().get_value(key, expires=True)
+	if count is None:
+		count = generator(conditions)
+
+		# not cached from a write transaction, it may be rolled back
+		if not (frappe.db.primary or frappe.db).transaction_writes:
+			frappe.cache().set_value(key, count, expires_in_sec=cint(frappe.conf.count_cache_ttl) or 30)
+
+	return count
+
 @frappe.whitelist()
 def get_stats(stats, doctype):
 	"""get tag info"""
@@ -140,16 +209,18 @@ def get_stats(stats, doctype):
 	tags = json.loads(stats)
 	stats = {}
 
-	columns = frappe.db.get_table_columns(doctype)
-	for tag in tags:
-		if not tag in columns: continue
-		tagcount = execute(doctype, fields=[tag, "count(*)"],
-			filters=["ifnull(`%s`,'')!=''" % tag], group_by=tag, as_list=True)
-
-		if tag=='_user_tags':
-			stats[tag] = scrub_user_tags(tagcount)
-		else:
-			stats[tag] = tagcount
+	with frappe.read_from_replica():
+		columns = frappe.db.get_table_columns(doctype)
+		for tag in tags:
+			if not tag in columns: continue
+			tagcount = get_cached_count(doctype, ["stats", tag],
+				lambda conditions: execute(doctype, fields=[tag, "count(*)"],
+					filters=["ifnull(`%s`,'')!=''" % tag], group_by=tag, as_list=True))
+
+			if tag=='_user_tags':
+				stats[tag] = scrub_user_tags(tagcount)
+			else:
+				stats[tag] = tagcount
 
 	return stats
 
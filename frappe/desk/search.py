@@ -3,9 +3,11 @@
 
 # Search
 from __future__ import unicode_literals
+import re
 import frappe
 import frappe.desk.reportview
 from frappe.utils import cstr, unique
+from frappe.model.db_schema import get_search_index_columns
 
 # this is called by the Link Field
 @frappe.whitelist()
@@ -31,8 +33,9 @@ def search_widget(doctype, txt, query=None, searchfield=None, start=0,
 
 	if query and query.split()[0].lower()!="select":
 		# by method
-		frappe.response["values"] = frappe.get_attr(query)(doctype, txt,
-			searchfield, start, page_len, filters)
+		with frappe.read_from_replica():
+			frappe.response["values"] = frappe.get_attr(query)(doctype, txt,
+				searchfield, start, page_len, filters)
 	elif not query and doctype in standard_queries:
 		# from standard queries
 		search_widget(doctype, txt, standard_queries[doctype][0],
@@ -58,7 +61,16 @@ def search_widget(doctype, txt, query=None, searchfield=None, start=0,
 
 
 			# build from doctype
-			if txt:
+			search_index_columns = get_search_index_columns(doctype) if txt else None
+			fulltext_query = get_fulltext_query(txt) if search_index_columns else None
+
+			if fulltext_query:
+				# indexed search on name, title and search fields
+				filters.append("""match({columns}) against ("{query}" in boolean mode)""".format(
+					columns=", ".join("`tab{0}`.`{1}`".format(doctype, c) for c in search_index_columns),
+					query=frappe.db.escape(fulltext_query)))
+
+			elif txt:
 				search_fields = ["name"]
 				if meta.title_field:
 					search_fields.append(meta.title_field)
@@ -83,17 +95,29 @@ def search_widget(doctype, txt, query=None, searchfield=None, start=0,
 			fields.append("""locate("{_txt}", `tab{doctype}`.`name`) as `_relevance`""".format(
 				_txt=frappe.db.escape((txt or "").replace("%", "")), doctype=frappe.db.escape(doctype)))
 
-			values = frappe.desk.reportview.execute(doctype,
-				filters=filters, fields=fields,
-				or_filters = or_filters, limit_start = start,
-				limit_page_length=page_len,
-				order_by="if(_relevance, _relevance, 99999), modified desc".format(doctype),
-				ignore_permissions = True if doctype == "DocType" else False, # for dynamic links
-				as_list=True)
+			with frappe.read_from_replica():
+				values = frappe.desk.reportview.execute(doctype,
+					filters=filters, fields=fields,
+					or_filters = or_filters, limit_start = start,
+					limit_page_length=page_len,
+					order_by="if(_relevance, _relevance, 99999), modified desc".format(doctype),
+					ignore_permissions = True if doctype == "DocType" else False, # for dynamic links
+					as_list=True)
 
 			# remove _relevance from results
 			frappe.response["values"] = [r[:-1] for r in values]
 
+def get_fulltext_query(txt):
+	"""Returns a boolean mode FULLTEXT query that matches all words of `txt` as prefixes.
+
+	Returns None if a word is shorter than the minimum indexed word length (3 for InnoDB),
+	in which case the search falls back to `like`."""
+	words = re.findall("\w+", txt, re.UNICODE)
+	if not words or any(len(w) < 3 for w in words):
+		return None
+
+	return " ".join("+{0}*".format(w) for w in words)
+
 def get_std_fields_list(meta, key):
 	# get additional search fields
 	sflist = meta.search_fields and meta.search_fields.split(",") or []
@@ -2,18 +2,24 @@
 # MIT License. See license.txt
 
 from __future__ import unicode_literals
-import frappe
+import frappe, json
+import redis
 import HTMLParser
 import smtplib
 from frappe import msgprint, throw, _
-from frappe.email.smtp import SMTPServer, get_outgoing_email_account
-from frappe.email.email_body import get_email, get_formatted_html
+from frappe.email.smtp import SMTPServer, get_outgoing_email_account, get_smtp_timeout
+from frappe.email.email_body import (get_email, get_formatted_html, get_email_template,
+	make_email_from_template)
 from frappe.utils.verified_command import get_signed_params, verify_request
 from html2text import html2text
-from frappe.utils import get_url, nowdate, encode, now_datetime, add_days, split_emails, cstr
+from frappe.utils import (get_url, nowdate, encode, now_datetime, add_days, split_emails, cstr, cint,
+	validate_email_add)
 
 class BulkLimitCrossedError(frappe.ValidationError): pass
 
+# minimum seconds after which the slot of a flusher that stopped renewing it is free again
+flusher_slot_expiry = 600
+
 def send(recipients=None, sender=None, subject=None, message=None, reference_doctype=None,
 		reference_name=None, unsubscribe_method=None, unsubscribe_params=None, unsubscribe_message=None,
 		attachments=None, reply_to=None, cc=(), show_as_cc=(), message_id=None, in_reply_to=None, send_after=None,
@@ -51,7 +57,7 @@ def send(recipients=None, sender=None, subject=None, message=None, reference_doc
 	if not sender or sender == "Administrator":
 		sender = email_account.default_sender
 
-	check_bulk_limit(recipients)
+	check_bulk_limit(recipients, reference_doctype, reference_name)
 
 	formatted = get_formatted_html(subject, message, email_account=email_account)
 
@@ -61,19 +67,26 @@ def send(recipients=None, sender=None, subject=None, message=None, reference_doc
 		text_content = "See html attachment"
 
 	if reference_doctype and reference_name:
-		unsubscribed = [d.email for d in frappe.db.get_all("Email Unsubscribe", "email",
-			{"reference_doctype": reference_doctype, "reference_name": reference_name})]
-
-		unsubscribed += [d.email for d in frappe.db.get_all("Email Unsubscribe", "email",
-			{"global_unsubscribe": 1})]
+		unsubscribed = get_unsubscribed(reference_doctype, reference_name)
 	else:
-		unsubscribed = []
+		unsubscribed = set()
+
+	recipients = [r for r in set(recipients) if r and r not in unsubscribed]
+
+	bulk_email_message = None
+	if cint(frappe.conf.get("bulk_email_render_once")) and len(recipients) > 1:
+		valid_recipients = filter(validate_email_add, recipients)
+		if not valid_recipients:
+			return
 
-	recipients = [r for r in list(set(recipients)) if r and r not in unsubscribed]
+		bulk_email_message = make_bulk_email_message(valid_recipients[0], sender, subject, formatted,
+			text_content, attachments, reply_to, cc, message_id, in_reply_to)
+		if not bulk_email_message:
+			return
 
+	queued = []
 	for email in recipients:
-		email_content = formatted
-		email_text_context = text_content
+		substitutions = None
 
 		if reference_doctype:
 			unsubscribe_link = get_unsubscribe_link(
@@ -88,20 +101,92 @@ def send(recipients=None, sender=None, subject=None, message=None, reference_doc
 				show_as_cc=show_as_cc
 			)
 
-			email_content = email_content.replace("<!--unsubscribe link here-->", unsubscribe_link.html)
-			email_text_context += unsubscribe_link.text
-
 			# show as cc
 			cc_message = ""
 			if email in show_as_cc:
 				cc_message = _("This email was sent to you as CC")
 
-			email_content = email_content.replace("<!-- cc message -->", cc_message)
-			email_text_context = cc_message + "\n" + email_text_context
+			substitutions = {
+				"unsubscribe_html": unsubscribe_link.html,
+				"unsubscribe_text": unsubscribe_link.text,
+				"cc_message": cc_message
+			}
+
+		if bulk_email_message:
+			if validate_email_add(email):
+				queued.append([email, json.dumps(substitutions) if substitutions else None])
+
+		else:
+			email_content, email_text_context = get_personalized_content(formatted, text_content, substitutions)
 
-		# add to queue
-		add(email, sender, subject, email_content, email_text_context, reference_doctype,
-			reference_name, attachments, reply_to, cc, message_id, in_reply_to, send_after, bulk_priority)
+			# add to queue
+			add(email, sender, subject, email_content, email_text_context, reference_doctype,
+				reference_name, attachments, reply_to, cc, message_id, in_reply_to, send_after, bulk_priority)
+
+	if bulk_email_message:
+		add_for_message(bulk_email_message, queued, sender, reference_doctype, reference_name,
+			send_after, bulk_priority)
+
+def get_personalized_content(formatted, text_content, substitutions=None):
+	"""Returns html and text of the email with the recipient's unsubscribe link and CC message"""
+	if not substitutions:
+		return formatted, text_content
+
+	formatted = formatted.replace("<!--unsubscribe link here-->", substitutions["unsubscribe_html"])
+	formatted = formatted.replace("<!-- cc message -->", substitutions["cc_message"])
+	text_content = substitutions["cc_message"] + "\n" + text_content + substitutions["unsubscribe_text"]
+
+	return formatted, text_content
+
+def make_bulk_email_message(recipient, sender, subject, formatted, text_content=None, attachments=None,
+	reply_to=None, cc=(), message_id=None, in_reply_to=None):
+	"""Render the email and its attachments once for all recipients (`bulk_email_render_once` in
+	site config). The queued Bulk Email only have the recipient and its substitutions, the email is
+	made from the shared message when it is sent, see `get_message`."""
+	try:
+		message = get_email_template(recipient, sender=sender, subject=subject, formatted=formatted,
+			attachments=attachments, reply_to=reply_to, cc=cc, message_id=message_id, in_reply_to=in_reply_to)
+
+	except frappe.InvalidEmailAddressError:
+		# bad sender - don't add to queue
+		return
+
+	return frappe.get_doc({
+		"doctype": "Bulk Email Message",
+		"message": cstr(message),
+		"html": formatted,
+		"text_content": text_content
+	}).insert(ignore_permissions=True)
+
+def add_for_message(bulk_email_message, recipients, sender, reference_doctype=None, reference_name=None,
+	send_after=None, bulk_priority=1):
+	"""Queue Bulk Email for a shared message with one insert per chunk of rows.
+	`recipients` is a list of `[email, substitutions]`."""
+	now = now_datetime()
+	frappe.db.bulk_insert("Bulk Email", ["name", "creation", "modified", "owner", "modified_by", "status",
+		"sender", "recipient", "bulk_email_message", "substitutions", "reference_doctype", "reference_name",
+		"send_after", "priority"],
+		[[frappe.generate_hash("Bulk Email", 10), now, now, frappe.session.user, frappe.session.user, "Not Sent",
+			sender, email, bulk_email_message.name, substitutions, reference_doctype, reference_name,
+			send_after, bulk_priority] for email, substitutions in recipients])
+
+def get_message(email, bulk_email_messages=None):
+	"""Returns the email to be sent for a Bulk Email as string"""
+	if not email.bulk_email_message:
+		return email.message
+
+	if bulk_email_messages is None:
+		bulk_email_messages = {}
+
+	if email.bulk_email_message not in bulk_email_messages:
+		bulk_email_messages[email.bulk_email_message] = frappe.db.get_value("Bulk Email Message",
+			email.bulk_email_message, ["message", "html", "text_content"], as_dict=True)
+
+	message = bulk_email_messages[email.bulk_email_message]
+	formatted, text_content = get_personalized_content(message.html, message.text_content,
+		json.loads(email.substitutions) if email.substitutions else None)
+
+	return make_email_from_template(message.message, email.recipient, formatted, text_content)
 
 def add(email, sender, subject, formatted, text_content=None,
 	reference_doctype=None, reference_name=None, attachments=None, reply_to=None,
@@ -133,7 +218,12 @@ def add(email, sender, subject, formatted, text_content=None,
 	e.send_after = send_after
 	e.insert(ignore_permissions=True)
 
-def check_bulk_limit(recipients):
+def check_bulk_limit(recipients, reference_doctype=None, reference_name=None):
+	# unsubscribed recipients will not be sent to
+	if reference_doctype and reference_name:
+		unsubscribed = get_unsubscribed(reference_doctype, reference_name)
+		recipients = [r for r in recipients if r not in unsubscribed]
+
 	# get count of mails sent this month
 	this_month = frappe.db.sql("""select count(*) from `tabBulk Email` where
 		status='Sent' and MONTH(creation)=MONTH(CURDATE())""")[0][0]
@@ -231,13 +321,53 @@ def unsubscribe(doctype, name, email):
 
 	return_unsubscribed_page(email, doctype, name)
 
+def get_unsubscribed(reference_doctype, reference_name):
+	"""Returns set of emails unsubscribed from the reference document or from all emails (cached)"""
+	global_unsubscribes = frappe.cache().get_value("global_unsubscribes",
+		lambda: set(frappe.db.sql_list("""select email from `tabEmail Unsubscribe`
+			where global_unsubscribe=1""")))
+
+	unsubscribes = frappe.cache().hget("unsubscribes", "{0}::{1}".format(reference_doctype, reference_name),
+		lambda: set(frappe.db.sql_list("""select email from `tabEmail Unsubscribe`
+			where reference_doctype=%s and reference_name=%s""", (reference_doctype, reference_name))))
+
+	return global_unsubscribes | unsubscribes
+
+def clear_unsubscribe_cache(reference_doctype=None, reference_name=None, global_unsubscribe=0):
+	"""Clear cached unsubscribes of the reference document (of all documents if not given) and
+	global unsubscribes. Cleared again when the transaction ends, since other requests may cache
+	the unsubscribes before the change is committed."""
+	_clear_unsubscribe_cache(reference_doctype, reference_name, global_unsubscribe)
+	frappe.local.rollback_observers.append(UnsubscribeCacheChange(reference_doctype, reference_name,
+		global_unsubscribe))
+
+class UnsubscribeCacheChange(object):
+	def __init__(self, reference_doctype, reference_name, global_unsubscribe):
+		self.reference_doctype, self.reference_name = reference_doctype, reference_name
+		self.global_unsubscribe = global_unsubscribe
+
+	def on_commit(self):
+		_clear_unsubscribe_cache(self.reference_doctype, self.reference_name, self.global_unsubscribe)
+
+	on_rollback = on_commit
+
+def _clear_unsubscribe_cache(reference_doctype=None, reference_name=None, global_unsubscribe=0):
+	if reference_doctype and reference_name and not cint(global_unsubscribe):
+		frappe.cache().hdel("unsubscribes", "{0}::{1}".format(reference_doctype, reference_name))
+	else:
+		frappe.cache().delete_value("unsubscribes")
+
+	frappe.cache().delete_value("global_unsubscribes")
+
 def return_unsubscribed_page(email, doctype, name):
 	frappe.respond_as_web_page(_("Unsubscribed"), _("{0} has left the conversation in {1} {2}").format(email, _(doctype), name))
 
 def flush(from_test=False):
-	"""flush email queue, every time: called from scheduler"""
-	smtpserver = SMTPServer()
+	"""flush email queue, every time: called from scheduler
 
+	Emails are sent in batches by `flush_batches`. If more than one batch is waiting, up to
+	`bulk_email_flushers` (site config, default 1) flushers run in parallel, as background jobs.
+	A flusher does not start if that many are already running (see `acquire_flusher_slot`)."""
 	auto_commit = not from_test
 
 	# additional check
@@ -250,47 +380,221 @@ def flush(from_test=False):
 	frappe.db.sql("""update `tabBulk Email` set status='Expired'
 		where datediff(curdate(), creation) > 3 and status='Not Sent'""", auto_commit=auto_commit)
 
-	for i in xrange(500):
-		email = frappe.db.sql("""select * from `tabBulk Email` where
-			status='Not Sent' and ifnull(send_after, "2000-01-01 00:00:00") < %s
-			order by priority desc, creation asc limit 1 for update""", now_datetime(), as_dict=1)
-		if email:
-			email = email[0]
-		else:
+	release_stale_batches(auto_commit)
+
+	if not from_test:
+		import frappe.tasks
+		running = get_running_flushers() or []
+		free = get_flusher_count() - len(running)
+		if free > 1 and frappe.db.sql("""select name from `tabBulk Email`
+			where status='Not Sent' limit %s, 1""", get_batch_size()):
+			for i in xrange(free - 1):
+				frappe.tasks.flush_bulk_email.delay(frappe.local.site)
+
+	flush_batches(from_test)
+
+def release_stale_batches(auto_commit=True):
+	"""Queue again emails claimed by flushers that are no longer running (their slot has expired)."""
+	running = get_running_flushers()
+	if running is None:
+		# cannot tell which flushers are running
+		return
+
+	for claimed_by in frappe.db.sql_list("""select distinct claimed_by from `tabBulk Email`
+		where status='Sending'"""):
+		if (claimed_by or "").split(":")[0] not in running:
+			frappe.db.sql("""update `tabBulk Email` set status='Not Sent', claimed_by=null
+				where status='Sending' and claimed_by=%s""", claimed_by, auto_commit=auto_commit)
+
+def get_flusher_count():
+	return cint(frappe.conf.get("bulk_email_flushers")) or 1
+
+def acquire_flusher_slot():
+	"""Returns `(slot key, flusher id)` if a flusher slot is free, else `(None, None)`.
+
+	Each running flusher holds one of `bulk_email_flushers` slots in redis, set with its id
+	and an expiry of `get_flusher_slot_expiry` seconds that is renewed before every email. If the
+	process dies, the slot expires, and `release_stale_batches` queues its unsent emails again."""
+	cache = frappe.cache()
+	flusher_id = frappe.generate_hash(length=10)
+	try:
+		for i in xrange(get_flusher_count()):
+			key = cache.make_key("bulk_email_flusher:{0}".format(i))
+			if cache.execute_command("SET", key, flusher_id, "NX", "EX", get_flusher_slot_expiry()):
+				return key, flusher_id
+	except redis.exceptions.ConnectionError:
+		# run without a slot
+		return None, flusher_id
+
+	return None, None
+
+def renew_flusher_slot(key, flusher_id):
+	"""Renew the slot of the flusher. Returns False if the slot has expired, in which case the
+	emails claimed by the flusher may already be queued again and it must stop sending."""
+	cache = frappe.cache()
+	try:
+		if cache.execute_command("GET", key) != flusher_id:
+			return False
+
+		cache.execute_command("EXPIRE", key, get_flusher_slot_expiry())
+	except redis.exceptions.ConnectionError:
+		pass
+
+	return True
+
+def get_flusher_slot_expiry():
+	"""Seconds after which the slot of a flusher that stopped renewing it is free again. Since the slot
+	is renewed before every email, it must outlast sending one email: a few SMTP commands (MAIL, RCPT,
+	DATA), each of which can wait up to `smtp_timeout` seconds."""
+	return max(flusher_slot_expiry, 10 * get_smtp_timeout())
+
+def release_flusher_slot(key, flusher_id):
+	cache = frappe.cache()
+	try:
+		if cache.execute_command("GET", key) == flusher_id:
+			cache.execute_command("DEL", key)
+	except redis.exceptions.ConnectionError:
+		pass
+
+def get_running_flushers():
+	"""Returns ids of running flushers, or None if redis cannot be reached"""
+	cache = frappe.cache()
+	try:
+		return [cache.execute_command("GET", key) for key in cache.keys(cache.make_key("bulk_email_flusher:*"))]
+	except redis.exceptions.ConnectionError:
+		return None
+
+def get_batch_size():
+	return cint(frappe.conf.get("bulk_email_batch_size")) or 100
+
+def flush_batches(from_test=False):
+	"""Send queued emails, a batch at a time, up to `bulk_email_flush_limit` (site config, default 500).
+
+	Each batch is claimed with one update (tagged with a random `claimed_by`), so that flushers running
+	in parallel never pick the same email. Emails of a batch are sent over one SMTP session per
+	outgoing Email Account, and their status is written back with one update per outcome."""
+	auto_commit = not from_test
+	batch_size = get_batch_size()
+	limit = cint(frappe.conf.get("bulk_email_flush_limit")) or 500
+
+	if frappe.are_emails_muted():
+		from_test = True
+
+	slot = flusher_id = None
+	if not from_test:
+		slot, flusher_id = acquire_flusher_slot()
+		if not flusher_id:
+			# enough flushers running
+			return
+
+	smtpservers = {}
+	sent_count = 0
+
+	try:
+		while sent_count < limit:
+			if slot and not renew_flusher_slot(slot, flusher_id):
+				break
+
+			batch = claim_batch(min(batch_size, limit - sent_count), auto_commit, flusher_id)
+			if not batch:
+				break
+
+			sent_count += len(batch)
+			if not send_batch(batch, smtpservers, from_test, auto_commit, slot, flusher_id):
+				# bad connection (retry later) or lost slot
+				break
+
+	finally:
+		for smtpserver in smtpservers.values():
+			smtpserver.close()
+
+		if slot:
+			release_flusher_slot(slot, flusher_id)
+
+def claim_batch(batch_size, auto_commit=True, flusher_id=None):
+	"""Mark the next `batch_size` emails as Sending and returns them. `claimed_by` is set
+	to `<flusher id>:<batch id>`."""
+	claimed_by = frappe.generate_hash(length=10)
+	if flusher_id:
+		claimed_by = "{0}:{1}".format(flusher_id, claimed_by)
+
+	frappe.db.sql("""update `tabBulk Email` set status='Sending', claimed_by=%s, modified=%s
+		where status='Not Sent' and ifnull(send_after, "2000-01-01 00:00:00") < %s
+		order by priority desc, creation asc limit {0}""".format(cint(batch_size)),
+		(claimed_by, now_datetime(), now_datetime()), auto_commit=auto_commit)
+
+	return frappe.db.sql("""select * from `tabBulk Email` where claimed_by=%s and status='Sending'
+		order by priority desc, creation asc""", claimed_by, as_dict=1)
+
+def send_batch(batch, smtpservers, from_test=False, auto_commit=True, slot=None, flusher_id=None):
+	"""Send emails of a claimed batch and set their status. Returns False if the connection to the
+	mail server failed, in which case the unsent emails are queued again, or if the flusher slot
+	expired, in which case the unsent emails are left to `release_stale_batches`."""
+	sent, errors, not_sent = [], {}, []
+	bulk_email_messages = {}
+	lost_slot = False
+
+	for i, email in enumerate(batch):
+		if slot and not renew_flusher_slot(slot, flusher_id):
+			lost_slot = True
 			break
 
-		frappe.db.sql("""update `tabBulk Email` set status='Sending' where name=%s""",
-			(email["name"],), auto_commit=auto_commit)
 		try:
 			if not from_test:
-				smtpserver.setup_email_account(email.reference_doctype)
+				message = get_message(email, bulk_email_messages)
+				smtpserver = get_smtp_server(email.reference_doctype, smtpservers)
 				smtpserver.replace_sender_in_email(email)
-				smtpserver.sess.sendmail(email["sender"], email["recipient"], encode(email["message"]))
+				smtpserver.sendmail(email["sender"], email["recipient"], encode(message))
 
-			frappe.db.sql("""update `tabBulk Email` set status='Sent' where name=%s""",
-				(email["name"],), auto_commit=auto_commit)
+			sent.append(email.name)
 
 		except (smtplib.SMTPServerDisconnected,
 				smtplib.SMTPConnectError,
 				smtplib.SMTPHeloError,
 				smtplib.SMTPAuthenticationError):
 
-			# bad connection, retry later
-			frappe.db.sql("""update `tabBulk Email` set status='Not Sent' where name=%s""",
-				(email["name"],), auto_commit=auto_commit)
-
 			# no need to attempt further
-			return
+			not_sent = [d.name for d in batch[i:]]
+			break
 
 		except Exception, e:
-			frappe.db.sql("""update `tabBulk Email` set status='Error', error=%s
-				where name=%s""", (unicode(e), email["name"]), auto_commit=auto_commit)
+			errors.setdefault(unicode(e), []).append(email.name)
 
-		# NOTE: removing commit here because we pass auto_commit
-		# finally:
-		# 	frappe.db.commit()
+	set_status(sent, "Sent", auto_commit=auto_commit)
+	set_status(not_sent, "Not Sent", auto_commit=auto_commit)
+	for error, names in errors.iteritems():
+		set_status(names, "Error", error, auto_commit=auto_commit)
+
+	return not (not_sent or lost_slot)
+
+def get_smtp_server(reference_doctype, smtpservers):
+	"""Returns one SMTPServer per outgoing Email Account, so that emails of a flush share the session
+	(closed, or returned to the session pool, at the end of `flush_batches`)"""
+	email_account = get_outgoing_email_account(raise_exception_not_set=False, append_to=reference_doctype)
+	key = email_account.name if email_account else None
+
+	if key not in smtpservers:
+		smtpservers[key] = SMTPServer(append_to=reference_doctype)
+
+	return smtpservers[key]
+
+def set_status(names, status, error=None, auto_commit=True):
+	if not names:
+		return
+
+	values = [status, error] if status=="Error" else [status]
+
+	frappe.db.sql("""update `tabBulk Email` set status=%s{error}{claimed_by}
+		where name in ({names})""".format(error=", error=%s" if status=="Error" else "",
+			claimed_by=", claimed_by=null" if status=="Not Sent" else "",
+			names=", ".join(["%s"] * len(names))), values + names, auto_commit=auto_commit)
 
 def clear_outbox():
 	"""Remove mails older than 31 days in Outbox. Called daily via scheduler."""
 	frappe.db.sql("""delete from `tabBulk Email` where
 		datediff(now(), creation) > 31""")
+
+	frappe.db.sql("""delete from `tabBulk Email Message` where
+		datediff(now(), creation) > 31
+		and not exists (select name from `tabBulk Email`
+			where `tabBulk Email`.bulk_email_message=`tabBulk Email Message`.name)""")
@@ -15,3 +15,8 @@ def retry_sending(name):
 	if doc and doc.status == "Error":
 		doc.status = "Not Sent"
 		doc.save(ignore_permissions=True)
+
+def on_doctype_update():
+	"""Add index in `tabBulk Email` for the queue and batches claimed by flush"""
+	frappe.db.add_index("Bulk Email", ["status", "send_after", "priority", "creation"])
+	frappe.db.add_index("Bulk Email", ["claimed_by"])
@@ -6,14 +6,17 @@ import frappe
 import imaplib
 import re
 import socket
+import time
+import redis
 from frappe import _
 from frappe.model.document import Document
-from frappe.utils import validate_email_add, cint, get_datetime, DATE_FORMAT, strip, comma_or
+from frappe.utils import validate_email_add, cint, flt, get_datetime, DATE_FORMAT, strip, comma_or, now
 from frappe.utils.user import is_system_user
 from frappe.utils.jinja import render_template
-from frappe.email.smtp import SMTPServer
+from frappe.email.smtp import SMTPServer, smtp_session_pool
 from frappe.email.receive import EmailServer, Email
 from poplib import error_proto
+from email.parser import HeaderParser
 from dateutil.relativedelta import relativedelta
 from datetime import datetime, timedelta
 from frappe.desk.form import assign_to
@@ -73,6 +76,10 @@ class EmailAccount(Document):
 		"""Check there is only one default of each type."""
 		self.there_must_be_only_one_default()
 
+		# sessions of this process with the old settings, idle sessions of other processes
+		# expire after `smtp_session_max_idle` seconds
+		smtp_session_pool.clear(self.name)
+
 	def there_must_be_only_one_default(self):
 		"""If current Email Account is default, un-default all other accounts."""
 		for fn in ("default_incoming", "default_outgoing"):
@@ -108,7 +115,10 @@ class EmailAccount(Document):
 			"use_ssl": self.use_ssl,
 			"username": getattr(self, "login_id", None) or self.email_id,
 			"password": self.password,
-			"use_imap": self.use_imap
+			"use_imap": self.use_imap,
+			"incremental": cint(frappe.conf.incremental_imap),
+			"uidvalidity": self.uidvalidity,
+			"last_uid": self.last_uid
 		}
 
 		if not args.get("host"):
@@ -165,33 +175,238 @@ class EmailAccount(Document):
 		"""Called by scheduler to receive emails from this EMail account using POP3/IMAP."""
 		if self.enable_incoming:
 			if frappe.local.flags.in_test:
-				incoming_mails = test_mails
-			else:
+				self.insert_pulled(test_mails)
+				return
+
+			lock = self.acquire_pull_lock()
+			if not lock:
+				# the last pull of this account is still running
+				return
+
+			try:
+				if self.resume_ingestion():
+					# emails of the last pull are still being inserted
+					return
+
 				email_server = self.get_server(in_receive=True)
 				if not email_server:
 					return
 
-				incoming_mails = email_server.get_messages()
+				incoming_mails = email_server.get_messages() or []
+				self.insert_pulled(incoming_mails, getattr(email_server, "latest_uids", None),
+					email_server.uid_state)
+
+			finally:
+				self.release_pull_lock(lock)
+
+	def insert_pulled(self, incoming_mails, uids=None, uid_state=None):
+		"""Insert pulled emails, split by thread in `email_ingestion_workers` celery tasks if set"""
+		update_ingestion_stats(self.name, fetched=len(incoming_mails))
 
-			exceptions = []
-			for raw in incoming_mails:
-				try:
-					communication = self.insert_communication(raw)
+		workers = cint(frappe.conf.email_ingestion_workers)
+		if workers > 1 and len(incoming_mails) > 1:
+			# threads are not split, so that replies are appended to the right parent
+			groups = split_by_thread(incoming_mails, workers)
+			try:
+				self.queue_ingestion(groups, uid_state)
+			except redis.exceptions.ConnectionError:
+				pass
+			else:
+				from frappe.tasks import insert_communications
+				for group in xrange(1, len(groups)):
+					insert_communications.delay(frappe.local.site, self.name, group)
 
-				except SentEmailInInbox:
-					frappe.db.rollback()
+				self.insert_queued_communications(0)
+				return
 
-				except Exception:
-					frappe.db.rollback()
-					exceptions.append(frappe.get_traceback())
+		self.insert_communications(incoming_mails, uids, uid_state)
 
-				else:
-					frappe.db.commit()
-					attachments = [d.file_name for d in communication._attachments]
-					communication.notify(attachments=attachments, fetched_from_email_account=True)
+	def acquire_pull_lock(self):
+		"""Returns a lock id if no other pull of this Email Account is running, else None.
+
+		The lock is held in redis with an expiry of `email_ingestion_timeout` seconds
+		(default 3600), so that a lost pull does not block the account."""
+		cache = frappe.cache()
+		lock = frappe.generate_hash(length=10)
+		timeout = cint(frappe.conf.email_ingestion_timeout) or 3600
+		try:
+			if cache.execute_command("SET", cache.make_key("email_pull_lock:" + self.name),
+				lock, "NX", "EX", timeout):
+				return lock
+		except redis.exceptions.ConnectionError:
+			# pull without a lock
+			return lock
+
+	def release_pull_lock(self, lock):
+		cache = frappe.cache()
+		key = cache.make_key("email_pull_lock:" + self.name)
+		try:
+			if cache.execute_command("GET", key) == lock:
+				cache.execute_command("DEL", key)
+		except redis.exceptions.ConnectionError:
+			pass
+
+	def set_uid_state(self, uid_state):
+		"""Save `UIDVALIDITY` and the last UID pulled by the incremental IMAP pull"""
+		self.db_set("uidvalidity", uid_state.uidvalidity, update_modified=False)
+		self.db_set("last_uid", uid_state.last_uid, update_modified=False)
+		frappe.db.commit()
+
+		update_ingestion_stats(self.name, backlog=uid_state.backlog)
+
+	def insert_communications(self, incoming_mails, uids=None, uid_state=None):
+		"""Insert a Communication for each raw email and notify participants. Raises the
+		collected tracebacks after all emails are processed.
+
+		If `uids` are given, the UID of each email is saved in the same transaction as its
+		Communication, so that an email is neither skipped nor inserted twice if the pull
+		is interrupted. `uid_state` is saved after all emails are processed."""
+		start = time.time()
+		exceptions = []
+		for i, raw in enumerate(incoming_mails):
+			if uids:
+				self.insert_mail(raw, exceptions, uid_state.uidvalidity, uids[i])
+			else:
+				self.insert_mail(raw, exceptions)
+
+		update_ingestion_stats(self.name, processed=len(incoming_mails), failed=len(exceptions),
+			seconds=time.time() - start)
 
-			if exceptions:
-				raise Exception, frappe.as_json(exceptions)
+		if uid_state:
+			# includes the UIDs of emails skipped by the pull
+			self.set_uid_state(uid_state)
+
+		if exceptions:
+			raise Exception, frappe.as_json(exceptions)
+
+	def insert_mail(self, raw, exceptions, uidvalidity=None, uid=None):
+		"""Insert a Communication for the raw email, commit and notify participants.
+		Tracebacks of failed emails are added to `exceptions`."""
+		communication = None
+		try:
+			communication = self.insert_communication(raw)
+
+		except SentEmailInInbox:
+			frappe.db.rollback()
+
+		except Exception:
+			frappe.db.rollback()
+			exceptions.append(frappe.get_traceback())
+
+		if uid:
+			self.db_set("uidvalidity", uidvalidity, update_modified=False)
+			self.db_set("last_uid", uid, update_modified=False)
+
+		frappe.db.commit()
+
+		if communication:
+			attachments = [d.file_name for d in communication._attachments]
+			communication.notify(attachments=attachments, fetched_from_email_account=True)
+
+	def queue_ingestion(self, groups, uid_state=None):
+		"""Queue groups of raw emails for `insert_queued_communications`, in redis lists
+		without expiry. The UID state of the pull is saved once all groups are inserted."""
+		cache = frappe.cache()
+		key = cache.make_key("email_ingestion:" + self.name)
+
+		pipeline = cache.pipeline()
+		for group, incoming_mails in enumerate(groups):
+			queue = "{0}:{1}".format(key, group)
+			pipeline.delete(queue, queue + ":processing")
+
+			# emails are claimed from the right (RPOPLPUSH), in order
+			pipeline.lpush(queue, *incoming_mails)
+			pipeline.sadd(key + ":pending", group)
+
+		run = {"queued": time.time()}
+		if uid_state:
+			run.update(uid_state)
+		pipeline.hmset(key, run)
+		pipeline.execute()
+
+	def insert_queued_communications(self, group):
+		"""Insert the emails of a group queued by `queue_ingestion`. Each email is claimed by
+		moving it to the processing list of the group (RPOPLPUSH), so that workers never get
+		the same email, and removed after its Communication is committed. Emails of a lost
+		worker are queued again by `resume_ingestion`. Raises the collected tracebacks after
+		all emails are processed."""
+		cache = frappe.cache()
+		key = cache.make_key("email_ingestion:" + self.name)
+		queue = "{0}:{1}".format(key, group)
+		processing = queue + ":processing"
+
+		start = time.time()
+		exceptions = []
+		processed = 0
+		while True:
+			raw = cache.rpoplpush(queue, processing)
+			if raw is None:
+				break
+
+			self.insert_mail(raw, exceptions)
+			cache.execute_command("LREM", processing, 1, raw)
+			processed += 1
+
+		update_ingestion_stats(self.name, processed=processed, failed=len(exceptions),
+			seconds=time.time() - start)
+
+		# the group is done once no other worker is inserting its emails
+		if not cache.llen(processing) and cache.srem(key + ":pending", group) \
+			and not cache.scard(key + ":pending"):
+			self.complete_ingestion()
+
+		if exceptions:
+			raise Exception, frappe.as_json(exceptions)
+
+	def complete_ingestion(self):
+		"""Save the UID state of the queued pull and remove it"""
+		cache = frappe.cache()
+		key = cache.make_key("email_ingestion:" + self.name)
+
+		run = super(redis.Redis, cache).hgetall(key)
+		if run.get("last_uid"):
+			self.set_uid_state(frappe._dict({
+				"uidvalidity": run.get("uidvalidity") or "",
+				"last_uid": cint(run.get("last_uid")),
+				"backlog": cint(run.get("backlog"))
+			}))
+
+		cache.delete(key)
+
+	def resume_ingestion(self):
+		"""Returns True if emails of the last pull are still queued. Groups not inserted
+		within `email_ingestion_timeout` seconds (default 3600) of being queued, for
+		example because the worker was lost, are queued again, along with the emails
+		their workers had claimed."""
+		cache = frappe.cache()
+		key = cache.make_key("email_ingestion:" + self.name)
+		try:
+			run = super(redis.Redis, cache).hgetall(key)
+			if not run:
+				return False
+
+			pending = cache.smembers(key + ":pending")
+		except redis.exceptions.ConnectionError:
+			return False
+
+		if not pending:
+			# the last worker was lost before saving the UID state
+			self.complete_ingestion()
+			return False
+
+		timeout = cint(frappe.conf.email_ingestion_timeout) or 3600
+		if time.time() - flt(run.get("queued")) > timeout:
+			from frappe.tasks import insert_communications
+			super(redis.Redis, cache).hset(key, "queued", time.time())
+			for group in pending:
+				# emails claimed by a lost worker
+				queue = "{0}:{1}".format(key, group)
+				while cache.rpoplpush(queue + ":processing", queue):
+					pass
+
+				insert_communications.delay(frappe.local.site, self.name, cint(group))
+
+		return True
 
 	def insert_communication(self, raw):
 		email = Email(raw)
@@ -358,6 +573,7 @@ class EmailAccount(Document):
 	def on_trash(self):
 		"""Clear communications where email account is linked"""
 		frappe.db.sql("update `tabCommunication` set email_account='' where email_account=%s", self.name)
+		smtp_session_pool.clear(self.name)
 
 	def after_rename(self, old, new, merge=False):
 		frappe.db.set_value("Email Account", new, "email_account_name", new)
@@ -376,6 +592,63 @@ def pull(now=False):
 		else:
 			frappe.tasks.pull_from_email_account.delay(frappe.local.site, email_account.name)
 
+def split_by_thread(incoming_mails, count):
+	"""Split raw emails in upto `count` groups, keeping emails of the same thread
+	(subject without Re: / Fwd:) in the same group and in order"""
+	groups = [[] for i in xrange(count)]
+	for raw in incoming_mails:
+		subject = HeaderParser().parsestr(raw).get("Subject") or ""
+		subject = re.sub(r"^((re|fw|fwd)\s*:\s*)+", "", subject.strip(), flags=re.IGNORECASE).lower()
+		groups[hash(subject) % count].append(raw)
+
+	return [group for group in groups if group]
+
+def update_ingestion_stats(email_account, fetched=0, processed=0, failed=0, seconds=0, backlog=None):
+	"""Add to the pull counters of the Email Account, shared by all workers"""
+	cache = frappe.cache()
+	key = cache.make_key("email_ingestion_stats:" + email_account)
+	try:
+		pipeline = cache.pipeline()
+		for fieldname, value in (("fetched", fetched), ("processed", processed), ("failed", failed)):
+			if value:
+				pipeline.hincrby(key, fieldname, value)
+
+		if seconds:
+			pipeline.hincrbyfloat(key, "seconds", seconds)
+
+		if backlog is not None:
+			pipeline.hset(key, "backlog", backlog)
+
+		if fetched:
+			pipeline.hset(key, "last_pull", now())
+
+		pipeline.execute()
+	except redis.exceptions.ConnectionError:
+		pass
+
+@frappe.whitelist()
+def get_ingestion_stats(email_account):
+	"""Returns counts of emails fetched, processed and failed, the throughput (emails
+	per minute) and the backlog of the incremental IMAP pull"""
+	frappe.only_for("System Manager")
+
+	cache = frappe.cache()
+	try:
+		stats = super(redis.Redis, cache).hgetall(cache.make_key("email_ingestion_stats:" + email_account))
+	except redis.exceptions.ConnectionError:
+		stats = {}
+
+	out = frappe._dict({
+		"fetched": cint(stats.get("fetched")),
+		"processed": cint(stats.get("processed")),
+		"failed": cint(stats.get("failed")),
+		"seconds": flt(stats.get("seconds")),
+		"backlog": cint(stats.get("backlog")),
+		"last_pull": stats.get("last_pull")
+	})
+	out.per_minute = flt(out.processed * 60.0 / out.seconds, 2) if out.seconds else 0
+	return out
+
 def notify_unreplied():
 	"""Sends email notifications if there are unreplied Communications
 		and `notify_if_unreplied` is set as true."""
@@ -2,7 +2,7 @@
 # See license.txt
 
 import frappe, os
-import unittest, email
+import unittest, email, imaplib
 
 test_records = frappe.get_test_records('Email Account')
 
@@ -145,3 +145,158 @@ class TestEmailAccount(unittest.TestCase):
 
 
 
+
+	def test_incremental_imap(self):
+		from frappe.email.receive import EmailServer
+
+		class IMAPMailbox(object):
+			"""Inbox with UIDs 1 to 120, 1 to 100 read. UID 103 is 100 bytes and UID 105 cannot be fetched"""
+			def __init__(self, uidvalidity="1", broken=False):
+				self.uidvalidity, self.fetches, self.broken = uidvalidity, [], broken
+			def select(self, mailbox):
+				return ("OK", ["120"])
+			def response(self, code):
+				return (code, [self.uidvalidity if code=="UIDVALIDITY" else "121"])
+			def uid(self, command, *args):
+				if command=="search":
+					if args[1]=="UNSEEN":
+						return ("OK", [" ".join(str(i) for i in xrange(101, 121))])
+					start = int(args[1].split()[1].split(":")[0])
+					return ("OK", [" ".join(str(i) for i in xrange(start, 121)) or "120"])
+
+				uids = args[0].split(",")
+				if args[1]=="(RFC822.SIZE)":
+					return ("OK", ["{0} (UID {0} RFC822.SIZE {1})".format(uid, 100 if uid=="103" else 7)
+						for uid in uids])
+
+				self.fetches.append(args[0])
+				if self.broken and "105" in uids:
+					raise imaplib.IMAP4.error("FETCH failed")
+
+				data = []
+				for uid in uids:
+					data.extend([("{0} (UID {0} RFC822 {{7}}".format(uid), "mail{0}".format(uid)), ")"])
+				return ("OK", data)
+
+		frappe.local.conf.email_fetch_batch_size = 8
+		frappe.local.conf.email_fetch_limit = 15
+		try:
+			server = EmailServer(frappe._dict({"use_imap": 1, "incremental": 1}))
+			server.imap = IMAPMailbox()
+			server.latest_messages, server.errors = [], False
+			server.total_size, server.max_email_size, server.max_total_size = 0, 0, 0
+
+			# first pull starts from unread messages, in batches
+			server.get_messages_incrementally()
+			self.assertEquals(server.latest_messages, ["mail{0}".format(i) for i in xrange(101, 116)])
+			self.assertEquals(server.latest_uids, range(101, 116))
+			self.assertEquals(len(server.imap.fetches), 2)
+			self.assertEquals(server.uid_state, {"uidvalidity": "1", "last_uid": 115, "backlog": 5})
+
+			# next pull continues after the last UID
+			server.settings.update({"uidvalidity": "1", "last_uid": 115})
+			server.latest_messages = []
+			server.get_messages_incrementally()
+			self.assertEquals(server.latest_messages, ["mail{0}".format(i) for i in xrange(116, 121)])
+			self.assertEquals(server.uid_state.last_uid, 120)
+
+			# nothing new
+			server.settings.last_uid = 120
+			server.latest_messages = []
+			server.get_messages_incrementally()
+			self.assertEquals(server.latest_messages, [])
+			self.assertEquals(server.uid_state.last_uid, 120)
+
+			# mailbox recreated
+			server.imap = IMAPMailbox(uidvalidity="2")
+			server.get_messages_incrementally()
+			self.assertEquals(server.latest_messages[0], "mail101")
+
+			# large mails and mails that cannot be fetched are skipped, but pulled past
+			server.imap = IMAPMailbox(broken=True)
+			server.settings.update({"uidvalidity": "1", "last_uid": 100})
+			server.latest_messages, server.total_size = [], 0
+			server.max_email_size, server.max_total_size = 50, 250
+			server.get_messages_incrementally()
+			self.assertEquals(server.latest_uids, [101, 102, 104] + range(106, 116))
+			self.assertEquals(server.latest_messages, ["mail{0}".format(i) for i in server.latest_uids])
+			self.assertEquals(server.uid_state.last_uid, 115)
+			self.assertTrue(server.errors)
+
+			# total size limit
+			server.max_email_size, server.max_total_size = 50, 30
+			server.total_size = 0
+			server.imap = IMAPMailbox()
+			server.latest_messages = []
+			server.get_messages_incrementally()
+			self.assertEquals(server.latest_uids, [101, 102, 104, 105])
+			self.assertEquals(server.uid_state.last_uid, 105)
+			self.assertEquals(server.uid_state.backlog, 15)
+
+		finally:
+			del frappe.local.conf["email_fetch_batch_size"]
+			del frappe.local.conf["email_fetch_limit"]
+
+	def test_last_uid_saved_with_communication(self):
+		frappe.db.sql("delete from tabCommunication where sender='test_sender@example.com'")
+
+		with open(os.path.join(os.path.dirname(__file__), "test_mails", "incoming-1.raw"), "r") as f:
+			raw = f.read()
+
+		email_account = frappe.get_doc("Email Account", "_Test Email Account 1")
+		uid_state = frappe._dict({"uidvalidity": "1", "last_uid": 12, "backlog": 0})
+
+		# the UID of each mail is committed with its Communication
+		email_account.insert_mail(raw, [], "1", 10)
+		self.assertEquals(frappe.db.get_value("Email Account", email_account.name, "last_uid"), 10)
+		self.assertTrue(frappe.db.get_value("Communication", {"sender": "test_sender@example.com"}))
+
+		# the UIDs of skipped mails are saved once all mails are inserted
+		email_account.insert_communications([raw], [11], uid_state)
+		self.assertEquals(frappe.db.get_value("Email Account", email_account.name, "last_uid"), 12)
+
+	def test_queued_ingestion(self):
+		frappe.db.sql("delete from tabCommunication where sender='test_sender@example.com'")
+
+		with open(os.path.join(os.path.dirname(__file__), "test_mails", "incoming-1.raw"), "r") as f:
+			raw = f.read()
+
+		email_account = frappe.get_doc("Email Account", "_Test Email Account 1")
+		email_account.db_set("last_uid", 0)
+		email_account.queue_ingestion([[raw], [raw]],
+			frappe._dict({"uidvalidity": "1", "last_uid": 20, "backlog": 0}))
+
+		email_account.insert_queued_communications(0)
+		self.assertEquals(frappe.db.get_value("Email Account", email_account.name, "last_uid"), 0)
+		self.assertTrue(email_account.resume_ingestion())
+
+		# the UID state is saved after the last group is inserted
+		email_account.insert_queued_communications(1)
+		self.assertEquals(frappe.db.get_value("Email Account", email_account.name, "last_uid"), 20)
+		self.assertFalse(email_account.resume_ingestion())
+		self.assertEquals(frappe.db.count("Communication", {"sender": "test_sender@example.com"}), 2)
+
+	def test_pull_lock(self):
+		email_account = frappe.get_doc("Email Account", "_Test Email Account 1")
+
+		lock = email_account.acquire_pull_lock()
+		self.assertTrue(lock)
+
+		# another pull of the account is skipped
+		self.assertEquals(email_account.acquire_pull_lock(), None)
+
+		email_account.release_pull_lock(lock)
+		lock = email_account.acquire_pull_lock()
+		self.assertTrue(lock)
+		email_account.release_pull_lock(lock)
+
+	def test_split_by_thread(self):
+		from frappe.email.doctype.email_account.email_account import split_by_thread
+
+		mails = ["Subject: {0}\n\nbody".format(subject)
+			for subject in ("Order", "Invoice", "Re: Order", "RE: Fwd: order", "Quotation")]
+		groups = split_by_thread(mails, 3)
+
+		self.assertEquals(sorted(sum(groups, [])), sorted(mails))
+		group = [g for g in groups if mails[0] in g][0]
+		self.assertEquals([m for m in group if "rder" in m], [mails[0], mails[2], mails[3]])
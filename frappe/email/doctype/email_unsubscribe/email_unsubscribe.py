@@ -6,6 +6,7 @@ from __future__ import unicode_literals
 import frappe
 from frappe.model.document import Document
 from frappe import _
+from frappe.email.bulk import clear_unsubscribe_cache
 
 class EmailUnsubscribe(Document):
 	def validate(self):
@@ -33,7 +34,15 @@ class EmailUnsubscribe(Document):
 					frappe.DuplicateEntryError)
 
 	def on_update(self):
+		self.clear_cache()
+
 		if self.reference_doctype and self.reference_name:
 			doc = frappe.get_doc(self.reference_doctype, self.reference_name)
 			doc.add_comment("Label", _("Left this conversation"), comment_by=self.email)
 
+	def on_trash(self):
+		self.clear_cache()
+
+	def clear_cache(self):
+		clear_unsubscribe_cache(self.reference_doctype, self.reference_name, self.global_unsubscribe)
+
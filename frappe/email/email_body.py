@@ -5,8 +5,10 @@ from __future__ import unicode_literals
 import frappe
 from frappe.utils.pdf import get_pdf
 from frappe.email.smtp import get_outgoing_email_account
-from frappe.utils import get_url, scrub_urls, strip, expand_relative_urls, cint, split_emails, to_markdown, markdown
+from frappe.utils import (get_url, scrub_urls, strip, expand_relative_urls, cint, split_emails, to_markdown,
+	markdown, cstr)
 import email.utils
+import email.message
 
 def get_email(recipients, sender='', msg='', subject='[No Subject]',
 	text_content = None, footer=None, print_html=None, formatted=None, attachments=None,
@@ -28,6 +30,44 @@ def get_email(recipients, sender='', msg='', subject='[No Subject]',
 
 	return emailobj
 
+# placeholders in emails rendered once for many recipients, see `get_email_template`
+template_recipient = "<!--email recipient here-->"
+template_body = "<!--email body here-->"
+
+def get_email_template(recipient, sender='', subject='[No Subject]', formatted=None, attachments=None,
+	reply_to=None, cc=(), message_id=None, in_reply_to=None):
+	"""Returns the email as string with placeholders for the recipient and the body, to be sent to many
+	recipients with `make_email_from_template`, so that headers and attachments are encoded only once.
+
+	`recipient` (any of the recipients) is used to validate the email."""
+	emailobj = get_email(recipient, sender=sender, formatted=formatted, subject=subject,
+		attachments=attachments, reply_to=reply_to, cc=cc)
+
+	if message_id:
+		emailobj.set_message_id(message_id)
+
+	if in_reply_to:
+		emailobj.set_in_reply_to(in_reply_to)
+
+	emailobj.validate()
+	emailobj.recipients = [template_recipient]
+	emailobj.make()
+
+	# the multipart/alternative body is made for each recipient
+	body = email.message.Message()
+	body.set_payload(template_body)
+	emailobj.msg_root.get_payload()[0] = body
+
+	return emailobj.msg_root.as_string()
+
+def make_email_from_template(template, recipient, formatted, text_content=None):
+	"""Returns the email as string from a template made by `get_email_template`"""
+	body = EMail()
+	body.set_html(None, text_content, formatted=formatted)
+
+	return (template.replace(template_recipient, recipient, 1)
+		.replace("\n" + template_body, cstr(body.msg_multipart.as_string()), 1))
+
 class EMail:
 	"""
 	Wrapper on the email module. Email object represents emails to be sent to the client.
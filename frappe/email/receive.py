@@ -2,6 +2,7 @@
 # MIT License. See license.txt
 
 from __future__ import unicode_literals
+import re
 import time
 import _socket, poplib, imaplib
 import frappe
@@ -25,6 +26,7 @@ class EmailServer:
 	def setup(self, args=None):
 		# overrride
 		self.settings = args or frappe._dict()
+		self.uid_state = None
 
 	def check_mails(self):
 		# overrride
@@ -105,18 +107,23 @@ class EmailServer:
 			# track if errors arised
 			self.errors = False
 			self.latest_messages = []
-
-			email_list = self.get_new_mails()
-			num = num_copy = len(email_list)
-
-			# WARNING: Hard coded max no. of messages to be popped
-			if num > 20: num = 20
+			self.latest_uids = []
 
 			# size limits
 			self.total_size = 0
 			self.max_email_size = cint(frappe.local.conf.get("max_email_size"))
 			self.max_total_size = 5 * self.max_email_size
 
+			if cint(self.settings.use_imap) and self.settings.incremental:
+				self.get_messages_incrementally()
+				return self.latest_messages
+
+			email_list = self.get_new_mails()
+			num = num_copy = len(email_list)
+
+			# max no. of messages to be popped
+			num = min(num, cint(frappe.local.conf.get("email_fetch_limit")) or 20)
+
 			for i, message_meta in enumerate(email_list):
 				# do not pull more than NUM emails
 				if (i+1) > num:
@@ -162,6 +169,136 @@ class EmailServer:
 
 		return email_list
 
+	def get_messages_incrementally(self):
+		"""Fetch messages with UIDs after `settings.last_uid`, in batched `UID FETCH` commands.
+
+		Sets `latest_uids` (the UID of each message in `latest_messages`) and `uid_state` (`uidvalidity`, `last_uid`,
+		`backlog`), to be saved by the caller once the messages are inserted. If `UIDVALIDITY` has changed, UIDs are reset
+		and unread messages are pulled, as on the first pull."""
+		self.imap.select("Inbox")
+		uidvalidity = cstr(self.imap.response("UIDVALIDITY")[1][0] or "")
+		uidnext = cint(self.imap.response("UIDNEXT")[1][0])
+
+		last_uid = cint(self.settings.last_uid) if uidvalidity==self.settings.uidvalidity else 0
+		if last_uid:
+			# UID m:* always includes the last message, even if its UID is less than m
+			response, message = self.imap.uid("search", None, "UID {0}:*".format(last_uid + 1))
+		else:
+			response, message = self.imap.uid("search", None, "UNSEEN")
+
+		uids = sorted(uid for uid in (cint(uid) for uid in message[0].split()) if uid > last_uid)
+		limit = cint(frappe.local.conf.get("email_fetch_limit")) or 500
+		batch_size = cint(frappe.local.conf.get("email_fetch_batch_size")) or 50
+
+		if not uids and not last_uid and uidnext:
+			# nothing unread, start after the latest message
+			last_uid = uidnext - 1
+
+		self.latest_uids = []
+		self.uid_state = frappe._dict({
+			"uidvalidity": uidvalidity,
+			"last_uid": last_uid,
+			"backlog": len(uids)
+		})
+
+		for i in xrange(0, min(len(uids), limit), batch_size):
+			batch = uids[i:min(i + batch_size, limit)]
+			try:
+				fetched = self.fetch_batch(batch)
+			except (EmailTimeoutError, LoginLimitExceeded):
+				self.errors = True
+				break
+
+			if fetched:
+				self.uid_state.last_uid = fetched[-1]
+				self.uid_state.backlog -= len(fetched)
+
+			if len(fetched) < len(batch):
+				# total size limit reached
+				break
+
+	def fetch_batch(self, uids):
+		"""Fetch the messages of the UIDs with one `UID FETCH`. Messages larger than `max_email_size` are skipped
+		and the batch is cut short where `max_total_size` is reached. If the batch cannot be fetched, messages are
+		fetched one by one and the ones that fail are skipped. Skipped messages are logged in Scheduler Log.
+
+		Returns the UIDs that were pulled or skipped, the rest are left for the next pull."""
+		pulled, to_fetch = [], []
+		sizes = self.fetch_sizes(uids) if self.max_email_size else {}
+		for uid in uids:
+			size = sizes.get(uid, 0)
+			if self.max_email_size and size >= self.max_email_size:
+				log("receive.get_messages", "Email with UID {0} exceeds the maximum email size ({1} bytes)".format(uid, size))
+				self.errors = True
+				pulled.append(uid)
+				continue
+
+			self.total_size += size
+			if self.max_total_size and self.total_size > self.max_total_size:
+				break
+
+			pulled.append(uid)
+			to_fetch.append(uid)
+
+		try:
+			messages = self.fetch_uids(to_fetch) if to_fetch else {}
+
+		except EmailTimeoutError:
+			raise
+
+		except Exception, e:
+			if self.has_login_limit_exceeded(e):
+				raise LoginLimitExceeded, e
+
+			messages = {}
+			for uid in to_fetch:
+				try:
+					messages.update(self.fetch_uids([uid]))
+				except EmailTimeoutError:
+					raise
+				except Exception, e:
+					if self.has_login_limit_exceeded(e):
+						raise LoginLimitExceeded, e
+
+					# log performs rollback and logs error in scheduler log
+					log("receive.get_messages", "Error in retrieving email with UID {0}.".format(uid))
+					self.errors = True
+
+		for uid in to_fetch:
+			if uid in messages:
+				self.latest_messages.append(messages[uid])
+				self.latest_uids.append(uid)
+
+		return pulled
+
+	def fetch_sizes(self, uids):
+		"""Returns a dict of UID and size of the messages"""
+		response, data = self.imap.uid("fetch", ",".join(str(uid) for uid in uids), "(RFC822.SIZE)")
+		sizes = {}
+		for d in data:
+			d = cstr(d[0] if isinstance(d, tuple) else d)
+			uid, size = re.search(r"UID (\d+)", d), re.search(r"RFC822\.SIZE (\d+)", d)
+			if uid and size:
+				sizes[cint(uid.group(1))] = cint(size.group(1))
+
+		return sizes
+
+	def fetch_uids(self, uids):
+		"""Returns a dict of UID and raw message"""
+		response, data = self.imap.uid("fetch", ",".join(str(uid) for uid in uids), "(RFC822)")
+		if response != "OK":
+			raise imaplib.IMAP4.error(cstr(data))
+
+		# data has a (header, message) tuple and a closing ")" for each message
+		messages = {}
+		for d in data:
+			if isinstance(d, tuple):
+				uid = re.search(r"UID (\d+)", cstr(d[0]))
+				if uid:
+					messages[cint(uid.group(1))] = d[1]
+
+		return messages
+
 	def retrieve_message(self, message_meta, msg_num=None):
 		incoming_mail = None
 		try:
@@ -7,7 +7,11 @@ import frappe
 import smtplib
 import email.utils
 import _socket
-from frappe.utils import cint
+import os
+import time
+import threading
+import hashlib
+from frappe.utils import cint, cstr
 from frappe import _
 
 def send(email, append_to=None):
@@ -20,10 +24,11 @@ def send(email, append_to=None):
 		frappe.msgprint(_("Emails are muted"))
 		return
 
+	smtpserver = None
 	try:
 		smtpserver = SMTPServer(append_to=append_to)
 		smtpserver.replace_sender_in_email(email)
-		smtpserver.sess.sendmail(email.sender, email.recipients + (email.cc or []),
+		smtpserver.sendmail(email.sender, email.recipients + (email.cc or []),
 			email.as_string())
 
 	except smtplib.SMTPSenderRefused:
@@ -33,6 +38,10 @@ def send(email, append_to=None):
 		frappe.msgprint(_("Invalid recipient address"))
 		raise
 
+	finally:
+		if smtpserver:
+			smtpserver.close()
+
 def get_outgoing_email_account(raise_exception_not_set=True, append_to=None):
 	"""Returns outgoing email account based on `append_to` or the default
 		outgoing account. If default outgoing account is not found, it will
@@ -132,12 +141,50 @@ class SMTPServer:
 				email.reply_to = email.sender
 			email.sender = self.login
 
+	def sendmail(self, sender, recipients, msg):
+		"""Send over the session, reconnecting once if the server has closed a reused session"""
+		try:
+			self.sess.sendmail(sender, recipients, msg)
+		except smtplib.SMTPServerDisconnected:
+			smtp_session_pool.close(self._sess)
+			self._sess = None
+			self.sess.sendmail(sender, recipients, msg)
+
+	def close(self):
+		"""Return the session to the process' session pool if `smtp_session_pool` is set
+		in site config, else quit"""
+		if not self._sess:
+			return
+
+		if frappe.conf.smtp_session_pool and self.email_account:
+			smtp_session_pool.put(self.get_pool_key(), self._sess,
+				size=frappe.conf.smtp_session_pool_size or 5)
+		else:
+			smtp_session_pool.close(self._sess)
+
+		self._sess = None
+
+	def get_pool_key(self):
+		"""Sessions are pooled per site and Email Account. A digest of the password is part
+		of the key, so that changed credentials get new sessions."""
+		port = cint(self.port) or (587 if cint(self.use_ssl) else 25)
+		password = hashlib.sha1(cstr(self.password).encode("utf-8")).hexdigest()
+		return (frappe.local.site, self.server, port, self.login, cint(self.use_ssl), password,
+			self.email_account.name)
+
 	@property
 	def sess(self):
 		"""get session"""
 		if self._sess:
 			return self._sess
 
+		# sessions of explicitly set servers (like when validating an Email Account) are not reused
+		if frappe.conf.smtp_session_pool and self.email_account and self.server:
+			self._sess = smtp_session_pool.get(self.get_pool_key(),
+				max_idle=frappe.conf.smtp_session_max_idle or 60)
+			if self._sess:
+				return self._sess
+
 		# check if email server specified
 		if not getattr(self, 'server'):
 			err_msg = _('Email Account not setup. Please create a new Email Account from Setup > Email > Email Account')
@@ -149,7 +196,7 @@ class SMTPServer:
 				self.port = 587
 
 			self._sess = smtplib.SMTP((self.server or "").encode('utf-8'),
-				cint(self.port) or None)
+				cint(self.port) or None, timeout=get_smtp_timeout())
 
 			if not self._sess:
 				err_msg = _('Could not connect to outgoing email server')
@@ -181,3 +228,75 @@ class SMTPServer:
 			frappe.msgprint(_('Unable to send emails at this time'))
 			raise
 
+def get_smtp_timeout():
+	"""Seconds to wait for the mail server on each command (`smtp_timeout` in site config, default 60)"""
+	return cint(frappe.conf.get("smtp_timeout")) or 60
+
+class SMTPSessionPool(object):
+	"""Per process pool of idle, logged in SMTP sessions, keyed by site, server, login and Email Account.
+
+	Sessions are checked with `NOOP` when taken out and closed if they have been idle for more than
+	`max_idle` seconds (servers drop idle sessions after a few minutes)."""
+	def __init__(self):
+		self.pid = os.getpid()
+		self.idle = {}
+		self.lock = threading.Lock()
+
+	def get(self, key, max_idle=60):
+		"""Returns a healthy idle session for key or None."""
+		with self.lock:
+			self.check_pid()
+			sessions = self.idle.get(key) or []
+
+			while sessions:
+				sess, idle_since = sessions.pop()
+
+				if time.time() - idle_since > max_idle:
+					self.close(sess)
+					continue
+
+				try:
+					if sess.noop()[0]!=250:
+						raise smtplib.SMTPException
+				except (smtplib.SMTPException, _socket.error):
+					self.close(sess)
+					continue
+
+				return sess
+
+	def put(self, key, sess, size=5):
+		"""Add session to the pool. Quits it if the pool for key is full."""
+		with self.lock:
+			self.check_pid()
+			sessions = self.idle.setdefault(key, [])
+			if len(sessions) < size:
+				sessions.append((sess, time.time()))
+			else:
+				self.close(sess)
+
+	def clear(self, email_account=None):
+		"""Quit idle sessions of the Email Account of the current site, or all idle sessions."""
+		with self.lock:
+			for key in self.idle.keys():
+				if email_account and (key[0]!=frappe.local.site or key[-1]!=email_account):
+					continue
+
+				for sess, idle_since in self.idle.pop(key):
+					self.close(sess)
+
+	def check_pid(self):
+		# sessions inherited from a parent process (after fork) must not be shared
+		if self.pid != os.getpid():
+			self.pid = os.getpid()
+			self.idle = {}
+
+	def close(self, sess):
+		try:
+			sess.quit()
+		except (smtplib.SMTPException, _socket.error):
+			try:
+				sess.close()
+			except _socket.error:
+				pass
+
+smtp_session_pool = SMTPSessionPool()
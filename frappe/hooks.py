@@ -88,7 +88,10 @@ standard_queries = {
 doc_events = {
 	"*": {
 		"after_insert": "frappe.email.doctype.email_alert.email_alert.trigger_email_alerts",
-		"validate": "frappe.email.doctype.email_alert.email_alert.trigger_email_alerts",
+		"validate": [
+			"frappe.desk.notifications.set_notification_match",
+			"frappe.email.doctype.email_alert.email_alert.trigger_email_alerts"
+		],
 		"on_update": [
 			"frappe.desk.notifications.clear_doctype_notifications",
 			"frappe.email.doctype.email_alert.email_alert.trigger_email_alerts",
@@ -98,10 +101,13 @@ doc_events = {
 		"on_submit": [
 			"frappe.email.doctype.email_alert.email_alert.trigger_email_alerts",
 		],
+		"before_cancel": "frappe.desk.notifications.set_notification_match",
 		"on_cancel": [
 			"frappe.desk.notifications.clear_doctype_notifications",
 			"frappe.email.doctype.email_alert.email_alert.trigger_email_alerts"
 		],
+		"before_update_after_submit": "frappe.desk.notifications.set_notification_match",
+		"on_update_after_submit": "frappe.desk.notifications.clear_doctype_notifications",
 		"on_trash": "frappe.desk.notifications.clear_doctype_notifications"
 	}
 }
@@ -113,6 +119,9 @@ scheduler_events = {
 		"frappe.email.doctype.email_account.email_account.notify_unreplied",
 		"frappe.utils.error.collect_error_snapshots",
 	],
+	"hourly": [
+		"frappe.desk.notifications.reconcile_notification_counts"
+	],
 	"daily": [
 		"frappe.email.bulk.clear_outbox",
 		"frappe.desk.notifications.clear_notifications",
@@ -15,6 +15,7 @@ integer_docfield_properties = ("reqd", "search_index", "in_list_view", "permleve
 	"hidden", "read_only", "ignore_user_permissions", "allow_on_submit", "report_hide",
 	"in_filter", "no_copy", "print_hide", "unique")
 optional_fields = ("_user_tags", "_comments", "_assign", "_liked_by")
+large_text_fieldtypes = ('Long Text', 'Code', 'Text Editor')
 
 def rename(doctype, old, new, debug=False):
 	import frappe.model.rename_doc
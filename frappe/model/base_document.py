@@ -344,6 +344,11 @@ class BaseDocument(object):
 		frappe.db.set_value(self.doctype, self.name, fieldname, value,
 			self.modified, self.modified_by, update_modified=update_modified)
 
+		if self.get("parent"):
+			frappe.clear_document_cache(self.parenttype, self.parent)
+		else:
+			frappe.clear_document_cache(self.doctype, self.name)
+
 	def _fix_numeric_types(self):
 		for df in self.meta.get("fields"):
 			if df.fieldtype == "Check":
@@ -386,19 +391,12 @@ class BaseDocument(object):
 
 		return missing
 
-	def get_invalid_links(self, is_submittable=False):
-		def get_msg(df, docname):
-			if self.parentfield:
-				return "{} #{}: {}: {}".format(_("Row"), self.idx, _(df.label), docname)
-			else:
-				return "{}: {}".format(_(df.label), docname)
-
-		invalid_links = []
-		cancelled_links = []
+	def get_links(self):
+		"""Returns list of (docfield, doctype, docname) for Link and Dynamic Link fields that are set."""
+		links = []
 		for df in self.meta.get_link_fields() + self.meta.get("fields",
 			{"fieldtype":"Dynamic Link"}):
 
-
 			docname = self.get(df.fieldname)
 			if docname:
 				if df.fieldtype=="Link":
@@ -410,18 +408,42 @@ class BaseDocument(object):
 					if not doctype:
 						frappe.throw(_("{0} must be set first").format(self.meta.get_label(df.options)))
 
-				# MySQL is case insensitive. Preserve case of the original docname in the Link Field.
-				value = frappe.db.get_value(doctype, docname, "name", cache=True)
-				setattr(self, df.fieldname, value)
+				links.append((df, doctype, docname))
 
-				if not value:
-					invalid_links.append((df.fieldname, docname, get_msg(df, docname)))
+		return links
 
-				elif (df.fieldname != "amended_from"
-					and (is_submittable or self.meta.is_submittable) and frappe.get_meta(doctype).is_submittable
-					and cint(frappe.db.get_value(doctype, docname, "docstatus"))==2):
+	def get_invalid_links(self, is_submittable=False, link_values=None):
+		"""Returns (invalid_links, cancelled_links) for Link and Dynamic Link fields.
 
-					cancelled_links.append((df.fieldname, docname, get_msg(df, docname)))
+		:param is_submittable: Check for cancelled links even if this DocType is not submittable (child rows).
+		:param link_values: Values returned by `get_link_values` for the links of the whole
+			document, so that they are validated with one query per linked DocType."""
+		def get_msg(df, docname):
+			if self.parentfield:
+				return "{} #{}: {}: {}".format(_("Row"), self.idx, _(df.label), docname)
+			else:
+				return "{}: {}".format(_(df.label), docname)
+
+		links = self.get_links()
+		if link_values is None:
+			link_values = get_link_values(links)
+
+		invalid_links = []
+		cancelled_links = []
+		for df, doctype, docname in links:
+			# MySQL is case insensitive. Preserve case of the original docname in the Link Field.
+			value, docstatus = link_values.get((doctype, cstr(docname).lower())) \
+				or get_link_value(doctype, docname)
+			setattr(self, df.fieldname, value)
+
+			if not value:
+				invalid_links.append((df.fieldname, docname, get_msg(df, docname)))
+
+			elif (df.fieldname != "amended_from"
+				and (is_submittable or self.meta.is_submittable) and frappe.get_meta(doctype).is_submittable
+				and cint(docstatus)==2):
+
+				cancelled_links.append((df.fieldname, docname, get_msg(df, docname)))
 
 		return invalid_links, cancelled_links
 
@@ -689,6 +711,44 @@ class BaseDocument(object):
 			for df in self.meta.get("fields", {"fieldtype":"Text Editor"}):
 				extract_images_from_doc(self, df.fieldname)
 
+def get_link_values(links):
+	"""Returns `{(doctype, lower-cased name): (name, docstatus)}` for the given list of
+	(docfield, doctype, docname), with one `name in (...)` query per linked DocType.
+	Names that are not found are not in the result."""
+	names_by_doctype = {}
+	for df, doctype, docname in links:
+		names_by_doctype.setdefault(doctype, set()).add(docname)
+
+	values = {}
+	for doctype, names in names_by_doctype.iteritems():
+		if frappe.db.get_value("DocType", doctype, "issingle"):
+			continue
+
+		names = list(names)
+		try:
+			result = frappe.db.sql("""select name, docstatus from `tab{0}`
+				where name in ({1})""".format(doctype, ", ".join(["%s"] * len(names))), names)
+		except Exception, e:
+			if e.args[0]==1146:
+				# table not found, the links are invalid
+				continue
+			else:
+				raise
+
+		for name, docstatus in result:
+			values[(doctype, cstr(name).lower())] = (name, docstatus)
+
+	return values
+
+def get_link_value(doctype, docname):
+	"""Returns (name, docstatus) of a single link, used for links not resolved by `get_link_values`
+	(single DocTypes and names that only match with the database collation)."""
+	value = frappe.db.get_value(doctype, docname, "name", cache=True)
+	if not value or frappe.db.get_value("DocType", doctype, "issingle"):
+		return value, None
+
+	return value, frappe.db.get_value(doctype, docname, "docstatus")
+
 def _filter(data, filters, limit=None):
 	"""pass filters as:
 		{"key": "val", "key": ["!=", "val"],
@@ -4,13 +4,17 @@
 from __future__ import unicode_literals
 """build query for doclistview and return results"""
 
-import frappe, json
+import frappe, json, re, base64
 import frappe.defaults
 import frappe.share
 import frappe.permissions
 from frappe.utils import flt, cint, getdate, get_datetime, get_time
 from frappe import _
 from frappe.model import optional_fields
+from collections import OrderedDict
+
+# `tabDocType`.`column` asc
+sort_key_pattern = re.compile(r"^(?:(`tab[^`]+`|tab\w+)\.)?`?(\w+)`?(?:\s+(asc|desc))?$", re.I)
 
 class DatabaseQuery(object):
 	def __init__(self, doctype):
@@ -21,11 +25,18 @@ class DatabaseQuery(object):
 		self.fields = ["`tab{0}`.`name`".format(doctype)]
 		self.user = None
 		self.flags = frappe._dict()
+		self.cursor = None
+		self.next_cursor = None
 
 	def execute(self, query=None, fields=None, filters=None, or_filters=None,
 		docstatus=None, group_by=None, order_by=None, limit_start=False,
 		limit_page_length=None, as_list=False, with_childnames=False, debug=False,
-		ignore_permissions=False, user=None, with_comment_count=False):
+		ignore_permissions=False, user=None, with_comment_count=False, iterate=False, cursor=None):
+		"""Build and run the list query. Returns list of dicts (or lists if `as_list`).
+
+		If `cursor` is not None, rows are paged by the sort keys (keyset pagination) instead of
+		`limit_start`: pass `""` for the first page and `self.next_cursor` for the next pages.
+		`next_cursor` is None after the last page."""
 		if not ignore_permissions and not frappe.has_permission(self.doctype, "read", user=user):
 			raise frappe.PermissionError, self.doctype
 
@@ -41,6 +52,8 @@ class DatabaseQuery(object):
 		self.with_childnames = with_childnames
 		self.debug = debug
 		self.as_list = as_list
+		self.iterate = iterate
+		self.cursor = cursor
 		self.flags.ignore_permissions = ignore_permissions
 		self.user = user or frappe.session.user
 
@@ -49,7 +62,7 @@ class DatabaseQuery(object):
 		else:
 			result = self.build_and_run()
 
-		if with_comment_count and not as_list and self.doctype:
+		if with_comment_count and not as_list and not iterate and self.doctype:
 			self.add_comment_count(result)
 
 		return result
@@ -58,26 +71,35 @@ class DatabaseQuery(object):
 		args = self.prepare_args()
 		args.limit = self.add_limit()
 
+		if self.cursor is not None:
+			sort_keys = self.add_cursor_condition(args)
+
 		if args.conditions:
 			args.conditions = "where " + args.conditions
 
 		query = """select %(fields)s from %(tables)s %(conditions)s
 			%(group_by)s %(order_by)s %(limit)s""" % args
 
-		return frappe.db.sql(query, as_dict=not self.as_list, debug=self.debug)
+		result = frappe.db.sql(query, as_dict=not self.as_list, debug=self.debug, iterate=self.iterate)
+
+		if self.cursor is not None:
+			result = self.set_next_cursor(result, sort_keys)
+
+		return result
 
 	def prepare_args(self):
 		self.parse_args()
-		self.extract_tables()
-		self.remove_user_tags()
-		self.build_conditions()
+		query_shape = self.get_query_shape()
 
-		args = frappe._dict()
+		self.tables = list(query_shape.tables)
+		self.fields = list(query_shape.fields)
+		if not self.flags.ignore_permissions:
+			for tname in self.tables[1:]:
+				self.check_table_permission(tname)
 
-		if self.with_childnames:
-			for t in self.tables:
-				if t != "`tab" + self.doctype + "`":
-					self.fields.append(t + ".name as '%s:name'" % t[4:-1])
+		self.build_conditions(query_shape)
+
+		args = frappe._dict()
 
 		# query dict
 		args.tables = self.tables[0]
@@ -96,14 +118,74 @@ class DatabaseQuery(object):
 				 ' or '.join(self.or_conditions)
 
 		args.fields = ', '.join(self.fields)
+		args.order_by = query_shape.order_by
+		args.group_by = query_shape.group_by
 
-		self.set_order_by(args)
-		self.check_sort_by_table(args.order_by)
-		args.order_by = args.order_by and (" order by " + args.order_by) or ""
+		return args
 
-		args.group_by = self.group_by and (" group by " + self.group_by) or ""
+	def get_query_shape(self):
+		"""Returns the query compiled for the fields, the shape of the filters (without values), order by
+		and group by: tables, fields, filter conditions to be bound to values and the order by clause.
 
-		return args
+		Scheduler jobs and API clients run the same list queries again and again, so the shapes are cached
+		on the DocType's `Meta` (cleared with it). Permissions and values are applied for every query.
+
+		Queries with string (SQL) filters, or with literals in fields, order by or group by, are not cached,
+		since their values are part of the query, like the search conditions and relevance of `search_widget`.
+		The least recently used shape is evicted when 500 shapes are cached."""
+		if any(isinstance(f, basestring) for f in list(self.filters) + list(self.or_filters)) \
+			or any(has_literal(f) for f in list(self.fields) + [self.order_by, self.group_by]):
+			return self.make_query_shape()
+
+		filters_shape = [self.get_filter_key(f) for f in self.filters]
+		or_filters_shape = [self.get_filter_key(f) for f in self.or_filters]
+
+		key = json.dumps([self.fields, filters_shape, or_filters_shape, self.group_by, self.order_by,
+			self.with_childnames])
+
+		query_shapes = frappe.get_meta(self.doctype).__dict__.setdefault("_query_shapes", OrderedDict())
+		query_shape = query_shapes.pop(key, None)
+		if not query_shape:
+			if len(query_shapes) >= 500:
+				query_shapes.popitem(last=False)
+			query_shape = self.make_query_shape()
+
+		# most recently used last
+		query_shapes[key] = query_shape
+
+		return query_shape
+
+	def get_filter_key(self, f):
+		f = self.get_filter(f)
+		return [f.doctype, f.fieldname, f.operator]
+
+	def make_query_shape(self):
+		filters, or_filters = list(self.filters), list(self.or_filters)
+
+		self.extract_tables()
+		self.remove_user_tags()
+
+		query_shape = frappe._dict()
+
+		# filters removed by `remove_user_tags` are None
+		query_shape.filters = [(self.get_condition_shape(f) if f in self.filters else None) for f in filters]
+		query_shape.or_filters = [self.get_condition_shape(f) for f in or_filters]
+
+		if self.with_childnames:
+			for t in self.tables:
+				if t != "`tab" + self.doctype + "`":
+					self.fields.append(t + ".name as '%s:name'" % t[4:-1])
+
+		query_shape.tables = list(self.tables)
+		query_shape.fields = list(self.fields)
+
+		self.set_order_by(query_shape)
+		self.check_sort_by_table(query_shape.order_by)
+		query_shape.order_by = query_shape.order_by and (" order by " + query_shape.order_by) or ""
+
+		query_shape.group_by = self.group_by and (" group by " + self.group_by) or ""
+
+		return query_shape
 
 	def parse_args(self):
 		"""Convert fields and filters from strings to list, dicts"""
@@ -156,8 +238,12 @@ class DatabaseQuery(object):
 
 	def append_table(self, table_name):
 		self.tables.append(table_name)
+		if not self.flags.ignore_permissions:
+			self.check_table_permission(table_name)
+
+	def check_table_permission(self, table_name):
 		doctype = table_name[4:-1]
-		if (not self.flags.ignore_permissions) and (not frappe.has_permission(doctype)):
+		if not frappe.has_permission(doctype):
 			raise frappe.PermissionError, doctype
 
 	def remove_user_tags(self):
@@ -190,11 +276,11 @@ class DatabaseQuery(object):
 			else:
 				self.filters.remove(each)
 
-	def build_conditions(self):
+	def build_conditions(self, query_shape):
 		self.conditions = []
 		self.grouped_or_conditions = []
-		self.build_filter_conditions(self.filters, self.conditions)
-		self.build_filter_conditions(self.or_filters, self.grouped_or_conditions)
+		self.build_filter_conditions(self.filters, query_shape.filters, self.conditions)
+		self.build_filter_conditions(self.or_filters, query_shape.or_filters, self.grouped_or_conditions)
 
 		# match conditions
 		if not self.flags.ignore_permissions:
@@ -202,16 +288,22 @@ class DatabaseQuery(object):
 			if match_conditions:
 				self.conditions.append("(" + match_conditions + ")")
 
-	def build_filter_conditions(self, filters, conditions):
-		"""build conditions from user filters"""
-		if isinstance(filters, dict):
-			filters = [filters]
+	def build_filter_conditions(self, filters, shapes, conditions):
+		"""build conditions from user filters, bound to their compiled shapes"""
+		for f, shape in zip(filters, shapes):
+			if shape is None:
+				continue
+
+			elif isinstance(shape, basestring):
+				conditions.append(shape)
 
-		for f in filters:
-			if isinstance(f, basestring):
-				conditions.append(f)
 			else:
-				conditions.append(self.prepare_filter_condition(f))
+				conditions.append(self.make_filter_condition(shape, self.get_filter(f).value))
+
+	def get_condition_shape(self, f):
+		if isinstance(f, basestring):
+			return f
+		return self.get_filter_shape(self.get_filter(f))
 
 	def prepare_filter_condition(self, f):
 		"""Returns a filter condition in the format:
@@ -220,14 +312,29 @@ class DatabaseQuery(object):
 		"""
 
 		f = self.get_filter(f)
+		return self.make_filter_condition(self.get_filter_shape(f), f.value)
 
+	def get_filter_shape(self, f):
+		"""Returns the part of the filter condition that does not depend on the value:
+		table, fieldname, operator and fieldtype"""
 		tname = ('`tab' + f.doctype + '`')
 		if not tname in self.tables:
 			self.append_table(tname)
 
+		fieldtype = None
+		if f.operator not in ('in', 'not in'):
+			df = frappe.get_meta(f.doctype).get("fields", {"fieldname": f.fieldname})
+			fieldtype = df[0].fieldtype if df else None
+
+		return frappe._dict({"tname": tname, "fieldname": f.fieldname, "operator": f.operator,
+			"fieldtype": fieldtype})
+
+	def make_filter_condition(self, shape, value):
+		tname, operator, fieldtype = shape.tname, shape.operator, shape.fieldtype
+
 		# prepare in condition
-		if f.operator in ('in', 'not in'):
-			values = f.value
+		if operator in ('in', 'not in'):
+			values = value
 			if not isinstance(values, (list, tuple)):
 				values = values.split(",")
 
@@ -235,35 +342,32 @@ class DatabaseQuery(object):
 			values = '("{0}")'.format('", "'.join(values))
 
 			condition = 'ifnull({tname}.{fname}, "") {operator} {value}'.format(
-				tname=tname, fname=f.fieldname, operator=f.operator, value=values)
+				tname=tname, fname=shape.fieldname, operator=operator, value=values)
 
 		else:
-			df = frappe.get_meta(f.doctype).get("fields", {"fieldname": f.fieldname})
-			df = df[0] if df else None
-
-			if df and df.fieldtype=="Date":
-				value = getdate(f.value).strftime("%Y-%m-%d")
+			if fieldtype=="Date":
+				value = getdate(value).strftime("%Y-%m-%d")
 				fallback = "'0000-00-00'"
 
-			elif df and df.fieldtype=="Datetime":
-				value = get_datetime(f.value).strftime("%Y-%m-%d %H:%M:%S.%f")
+			elif fieldtype=="Datetime":
+				value = get_datetime(value).strftime("%Y-%m-%d %H:%M:%S.%f")
 				fallback = "'0000-00-00 00:00:00'"
 
-			elif df and df.fieldtype=="Time":
-				value = get_time(f.value).strftime("%H:%M:%S.%f")
+			elif fieldtype=="Time":
+				value = get_time(value).strftime("%H:%M:%S.%f")
 				fallback = "'00:00:00'"
 
-			elif f.operator in ("like", "not like") or (isinstance(f.value, basestring) and
-				(not df or df.fieldtype not in ["Float", "Int", "Currency", "Percent", "Check"])):
-					value = "" if f.value==None else f.value
+			elif operator in ("like", "not like") or (isinstance(value, basestring) and
+				(not fieldtype or fieldtype not in ["Float", "Int", "Currency", "Percent", "Check"])):
+					value = "" if value==None else value
 					fallback = '""'
 
-					if f.operator in ("like", "not like") and isinstance(value, basestring):
+					if operator in ("like", "not like") and isinstance(value, basestring):
 						# because "like" uses backslash (\) for escaping
 						value = value.replace("\\", "\\\\").replace("%", "%%")
 
 			else:
-				value = flt(f.value)
+				value = flt(value)
 				fallback = 0
 
 			# put it inside double quotes
@@ -271,7 +375,7 @@ class DatabaseQuery(object):
 				value = '"{0}"'.format(frappe.db.escape(value, percent=False))
 
 			condition = 'ifnull({tname}.{fname}, {fallback}) {operator} {value}'.format(
-				tname=tname, fname=f.fieldname, fallback=fallback, operator=f.operator,
+				tname=tname, fname=shape.fieldname, fallback=fallback, operator=operator,
 				value=value)
 
 		return condition
@@ -368,6 +472,13 @@ class DatabaseQuery(object):
 			return self.match_filters
 
 	def get_share_condition(self):
+		if use_subquery(len(self.shared)):
+			# match with DocShare in the query instead of listing thousands of names
+			return """`tab{doctype}`.name in (select share_name from tabDocShare
+				where (user='{user}' {everyone}) and share_doctype='{doctype}' and `read`=1)""".format(
+					doctype=self.doctype, user=frappe.db.escape(self.user, percent=False),
+					everyone="or everyone=1" if self.user!="Guest" else "")
+
 		return """`tab{0}`.name in ({1})""".format(self.doctype, ", ".join(["'%s'"] * len(self.shared))) % \
 			tuple([frappe.db.escape(s, percent=False) for s in self.shared])
 
@@ -383,7 +494,10 @@ class DatabaseQuery(object):
 				user_permission_values = user_permissions.get(df.options, [])
 
 				condition = 'ifnull(`tab{doctype}`.`{fieldname}`, "")=""'.format(doctype=self.doctype, fieldname=df.fieldname)
-				if user_permission_values:
+				if use_subquery(len(user_permission_values)):
+					condition += " or " + self.get_user_permission_subquery(df)
+
+				elif user_permission_values:
 					condition += """ or `tab{doctype}`.`{fieldname}` in ({values})""".format(
 						doctype=self.doctype, fieldname=df.fieldname,
 						values=", ".join([('"'+frappe.db.escape(v, percent=False)+'"') for v in user_permission_values])
@@ -398,6 +512,22 @@ class DatabaseQuery(object):
 			if match_filters:
 				self.match_filters.append(match_filters)
 
+	def get_user_permission_subquery(self, df):
+		"""Returns condition that matches the link field with the user's User Permissions in
+		`tabDefaultValue`, same as the `in (...)` list built from `get_user_permissions`."""
+		condition = """exists (select defvalue from tabDefaultValue
+			where parent='{user}' and parenttype='User Permission' and defkey='{options}'
+			and defvalue=`tab{doctype}`.`{fieldname}`)""".format(doctype=self.doctype, fieldname=df.fieldname,
+				user=frappe.db.escape(self.user, percent=False), options=frappe.db.escape(df.options, percent=False))
+
+		if df.options=="User":
+			# the user is always allowed, see `frappe.defaults.build_user_permissions`
+			condition = """({condition} or `tab{doctype}`.`{fieldname}`='{user}')""".format(
+				condition=condition, doctype=self.doctype, fieldname=df.fieldname,
+				user=frappe.db.escape(self.user, percent=False))
+
+		return condition
+
 	def get_permission_query_conditions(self):
 		condition_methods = frappe.get_hooks("permission_query_conditions", {}).get(self.doctype, [])
 		if condition_methods:
@@ -412,7 +542,7 @@ class DatabaseQuery(object):
 	def run_custom_query(self, query):
 		if '%(key)s' in query:
 			query = query.replace('%(key)s', 'name')
-		return frappe.db.sql(query, as_dict = (not self.as_list))
+		return frappe.db.sql(query, as_dict = (not self.as_list), iterate=self.iterate)
 
 	def set_order_by(self, args):
 		meta = frappe.get_meta(self.doctype)
@@ -450,33 +580,146 @@ class DatabaseQuery(object):
 
 	def add_limit(self):
 		if self.limit_page_length:
+			if self.cursor is not None:
+				return 'limit %s' % self.limit_page_length
 			return 'limit %s, %s' % (self.limit_start, self.limit_page_length)
 		else:
 			return ''
 
+	def get_sort_keys(self, order_by):
+		"""Returns list of (column, descending) from the order by clause, with `name` added
+		as the tie breaker. Only columns of the main table can be used with a cursor."""
+		sort_keys = []
+		for part in order_by.split(","):
+			match = sort_key_pattern.match(part.strip())
+			if not match or (match.group(1) and match.group(1).strip("`") != "tab" + self.doctype):
+				frappe.throw(_("Cannot page by cursor when sorting by {0}").format(part.strip()))
+
+			sort_keys.append((match.group(2), (match.group(3) or "asc").lower()=="desc"))
+
+		if "name" not in [column for column, descending in sort_keys]:
+			sort_keys.append(("name", sort_keys[-1][1] if sort_keys else False))
+
+		return sort_keys
+
+	def add_cursor_condition(self, args):
+		"""Add condition to select rows after the cursor, and the sort keys as fields (removed
+		from the result in `set_next_cursor`). Returns the list of sort keys."""
+		if self.group_by:
+			frappe.throw(_("Cannot page by cursor with group by"))
+
+		sort_keys = self.get_sort_keys(args.order_by.replace(" order by ", "", 1).strip())
+
+		columns = ["`tab{0}`.`{1}`".format(self.doctype, column) for column, descending in sort_keys]
+		args.order_by = " order by " + ", ".join("{0} {1}".format(column, "desc" if descending else "asc")
+			for column, (c, descending) in zip(columns, sort_keys))
+		args.fields += "".join(", {0} as `_cursor_{1}`".format(column, i) for i, column in enumerate(columns))
+
+		if self.cursor:
+			values = self.decode_cursor(len(sort_keys))
+
+			# (a after x) or (a = x and b after y) or (a = x and b = y and name after z)
+			or_conditions = []
+			for i, ((column, descending), value) in enumerate(zip(sort_keys, values)):
+				equal = [get_equal_condition(columns[j], values[j]) for j in xrange(i)]
+				or_conditions.append(" and ".join(equal + [get_after_condition(columns[i], value, descending)]))
+
+			condition = "(" + ") or (".join(or_conditions) + ")"
+			args.conditions = "({0}) and ({1})".format(args.conditions, condition) if args.conditions \
+				else condition
+
+		return sort_keys
+
+	def decode_cursor(self, length):
+		try:
+			values = json.loads(base64.urlsafe_b64decode(str(self.cursor)))
+		except (TypeError, ValueError):
+			values = None
+
+		if not isinstance(values, list) or len(values)!=length:
+			frappe.throw(_("Invalid cursor"))
+
+		return values
+
+	def set_next_cursor(self, result, sort_keys):
+		"""Set `next_cursor` from the last row, if the page is full. Returns the result without
+		the sort key fields."""
+		keys = ["_cursor_{0}".format(i) for i in xrange(len(sort_keys))]
+
+		values = None
+		if self.as_list:
+			if result:
+				values = result[-1][-len(keys):]
+			result = [row[:-len(keys)] for row in result]
+		else:
+			for row in result:
+				values = [row.pop(key) for key in keys]
+
+		if values and self.limit_page_length and len(result)==self.limit_page_length:
+			self.next_cursor = base64.urlsafe_b64encode(frappe.as_json(list(values), indent=None))
+		else:
+			self.next_cursor = None
+
+		return result
+
 	def add_comment_count(self, result):
+		"""Set `_comment_count` (comments and communications) of each row, with one query for the page."""
+		names = [r.name for r in result if r.name]
+		if not names:
+			return
+
+		counts = {}
+		for name, comment_count, communication_count in frappe.db.sql("""select reference_name,
+				sum(communication_type='Comment' and comment_type='Comment'),
+				sum(communication_type='Communication')
+			from `tabCommunication`
+			where reference_doctype=%s and reference_name in ({0})
+				and communication_type in ('Comment', 'Communication')
+			group by reference_name""".format(", ".join(["%s"] * len(names))), [self.doctype] + names):
+			# MySQL is case insensitive, match on the lower-cased name
+			counts[name.lower()] = (cint(comment_count), cint(communication_count))
+
 		for r in result:
 			if not r.name:
 				continue
 
+			comment_count, communication_count = counts.get(r.name.lower(), (0, 0))
+
 			if "_comments" in r:
 				comment_count = len(json.loads(r._comments or "[]"))
-			else:
-				comment_count = cint(frappe.db.get_value("Communication",
-					filters={
-						"communication_type": "Comment",
-						"reference_doctype": self.doctype,
-						"reference_name": r.name,
-						"comment_type": "Comment"
-					},
-					fieldname="count(name)"))
-
-			communication_count = cint(frappe.db.get_value("Communication",
-				filters={
-					"communication_type": "Communication",
-					"reference_doctype": self.doctype,
-					"reference_name": r.name
-				},
-				fieldname="count(name)"))
 
 			r._comment_count = comment_count + communication_count
+
+def get_subquery_threshold():
+	"""Number of user permission values or shared documents above which they are matched with
+	a subquery instead of an `in (...)` list. Set `permission_subquery_threshold` in site config,
+	0 to always use lists."""
+	threshold = frappe.conf.get("permission_subquery_threshold")
+	return 500 if threshold is None else cint(threshold)
+
+def use_subquery(count):
+	threshold = get_subquery_threshold()
+	return threshold!=0 and count > threshold
+
+def has_literal(sql):
+	"""Returns True if the field or clause has a quoted string"""
+	return isinstance(sql, basestring) and ("'" in sql or '"' in sql)
+
+def get_cursor_value(value):
+	if isinstance(value, (int, long, float)):
+		return unicode(value)
+	return "'{0}'".format(frappe.db.escape(value, percent=False))
+
+def get_equal_condition(column, value):
+	if value is None:
+		return "{0} is null".format(column)
+	return "{0} = {1}".format(column, get_cursor_value(value))
+
+def get_after_condition(column, value, descending):
+	"""Condition for rows that come after `value` in the sort order (nulls sort first in MySQL)."""
+	if value is None:
+		return "0" if descending else "{0} is not null".format(column)
+
+	if descending:
+		return "({0} < {1} or {0} is null)".format(column, get_cursor_value(value))
+	return "{0} > {1}".format(column, get_cursor_value(value))
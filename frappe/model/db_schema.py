@@ -12,7 +12,7 @@ import re
 import os
 import frappe
 from frappe import _
-from frappe.utils import cstr, cint, flt
+from frappe.utils import cstr, cint, flt, unique
 import MySQLdb
 
 class InvalidColumnName(frappe.ValidationError): pass
@@ -48,6 +48,10 @@ default_columns = ['name', 'creation', 'modified', 'modified_by', 'owner',
 	'docstatus', 'parent', 'parentfield', 'parenttype', 'idx']
 optional_columns = ["_user_tags", "_comments", "_assign", "_liked_by"]
 
+# fieldtypes of name, title and search fields that are added to the FULLTEXT search index
+search_index_fieldtypes = ("Data", "Text", "Small Text", "Long Text", "Link", "Select", "Read Only",
+	"Text Editor")
+
 default_shortcuts = ['_Login', '__user', '_Full Name', 'Today', '__today', "now", "Now"]
 
 def updatedb(dt, meta=None):
@@ -144,6 +148,39 @@ class DbTable:
 		else:
 			self.alter()
 
+		self.sync_search_index()
+
+	def sync_search_index(self):
+		"""Add, update or drop the FULLTEXT index `_search` on name, title field and search fields,
+		used by link search (`frappe.desk.search`) for DocTypes set in `fulltext_search` (hooks or site config).
+
+		MySQL keeps the index up to date on insert and update."""
+		columns = self.get_search_index_columns() if self.doctype in get_fulltext_search_doctypes() else []
+
+		frappe.cache().hdel("search_index_columns", self.doctype)
+		current_columns = get_search_index_columns(self.doctype)
+
+		if columns != current_columns:
+			# InnoDB can only add one FULLTEXT index per statement
+			if current_columns:
+				frappe.db.sql("alter table `{0}` drop index `_search`".format(self.name))
+			if columns:
+				frappe.db.sql("alter table `{0}` add fulltext index `_search`({1})".format(self.name,
+					", ".join("`{0}`".format(c) for c in columns)))
+
+			frappe.cache().hdel("search_index_columns", self.doctype)
+
+	def get_search_index_columns(self):
+		fieldnames = ["name"]
+		if self.meta.get("title_field"):
+			fieldnames.append(self.meta.get("title_field"))
+		if self.meta.get("search_fields"):
+			fieldnames.extend(f.strip() for f in self.meta.get("search_fields").split(","))
+
+		# max 16 columns in an index
+		return [f for f in unique(fieldnames) if f=="name"
+			or (f in self.columns and self.columns[f].fieldtype in search_index_fieldtypes)][:16]
+
 	def is_new(self):
 		return self.name not in DbManager(frappe.db).get_tables_list(frappe.db.cur_db_name)
 
@@ -555,6 +592,28 @@ def remove_all_foreign_keys():
 		for f in fklist:
 			frappe.db.sql("alter table `tab%s` drop foreign key `%s`" % (t[0], f[1]))
 
+def get_fulltext_search_doctypes():
+	"""DocTypes with a FULLTEXT search index, from `fulltext_search` in hooks and site config"""
+	return frappe.get_hooks("fulltext_search") + (frappe.conf.get("fulltext_search") or [])
+
+def get_search_index_columns(doctype):
+	"""Returns the columns of the FULLTEXT search index of the table, if any (cached)"""
+	def _get():
+		try:
+			return [d[4] for d in frappe.db.sql("""show index from `tab{0}`
+				where key_name='_search'""".format(doctype))]
+		except Exception, e:
+			if e.args[0]==1146:
+				return []
+			raise
+
+	return frappe.cache().hget("search_index_columns", doctype, _get)
+
+def sync_search_indexes():
+	"""Sync FULLTEXT search indexes of all tables, to apply changes in `fulltext_search`"""
+	for doctype in frappe.db.sql_list("select name from tabDocType where issingle=0"):
+		DbTable(doctype).sync_search_index()
+
 def get_definition(fieldtype, precision=None, length=None):
 	d = type_map.get(fieldtype)
 
@@ -84,6 +84,8 @@ def delete_doc(doctype=None, name=None, force=0, ignore_doctypes=None, for_reloa
 			delete_from_table(doctype, name, ignore_doctypes, doc)
 			doc.run_method("after_delete")
 
+		frappe.clear_document_cache(doctype, name)
+
 		if doc:
 			try:
 				doc.notify_update()
@@ -5,20 +5,23 @@ from __future__ import unicode_literals
 import frappe
 from frappe import _, msgprint
 from frappe.utils import flt, cstr, now, get_datetime_str
-from frappe.model.base_document import BaseDocument, get_controller
+from frappe.model.base_document import BaseDocument, get_controller, get_link_values
 from frappe.model.naming import set_new_name
 from werkzeug.exceptions import NotFound, Forbidden
-import hashlib, json
-from frappe.model import optional_fields
+import hashlib, json, time
+import redis
+from frappe.model import optional_fields, default_fields
 
 # once_only validation
 # methods
 
-def get_doc(arg1, arg2=None):
+def get_doc(arg1, arg2=None, lazy=False, fields=None):
 	"""returns a frappe.model.Document object.
 
 	:param arg1: Document dict or DocType name.
 	:param arg2: [optional] document name.
+	:param lazy: [optional] Load large text fields (`Long Text`, `Code`, `Text Editor`) on first access.
+	:param fields: [optional] Load only these fields (and standard fields). The document cannot be saved.
 
 	There are two ways to call `get_doc`
 
@@ -33,6 +36,9 @@ def get_doc(arg1, arg2=None):
 				{"role": "System Manager"}
 			]
 		})
+
+		# load the communication without its content
+		communication = get_doc("Communication", "COMM-00001", lazy=True)
 	"""
 	if isinstance(arg1, BaseDocument):
 		return arg1
@@ -43,24 +49,185 @@ def get_doc(arg1, arg2=None):
 
 	controller = get_controller(doctype)
 	if controller:
+		if lazy or fields:
+			return controller(arg1, arg2, lazy=lazy, fields=fields)
 		return controller(arg1, arg2)
 
 	raise ImportError, arg1
 
+def get_docs(doctype, names):
+	"""Returns a list of frappe.model.Document objects for the given names, in the same order.
+
+	Parents are loaded with a single `name in (...)` query and children with one query
+	per child DocType, instead of one query per document and table field.
+
+	:param doctype: DocType name.
+	:param names: List of document names.
+
+		# load many documents with their child tables
+		todos = get_docs("ToDo", ["TD0001", "TD0002"])
+	"""
+	names = [name for name in names if name]
+	if not names:
+		return []
+
+	meta = frappe.get_meta(doctype)
+	if meta.issingle:
+		return [get_doc(doctype, doctype)]
+
+	unique_names = list(set(names))
+	parents = {}
+	for d in frappe.db.sql("""select * from `tab{0}` where name in ({1})""".format(doctype,
+		", ".join(["%s"] * len(unique_names))), unique_names, as_dict=True):
+		# MySQL is case insensitive, match on the lower-cased name
+		parents[d.name.lower()] = d
+
+	for name in names:
+		if name.lower() not in parents:
+			frappe.throw(_("{0} {1} not found").format(_(doctype), name), frappe.DoesNotExistError)
+
+	# one query per child doctype, even if it is used in more than one table field
+	parent_names = [d.name for d in parents.values()]
+	children = {}
+	for child_doctype in set(df.options for df in meta.get_table_fields()):
+		for child in frappe.db.sql("""select * from `tab{0}`
+			where parenttype=%s and parent in ({1}) order by idx asc""".format(child_doctype,
+				", ".join(["%s"] * len(parent_names))), [doctype] + parent_names, as_dict=True):
+			children.setdefault((child.parent.lower(), child.parentfield), []).append(child)
+
+	controller = get_controller(doctype)
+	docs = {}
+	out = []
+	for name in names:
+		key = name.lower()
+		if key not in docs:
+			d = frappe._dict(parents[key])
+			d.doctype = doctype
+			for df in meta.get_table_fields():
+				d[df.fieldname] = children.get((key, df.fieldname), [])
+
+			# children are set before __setup__ is called, same as `Document.load_from_db`
+			docs[key] = controller(d)
+
+		out.append(docs[key])
+
+	return out
+
+def get_cached_doc(doctype, name=None):
+	"""Returns a frappe.model.Document object from the document cache, loading it
+	from the database (and caching it) if it is not cached.
+
+	The document is stored as a dict (with children) in the `document_cache` hash in redis
+	and `frappe.local.cache`, and a new object is built on every call, so that changes made
+	by the caller do not leak into the cache. The cache is cleared when the document is
+	saved, deleted, renamed or updated via `db_set`. Values set via `frappe.db.set_value`
+	are not tracked, use `get_doc` if the document is updated that way.
+
+	:param doctype: DocType name.
+	:param name: Document name, same as DocType for single DocTypes.
+
+		company = get_cached_doc("Company", "Wind Power LLC")
+	"""
+	if not name:
+		name = doctype
+
+	cache = frappe.cache()
+	key = get_document_cache_key(doctype, name)
+
+	d = cache.hget("document_cache", key)
+	if d:
+		touch_cached_doc(key)
+		return get_doc(d)
+
+	doc = get_doc(doctype, name)
+
+	# not cached from a write transaction, it may be rolled back
+	if not frappe.db.transaction_writes:
+		set_cached_doc(doc)
+
+	return doc
+
+def set_cached_doc(doc):
+	"""Add document to the document cache and evict the least recently used documents
+	if there are more than `document_cache_size` (site config, default 1000) documents.
+
+	Last used times are kept in the `document_cache_access` sorted set."""
+	cache = frappe.cache()
+	key = get_document_cache_key(doc.doctype, doc.name)
+
+	cache.hset("document_cache", key, doc.as_dict())
+	touch_cached_doc(key)
+
+	max_size = frappe.conf.get("document_cache_size") or 1000
+	access_key = cache.make_key("document_cache_access")
+	try:
+		size = cache.execute_command("ZCARD", access_key)
+		if size > max_size:
+			# evict an extra 10%, so that this does not run on every set
+			for key in cache.execute_command("ZRANGE", access_key, 0, size - max_size + max_size / 10 - 1):
+				_clear_document_cache(key)
+	except redis.exceptions.ConnectionError:
+		pass
+
+def touch_cached_doc(key):
+	"""Set last used time of the cached document, once per request."""
+	touched = frappe.local.document_cache_touched
+	if key not in touched:
+		cache = frappe.cache()
+		try:
+			cache.execute_command("ZADD", cache.make_key("document_cache_access"), time.time(), key)
+		except redis.exceptions.ConnectionError:
+			pass
+		touched.add(key)
+
+def clear_document_cache(doctype=None, name=None, key=None):
+	"""Remove document from the document cache. Removed again when the transaction ends,
+	since other requests may cache the document before the change is committed."""
+	if not key:
+		key = get_document_cache_key(doctype, name)
+
+	_clear_document_cache(key)
+	frappe.local.rollback_observers.append(DocumentCacheChange(key))
+
+class DocumentCacheChange(object):
+	def __init__(self, key):
+		self.key = key
+
+	def on_commit(self):
+		_clear_document_cache(self.key)
+
+	on_rollback = on_commit
+
+def _clear_document_cache(key):
+	cache = frappe.cache()
+	cache.hdel("document_cache", key)
+	try:
+		cache.execute_command("ZREM", cache.make_key("document_cache_access"), key)
+	except redis.exceptions.ConnectionError:
+		pass
+
+def get_document_cache_key(doctype, name):
+	return "{0}::{1}".format(doctype, name)
+
 class Document(BaseDocument):
 	"""All controllers inherit from `Document`."""
-	def __init__(self, arg1, arg2=None):
+	def __init__(self, arg1, arg2=None, lazy=False, fields=None):
 		"""Constructor.
 
 		:param arg1: DocType name as string or document **dict**
 		:param arg2: Document name, if `arg1` is DocType name.
+		:param lazy: Load large text fields when they are first accessed.
+		:param fields: Load only these fields (and standard fields), for read only use.
 
 		If DocType name and document name are passed, the object will load
 		all values (including child documents) from the database.
 		"""
 		self.doctype = self.name = None
 		self._default_new_docs = {}
+		self._lazy_fields = None
 		self.flags = frappe._dict()
+		self.flags.lazy_load = lazy
+		self.flags.partial_load_fields = fields
 
 		if arg1 and isinstance(arg1, basestring):
 			if not arg2:
@@ -105,7 +272,7 @@ class Document(BaseDocument):
 			self._fix_numeric_types()
 
 		else:
-			d = frappe.db.get_value(self.doctype, self.name, "*", as_dict=1)
+			d = frappe.db.get_value(self.doctype, self.name, self.get_columns_to_load(), as_dict=1)
 			if not d:
 				frappe.throw(_("{0} {1} not found").format(_(self.doctype), self.name), frappe.DoesNotExistError)
 
@@ -117,6 +284,9 @@ class Document(BaseDocument):
 		else:
 			table_fields = self.meta.get_table_fields()
 
+		if self.flags.partial_load_fields:
+			table_fields = [df for df in table_fields if df.fieldname in self.flags.partial_load_fields]
+
 		for df in table_fields:
 			children = frappe.db.get_values(df.options,
 				{"parent": self.name, "parenttype": self.doctype, "parentfield": df.fieldname},
@@ -130,6 +300,50 @@ class Document(BaseDocument):
 		if hasattr(self, "__setup__"):
 			self.__setup__()
 
+	def get_columns_to_load(self):
+		"""Returns `*` or, for lazy / partial loads, the list of columns to be selected. Large text
+		columns that are not selected in a lazy load are added to `_lazy_fields`."""
+		self._lazy_fields = None
+		if not (self.flags.lazy_load or self.flags.partial_load_fields):
+			return "*"
+
+		from frappe.model.meta import get_table_columns
+		columns = get_table_columns(self.doctype)
+
+		if self.flags.partial_load_fields:
+			columns = [c for c in columns if c in default_fields or c in self.flags.partial_load_fields]
+
+		if self.flags.lazy_load:
+			large_text_fields = self.meta.get_large_text_fields()
+			self._lazy_fields = set(c for c in columns if c in large_text_fields)
+			columns = [c for c in columns if c not in self._lazy_fields]
+
+		return columns
+
+	def load_lazy_fields(self):
+		"""Load large text fields not loaded by a lazy load."""
+		lazy_fields, self._lazy_fields = self._lazy_fields, None
+		if lazy_fields:
+			values = frappe.db.get_value(self.doctype, self.name, list(lazy_fields), as_dict=True) or {}
+			for fieldname in lazy_fields:
+				self.__dict__[fieldname] = values.get(fieldname)
+
+	def __getattr__(self, key):
+		# only called if the attribute is not found, i.e. not yet loaded
+		lazy_fields = self.__dict__.get("_lazy_fields")
+		if lazy_fields and key in lazy_fields:
+			self.load_lazy_fields()
+			return self.__dict__[key]
+
+		raise AttributeError(key)
+
+	def get(self, key=None, *args, **kwargs):
+		lazy_fields = self.__dict__.get("_lazy_fields")
+		if lazy_fields and isinstance(key, basestring) and key in lazy_fields:
+			self.load_lazy_fields()
+
+		return super(Document, self).get(key, *args, **kwargs)
+
 	def get_latest(self):
 		if not getattr(self, "latest", None):
 			self.latest = frappe.get_doc(self.doctype, self.name)
@@ -203,8 +417,7 @@ class Document(BaseDocument):
 			self.db_insert()
 
 		# children
-		for d in self.get_all_children():
-			d.db_insert()
+		self.db_insert_children(self.get_all_children())
 
 		self.run_method("after_insert")
 		self.flags.in_insert = True
@@ -227,6 +440,10 @@ class Document(BaseDocument):
 		if ignore_permissions!=None:
 			self.flags.ignore_permissions = ignore_permissions
 
+		if self.flags.partial_load_fields:
+			frappe.throw(_("{0} {1} was loaded with only some fields and cannot be saved").format(
+				_(self.doctype), self.name))
+
 		if self.get("__islocal") or not self.get("name"):
 			self.insert()
 			return
@@ -261,8 +478,16 @@ class Document(BaseDocument):
 		child_map = {}
 		ignore_children_type = self.flags.ignore_children_type or []
 
+		new_children = []
+		for d in self.get_all_children():
+			if d.get("__islocal") or not d.name:
+				new_children.append(d)
+			else:
+				d.db_update()
+
+		self.db_insert_children(new_children)
+
 		for d in self.get_all_children():
-			d.db_update()
 			child_map.setdefault(d.doctype, []).append(d.name)
 
 		for df in self.meta.get_table_fields():
@@ -276,6 +501,38 @@ class Document(BaseDocument):
 					frappe.db.sql("""delete from `tab%s` where parent=%s and parenttype=%s""" \
 						% (df.options, '%s', '%s'), (self.name, self.doctype))
 
+	def db_insert_children(self, children):
+		"""INSERT new child rows with one multi-row `INSERT` per child DocType via `frappe.db.bulk_insert`.
+
+		If a duplicate entry is found, the batch is rolled back and rows are inserted one by one
+		via `db_insert`, so that hash naming retries and unique validation messages still apply."""
+		if len(children)==1:
+			children[0].db_insert()
+			return
+
+		batches = {}
+		for d in children:
+			if not d.name:
+				set_new_name(d)
+			values = d.get_valid_dict()
+			batches.setdefault((d.doctype, tuple(values.keys())), []).append((d, values.values()))
+
+		for (doctype, columns), rows in batches.iteritems():
+			frappe.db.sql("savepoint bulk_insert_children")
+			try:
+				frappe.db.bulk_insert(doctype, columns, [values for d, values in rows])
+			except Exception, e:
+				if e.args and e.args[0]==1062:
+					frappe.db.sql("rollback to savepoint bulk_insert_children")
+					for d, values in rows:
+						d.db_insert()
+					continue
+				else:
+					raise
+
+			for d, values in rows:
+				d.set("__islocal", False)
+
 	def set_new_name(self):
 		"""Calls `frappe.naming.se_new_name` for parent and child docs."""
 		set_new_name(self)
@@ -522,10 +779,17 @@ class Document(BaseDocument):
 		if self.flags.ignore_links:
 			return
 
-		invalid_links, cancelled_links = self.get_invalid_links()
+		# resolve the links of the parent and all rows together, one query per linked doctype
+		children = self.get_all_children()
+		links = self.get_links()
+		for d in children:
+			links.extend(d.get_links())
+		link_values = get_link_values(links)
+
+		invalid_links, cancelled_links = self.get_invalid_links(link_values=link_values)
 
-		for d in self.get_all_children():
-			result = d.get_invalid_links(is_submittable=self.meta.is_submittable)
+		for d in children:
+			result = d.get_invalid_links(is_submittable=self.meta.is_submittable, link_values=link_values)
 			invalid_links.extend(result[0])
 			cancelled_links.extend(result[1])
 
@@ -641,6 +905,7 @@ class Document(BaseDocument):
 
 	def clear_cache(self):
 		frappe.cache().hdel("last_modified", self.doctype)
+		clear_document_cache(self.doctype, self.name)
 		self.clear_linked_with_cache()
 
 	def clear_linked_with_cache(self):
@@ -5,18 +5,74 @@
 
 from __future__ import unicode_literals
 import frappe, json
+import redis
 from frappe.utils import cstr, cint
-from frappe.model import integer_docfield_properties, default_fields, no_value_fields, optional_fields
+from frappe.model import (integer_docfield_properties, default_fields, no_value_fields, optional_fields,
+	large_text_fieldtypes)
 from frappe.model.document import Document
 from frappe.model.base_document import BaseDocument
 from frappe.model.db_schema import type_map
 
+# in-process cache of Meta objects per site, see `get_process_meta_cache`
+_meta_cache = {}
+
 def get_meta(doctype, cached=True):
 	if cached:
-		return frappe.cache().hget("meta", doctype, lambda: Meta(doctype))
+		meta_cache = get_process_meta_cache()
+		if doctype not in meta_cache:
+			meta_cache[doctype] = frappe.cache().hget("meta", doctype, lambda: Meta(doctype))
+
+		return meta_cache[doctype]
 	else:
 		return Meta(doctype)
 
+def get_process_meta_cache():
+	"""Returns dict of Meta objects of this site cached in the process. The cache is checked
+	against `metadata_version` once per request (or job), so a change in meta made in any
+	process is picked up in the next request, without unpickling Meta from redis every time.
+
+	Meta objects are shared between requests, they must not be modified."""
+	meta_cache = getattr(frappe.local, "meta_cache", None)
+	if meta_cache is None:
+		version = get_meta_cache_version()
+
+		site_cache = _meta_cache.get(frappe.local.site)
+		if version is None or not site_cache or site_cache["version"] != version:
+			site_cache = _meta_cache[frappe.local.site] = {"version": version, "meta": {}}
+
+		meta_cache = frappe.local.meta_cache = site_cache["meta"]
+
+	return meta_cache
+
+def get_meta_cache_version():
+	"""Returns the `meta_cache_version` counter, incremented whenever meta is cleared. Unlike
+	`metadata_version`, this does not make clients reload their metadata."""
+	cache = frappe.cache()
+	try:
+		return cint(cache.execute_command("GET", cache.make_key("meta_cache_version")))
+	except redis.exceptions.ConnectionError:
+		return None
+
+def clear_process_meta_cache(doctypes=None):
+	"""Remove the given DocTypes (all if not given) from the in-process meta cache of this
+	process. Other processes drop their cache when they see the new `meta_cache_version`."""
+	cache = frappe.cache()
+	try:
+		version = cache.execute_command("INCR", cache.make_key("meta_cache_version"))
+	except redis.exceptions.ConnectionError:
+		version = None
+
+	site_cache = _meta_cache.get(frappe.local.site)
+	if doctypes and version and site_cache and site_cache["version"] == version - 1:
+		# no other changes since this process loaded its cache
+		for doctype in doctypes:
+			site_cache["meta"].pop(doctype, None)
+		site_cache["version"] = version
+
+	else:
+		_meta_cache.pop(frappe.local.site, None)
+		frappe.local.meta_cache = None
+
 def get_table_columns(doctype):
 	return frappe.cache().hget("table_columns", doctype,
 		lambda: frappe.db.get_table_columns(doctype))
@@ -58,14 +114,23 @@ class Meta(Document):
 				raise
 
 	def get_link_fields(self):
-		return self.get("fields", {"fieldtype": "Link", "options":["!=", "[Select]"]})
+		if not hasattr(self, "_link_fields"):
+			self._link_fields = self.get("fields", {"fieldtype": "Link", "options":["!=", "[Select]"]})
+
+		return self._link_fields
 
 	def get_dynamic_link_fields(self):
-		return self.get("fields", {"fieldtype": "Dynamic Link"})
+		if not hasattr(self, "_dynamic_link_fields"):
+			self._dynamic_link_fields = self.get("fields", {"fieldtype": "Dynamic Link"})
+
+		return self._dynamic_link_fields
 
 	def get_select_fields(self):
-		return self.get("fields", {"fieldtype": "Select", "options":["not in",
-			["[Select]", "Loading..."]]})
+		if not hasattr(self, "_select_fields"):
+			self._select_fields = self.get("fields", {"fieldtype": "Select", "options":["not in",
+				["[Select]", "Loading..."]]})
+
+		return self._select_fields
 
 	def get_table_fields(self):
 		if not hasattr(self, "_table_fields"):
@@ -76,6 +141,15 @@ class Meta(Document):
 
 		return self._table_fields
 
+	def get_large_text_fields(self):
+		"""Returns fieldnames of `Long Text`, `Code` and `Text Editor` fields, that are
+		not loaded till accessed in a lazy loaded document."""
+		if not hasattr(self, "_large_text_fields"):
+			self._large_text_fields = [df.fieldname for df in self.get("fields")
+				if df.fieldtype in large_text_fieldtypes]
+
+		return self._large_text_fields
+
 	def get_valid_columns(self):
 		if not hasattr(self, "_valid_columns"):
 			if self.name in ("DocType", "DocField", "DocPerm", "Property Setter"):
@@ -144,7 +218,19 @@ class Meta(Document):
 		self.add_custom_fields()
 		self.apply_property_setters()
 		self.sort_fields()
+		self.build_lookups()
+
+	def build_lookups(self):
+		"""Build field lists used in every save / query once, so that they are cached
+		(and pickled) with the Meta."""
+		self.get_field("name")
 		self.get_valid_columns()
+		self.get_table_fields()
+		self.get_link_fields()
+		self.get_dynamic_link_fields()
+		self.get_select_fields()
+		self.get_large_text_fields()
+		self.get_high_permlevel_fields()
 
 	def add_custom_fields(self):
 		try:
@@ -351,16 +437,21 @@ def clear_cache(doctype=None):
 		for name in groups:
 			cache.hdel(name, dt)
 
+		cache.delete_value("role_permissions:" + dt)
+
 		# also clear linked_with list cache
 		cache.delete_keys("user:*:linked_with:{doctype}:".format(doctype=doctype))
 
+	doctypes = None
 	if doctype:
 		clear_single(doctype)
+		doctypes = [doctype]
 
 		# clear all parent doctypes
 		for dt in frappe.db.sql("""select parent from tabDocField
 			where fieldtype="Table" and options=%s""", (doctype,)):
 			clear_single(dt[0])
+			doctypes.append(dt[0])
 
 		# clear all notifications
 		from frappe.desk.notifications import delete_notification_count_for
@@ -370,3 +461,7 @@ def clear_cache(doctype=None):
 		# clear all
 		for name in groups:
 			cache.delete_value(name)
+
+		cache.delete_keys("role_permissions:")
+
+	clear_process_meta_cache(doctypes)
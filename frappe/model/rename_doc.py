@@ -59,6 +59,8 @@ def rename_doc(doctype, old, new, force=False, merge=False, ignore_permissions=F
 	# update user_permissions
 	frappe.db.sql("""update tabDefaultValue set defvalue=%s where parenttype='User Permission'
 		and defkey=%s and defvalue=%s""", (new, doctype, old))
+	frappe.clear_document_cache(doctype, old)
+	frappe.clear_document_cache(doctype, new)
 	frappe.clear_cache()
 
 	return new
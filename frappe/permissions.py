@@ -2,7 +2,7 @@
 # MIT License. See license.txt
 
 from __future__ import unicode_literals
-import frappe, copy, json
+import frappe, copy, json, hashlib
 from frappe import _, msgprint
 from frappe.utils import cint
 import frappe.share
@@ -177,70 +177,88 @@ def get_role_permissions(meta, user=None, verbose=False):
 	cache_key = (meta.name, user)
 
 	if not frappe.local.role_permissions.get(cache_key):
-		perms = frappe._dict({ "apply_user_permissions": {}, "user_permission_doctypes": {}, "if_owner": {} })
-		user_roles = frappe.get_roles(user)
-		dont_match = []
-		has_a_role_with_apply_user_permissions = False
-
-		for p in meta.permissions:
-			if cint(p.permlevel)==0 and (p.role in user_roles):
-				# apply only for level 0
-
-				for ptype in rights:
-					# build if_owner dict if applicable for this right
-					perms[ptype] = perms.get(ptype, 0) or cint(p.get(ptype))
-
-					if ptype != "set_user_permissions" and p.get(ptype):
-						perms["apply_user_permissions"][ptype] = (perms["apply_user_permissions"].get(ptype, 1)
-							and p.get("apply_user_permissions"))
-
-					if p.if_owner and p.get(ptype):
-						perms["if_owner"][ptype] = 1
-
-					if p.get(ptype) and not p.if_owner and not p.get("apply_user_permissions"):
-						dont_match.append(ptype)
-
-				if p.apply_user_permissions:
-					has_a_role_with_apply_user_permissions = True
-
-					if p.user_permission_doctypes:
-						# set user_permission_doctypes in perms
-						user_permission_doctypes = json.loads(p.user_permission_doctypes)
-					else:
-						user_permission_doctypes = get_linked_doctypes(meta.name)
-
-					if user_permission_doctypes:
-						# perms["user_permission_doctypes"][ptype] would be a list of list like [["User", "Blog Post"], ["User"]]
-						for ptype in rights:
-							if p.get(ptype):
-								perms["user_permission_doctypes"].setdefault(ptype, []).append(user_permission_doctypes)
-
-		# if atleast one record having both Apply User Permission and If Owner unchecked is found,
-		# don't match for those rights
-		for ptype in rights:
-			if ptype in dont_match:
-				if perms["apply_user_permissions"].get(ptype):
-					del perms["apply_user_permissions"][ptype]
+		frappe.local.role_permissions[cache_key] = get_role_permissions_for_roles(meta,
+			frappe.get_roles(user))
 
-				if perms["if_owner"].get(ptype):
-					del perms["if_owner"][ptype]
+	return frappe.local.role_permissions[cache_key]
 
-		# if one row has only "Apply User Permissions" checked and another has only "If Owner" checked,
-		# set Apply User Permissions as checked
-		# i.e. the case when there is a role with apply_user_permissions as 1, but resultant apply_user_permissions is 0
-		if has_a_role_with_apply_user_permissions:
-			for ptype in rights:
-				if perms["if_owner"].get(ptype) and perms["apply_user_permissions"].get(ptype)==0:
-					perms["apply_user_permissions"][ptype] = 1
+def get_role_permissions_for_roles(meta, user_roles):
+	"""Returns role permissions (see `get_role_permissions`) for a set of roles.
 
-		# delete 0 values
-		for key, value in perms.get("apply_user_permissions").items():
-			if not value:
-				del perms["apply_user_permissions"][key]
+	Since many users share the same roles, the result is cached per DocType and role set, in
+	redis (a `role_permissions:<doctype>` hash with a field per role set, cleared with the
+	DocType's meta) and on the `Meta` object, which is cached in the process till its meta is cleared."""
+	role_key = hashlib.md5(json.dumps(sorted(set(user_roles)))).hexdigest()
 
-		frappe.local.role_permissions[cache_key] = perms
+	role_permissions = meta.__dict__.setdefault("_role_permissions", {})
+	if role_key not in role_permissions:
+		role_permissions[role_key] = frappe.cache().hget("role_permissions:" + meta.name, role_key,
+			lambda: make_role_permissions(meta, user_roles))
 
-	return frappe.local.role_permissions[cache_key]
+	return role_permissions[role_key]
+
+def make_role_permissions(meta, user_roles):
+	perms = frappe._dict({ "apply_user_permissions": {}, "user_permission_doctypes": {}, "if_owner": {} })
+	dont_match = []
+	has_a_role_with_apply_user_permissions = False
+
+	for p in meta.permissions:
+		if cint(p.permlevel)==0 and (p.role in user_roles):
+			# apply only for level 0
+
+			for ptype in rights:
+				# build if_owner dict if applicable for this right
+				perms[ptype] = perms.get(ptype, 0) or cint(p.get(ptype))
+
+				if ptype != "set_user_permissions" and p.get(ptype):
+					perms["apply_user_permissions"][ptype] = (perms["apply_user_permissions"].get(ptype, 1)
+						and p.get("apply_user_permissions"))
+
+				if p.if_owner and p.get(ptype):
+					perms["if_owner"][ptype] = 1
+
+				if p.get(ptype) and not p.if_owner and not p.get("apply_user_permissions"):
+					dont_match.append(ptype)
+
+			if p.apply_user_permissions:
+				has_a_role_with_apply_user_permissions = True
+
+				if p.user_permission_doctypes:
+					# set user_permission_doctypes in perms
+					user_permission_doctypes = json.loads(p.user_permission_doctypes)
+				else:
+					user_permission_doctypes = get_linked_doctypes(meta.name)
+
+				if user_permission_doctypes:
+					# perms["user_permission_doctypes"][ptype] would be a list of list like [["User", "Blog Post"], ["User"]]
+					for ptype in rights:
+						if p.get(ptype):
+							perms["user_permission_doctypes"].setdefault(ptype, []).append(user_permission_doctypes)
+
+	# if atleast one record having both Apply User Permission and If Owner unchecked is found,
+	# don't match for those rights
+	for ptype in rights:
+		if ptype in dont_match:
+			if perms["apply_user_permissions"].get(ptype):
+				del perms["apply_user_permissions"][ptype]
+
+			if perms["if_owner"].get(ptype):
+				del perms["if_owner"][ptype]
+
+	# if one row has only "Apply User Permissions" checked and another has only "If Owner" checked,
+	# set Apply User Permissions as checked
+	# i.e. the case when there is a role with apply_user_permissions as 1, but resultant apply_user_permissions is 0
+	if has_a_role_with_apply_user_permissions:
+		for ptype in rights:
+			if perms["if_owner"].get(ptype) and perms["apply_user_permissions"].get(ptype)==0:
+				perms["apply_user_permissions"][ptype] = 1
+
+	# delete 0 values
+	for key, value in perms.get("apply_user_permissions").items():
+		if not value:
+			del perms["apply_user_permissions"][key]
+
+	return perms
 
 def user_has_permission(doc, verbose=True, user=None, user_permission_doctypes=None):
 	from frappe.defaults import get_user_permissions
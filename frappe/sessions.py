@@ -31,7 +31,7 @@ def clear_cache(user=None):
 	cache = frappe.cache()
 
 	groups = ("bootinfo", "user_recent", "user_roles", "user_doc", "lang",
-		"defaults", "user_permissions", "roles", "home_page", "linked_with")
+		"defaults", "user_permissions", "roles", "home_page", "linked_with", "shared_doctypes")
 
 	if user:
 		for name in groups:
@@ -47,7 +47,10 @@ def clear_cache(user=None):
 def clear_global_cache():
 	frappe.model.meta.clear_cache()
 	frappe.cache().delete_value(["app_hooks", "installed_apps",
-		"app_modules", "module_app", "notification_config", 'system_settings'])
+		"app_modules", "module_app", "notification_config", 'system_settings',
+		"document_cache", "document_cache_access", "search_index_columns", "unsubscribes",
+		"global_unsubscribes"])
+	frappe.cache().delete_keys("shared_names:")
 	frappe.setup_module_map()
 
 def clear_sessions(user=None, keep_current=False, device=None):
@@ -96,6 +96,8 @@ def get_users(doctype, name, fields="*"):
 def get_shared(doctype, user=None, rights=None):
 	"""Get list of shared document names for given user and DocType.
 
+	Cached per DocType, user and rights till a share of the DocType is changed.
+
 	:param doctype: DocType of which shared names are queried.
 	:param user: User for which shared names are queried.
 	:param rights: List of rights for which the document is shared. List of `read`, `write`, `share`"""
@@ -106,19 +108,61 @@ def get_shared(doctype, user=None, rights=None):
 	if not rights:
 		rights = ["read"]
 
-	condition = " and ".join(["`{0}`=1".format(right) for right in rights])
+	if doctype not in get_shared_doctypes(user):
+		# nothing shared in this DocType
+		return []
+
+	def _get():
+		condition = " and ".join(["`{0}`=1".format(right) for right in rights])
+
+		return frappe.db.sql_list("""select share_name from tabDocShare
+			where (user=%s {everyone}) and share_doctype=%s and {condition}""".format(
+				condition=condition, everyone="or everyone=1" if user!="Guest" else ""),
+			(user, doctype))
+
+	if frappe.db.transaction_writes:
+		# not cached in a write transaction, it may be rolled back
+		return _get()
 
-	return frappe.db.sql_list("""select share_name from tabDocShare
-		where (user=%s {everyone}) and share_doctype=%s and {condition}""".format(
-			condition=condition, everyone="or everyone=1" if user!="Guest" else ""),
-		(user, doctype))
+	return frappe.cache().hget("shared_names:" + doctype,
+		"{0}::{1}".format(user, ",".join(sorted(rights))), _get)
 
 def get_shared_doctypes(user=None):
-	"""Return list of doctypes in which documents are shared for the given user."""
+	"""Return list of doctypes in which documents are shared for the given user (cached)."""
 	if not user:
 		user = frappe.session.user
 
-	return frappe.db.sql_list("select distinct share_doctype from tabDocShare where (user=%s or everyone=1)", user)
+	def _get():
+		return frappe.db.sql_list("select distinct share_doctype from tabDocShare where (user=%s or everyone=1)", user)
+
+	if frappe.db.transaction_writes:
+		return _get()
+
+	return frappe.cache().hget("shared_doctypes", user, _get)
+
+def clear_cache(share_doctype, user=None, everyone=0):
+	"""Clear cached shared names of the DocType and shared DocTypes of the user (of all users
+	if shared with everyone). Cleared again when the transaction ends, since other requests
+	may cache the shares that are not yet committed."""
+	_clear_cache(share_doctype, user, everyone)
+	frappe.local.rollback_observers.append(ShareCacheChange(share_doctype, user, everyone))
+
+class ShareCacheChange(object):
+	def __init__(self, share_doctype, user, everyone):
+		self.share_doctype, self.user, self.everyone = share_doctype, user, everyone
+
+	def on_commit(self):
+		_clear_cache(self.share_doctype, self.user, self.everyone)
+
+	on_rollback = on_commit
+
+def _clear_cache(share_doctype, user=None, everyone=0):
+	frappe.cache().delete_key("shared_names:" + share_doctype)
+
+	if cint(everyone) or not user:
+		frappe.cache().delete_key("shared_doctypes")
+	else:
+		frappe.cache().hdel("shared_doctypes", user)
 
 def get_share_name(doctype, name, user, everyone):
 	if cint(everyone):
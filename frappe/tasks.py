@@ -160,6 +160,27 @@ def pull_from_email_account(site, email_account):
 	finally:
 		frappe.destroy()
 
+@celery_task()
+def insert_communications(site, email_account, group):
+	try:
+		frappe.init(site=site)
+		frappe.connect(site=site)
+		email_account = frappe.get_doc("Email Account", email_account)
+		email_account.insert_queued_communications(group)
+		frappe.db.commit()
+	finally:
+		frappe.destroy()
+
+@celery_task()
+def flush_bulk_email(site):
+	from frappe.email.bulk import flush_batches
+	try:
+		frappe.init(site=site)
+		frappe.connect(site=site)
+		flush_batches()
+	finally:
+		frappe.destroy()
+
 @celery_task(bind=True)
 def run_async_task(self, site=None, user=None, cmd=None, form_dict=None, hijack_std=False):
 	ret = {}
@@ -27,3 +27,125 @@ class TestDB(unittest.TestCase):
 	def test_multiple_queries(self):
 		# implicit commit
 		self.assertRaises(frappe.SQLError, frappe.db.sql, """select name from `tabUser`; truncate `tabBulk Email`""")
+
+	def test_bulk_insert(self):
+		frappe.db.sql("""delete from `tabToDo` where description like '_Test Bulk Insert%'""")
+
+		names = [frappe.generate_hash(length=10) for i in xrange(5)]
+		frappe.db.bulk_insert("ToDo", ["name", "description", "status"],
+			[[name, "_Test Bulk Insert {0}".format(i), "Open"] for i, name in enumerate(names)], chunk_size=2)
+
+		self.assertEquals(frappe.db.sql_list("""select name from `tabToDo`
+			where description like '_Test Bulk Insert%' order by description"""), names)
+
+	def test_sql_iter(self):
+		query = "select name, enabled from `tabUser` order by name"
+		rows = frappe.db.sql_iter(query)
+		self.assertEquals([list(r) for r in rows], [list(r) for r in frappe.db.sql(query)])
+
+		rows = frappe.db.sql_iter(query, as_dict=True)
+		self.assertEquals(list(rows), frappe.db.sql(query, as_dict=True))
+
+		# connection can be used after a partially read result
+		rows = frappe.db.sql_iter(query)
+		rows.next()
+		rows.close()
+		self.assertEquals(frappe.db.get_value("User", "Administrator"), "Administrator")
+
+		# options of buffered results are not supported
+		self.assertRaises(ValueError, frappe.db.sql, query, iterate=True, formatted=True)
+		self.assertRaises(ValueError, frappe.db.sql, query, iterate=True, update={"x": 1})
+
+	def test_query_profile(self):
+		from frappe.utils.query_profiler import normalize_query
+		self.assertEquals(normalize_query("""select name from `tabUser`
+			where name in ('a', "b", %s) and idx > 10 and owner=%(owner)s"""),
+			"select name from `tabUser` where name in (?+) and idx > ? and owner=?")
+
+		count = frappe.db.query_count
+		for i in xrange(3):
+			frappe.db.sql("select name from `tabUser` where name=%s", "Administrator")
+
+		self.assertEquals(frappe.db.query_count, count + 3)
+		profile = frappe.db.get_query_profile(top_n=100)
+		self.assertTrue(filter(lambda d: d.query=="select name from `tabUser` where name=?" and d.count >= 3,
+			profile.slowest))
+
+	def test_name_value_cache(self):
+		frappe.db.set_value("User", "Administrator", "last_ip", "127.0.0.1", update_modified=False)
+		frappe.db.get_value("User", "Administrator", "last_ip")
+
+		hits = frappe.db.name_value_cache_hits
+		count = frappe.db.query_count
+		self.assertEquals(frappe.db.get_value("User", "Administrator", "last_ip"), "127.0.0.1")
+		self.assertEquals(frappe.db.name_value_cache_hits, hits + 1)
+		self.assertEquals(frappe.db.query_count, count)
+
+		# changes to returned rows do not change the cache
+		frappe.db.get_value("User", "Administrator", "*", as_dict=True).last_ip = "changed"
+		self.assertEquals(frappe.db.get_value("User", "Administrator", "*", as_dict=True).last_ip, "127.0.0.1")
+
+		# cleared on write
+		frappe.db.set_value("User", "Administrator", "last_ip", "127.0.0.2", update_modified=False)
+		self.assertEquals(frappe.db.get_value("User", "Administrator", "last_ip"), "127.0.0.2")
+
+		frappe.db.sql("""update tabUser set last_ip='127.0.0.3' where name='Administrator'""")
+		self.assertEquals(frappe.db.get_value("User", "Administrator", "last_ip"), "127.0.0.3")
+
+		# and at the end of the transaction
+		frappe.db.rollback()
+		self.assertEquals(frappe.db.name_value_cache, {})
+
+	def test_read_from_replica(self):
+		master = frappe.db._get_current_object()
+		frappe.local.conf.read_from_replica = {"host": master.host}
+
+		try:
+			with frappe.read_from_replica():
+				self.assertTrue(frappe.db.primary is master)
+				self.assertEquals(frappe.db.get_value("User", "Administrator"), "Administrator")
+
+				# writes go to the master
+				first_name = frappe.db.get_value("User", "Administrator", "first_name")
+				frappe.db.sql("""update `tabUser` set first_name='_Test Replica' where name='Administrator'""")
+				self.assertTrue(master.transaction_writes)
+
+				# and reads after the write are not served from the replica or its cache
+				self.assertEquals(frappe.db.get_value("User", "Administrator", "first_name"), "_Test Replica")
+				frappe.db.sql("""update `tabUser` set first_name=%s where name='Administrator'""", first_name)
+
+			self.assertTrue(frappe.db._get_current_object() is master)
+
+			# stay on master in a write transaction
+			with frappe.read_from_replica():
+				self.assertTrue(frappe.db._get_current_object() is master)
+
+		finally:
+			del frappe.local.conf["read_from_replica"]
+
+	def test_connection_pool(self):
+		from frappe.database import Database, connection_pool
+		frappe.local.conf.db_connection_pool = 1
+
+		try:
+			db = Database(user=frappe.conf.db_name)
+			db.connect()
+			conn = db._conn
+			db.close()
+
+			# idle connection is reused
+			db.connect()
+			self.assertTrue(db._conn is conn)
+			self.assertEquals(db.get_value("User", "Administrator"), "Administrator")
+
+			# session variables are reset
+			db.sql("set foreign_key_checks=0")
+			db.close()
+			db.connect()
+			self.assertTrue(db._conn is conn)
+			self.assertEquals(db.sql("select @@session.foreign_key_checks")[0][0], 1)
+			db.close()
+
+		finally:
+			del frappe.local.conf["db_connection_pool"]
+			connection_pool.clear()
@@ -3,8 +3,10 @@
 from __future__ import unicode_literals
 
 import frappe, unittest
+import frappe.share
 
 from frappe.model.db_query import DatabaseQuery
+from collections import OrderedDict
 
 class TestReportview(unittest.TestCase):
 	def test_basic(self):
@@ -38,3 +40,161 @@ class TestReportview(unittest.TestCase):
 		self.assertTrue({"fieldtype":"Table", "fieldname":"fields"} in data)
 		self.assertTrue({"fieldtype":"Select", "fieldname":"document_type"} in data)
 		self.assertFalse({"fieldtype":"Check", "fieldname":"issingle"} in data)
+
+	def test_cursor_pagination(self):
+		for order_by in ("modified desc", "`tabDocType`.module asc, `tabDocType`.`modified` desc"):
+			# name is added as the tie breaker, in the direction of the last key
+			all_names = [d.name for d in DatabaseQuery("DocType").execute(order_by=order_by + ", name desc",
+				limit_page_length=None)]
+
+			names = []
+			page = frappe.get_list_page("DocType", order_by=order_by, limit_page_length=7)
+			while True:
+				self.assertTrue(all(d.keys()==["name"] for d in page.data))
+				names.extend(d.name for d in page.data)
+				if not page.next_cursor:
+					break
+
+				page = frappe.get_list_page("DocType", cursor=page.next_cursor, order_by=order_by,
+					limit_page_length=7)
+
+			self.assertEquals(names, all_names)
+
+		self.assertRaises(frappe.ValidationError, frappe.get_list_page, "DocType", cursor="invalid")
+
+	def test_comment_count(self):
+		events = []
+		for i in xrange(2):
+			events.append(frappe.get_doc({
+				"doctype": "Event",
+				"subject": "_Test Comment Count {0}".format(i),
+				"starts_on": "2014-01-01",
+				"event_type": "Public"
+			}).insert())
+
+		events[0].add_comment("Comment", "comment 1")
+		events[0].add_comment("Comment", "comment 2")
+		events[1].add_comment("Info", "not counted")
+
+		def get_list(with_comment_count):
+			count = frappe.db.query_count
+			data = DatabaseQuery("Event").execute(filters={"name": ("in", [e.name for e in events])},
+				fields=["name"], with_comment_count=with_comment_count)
+			return data, frappe.db.query_count - count
+
+		data, query_count = get_list(True)
+
+		# one query for the counts of all rows
+		self.assertEquals(query_count - get_list(False)[1], 1)
+
+		counts = dict((d.name, d._comment_count) for d in data)
+		self.assertEquals(counts[events[0].name], 2)
+		self.assertEquals(counts[events[1].name], 0)
+
+	def test_cached_count(self):
+		from frappe.desk.reportview import get_count
+
+		filters = {"event_type": "Public"}
+
+		# counts are not cached from write transactions
+		frappe.get_doc({"doctype": "Event", "subject": "_Test Uncommitted Event",
+			"starts_on": "2014-01-01", "event_type": "Public"}).insert()
+		self.assertEquals(get_count("Event", filters)["count"], frappe.db.count("Event", filters))
+		frappe.db.rollback()
+
+		count = get_count("Event", filters)
+		self.assertEquals(count, {"count": frappe.db.count("Event", filters), "estimated": 0})
+
+		# served from cache
+		query_count = frappe.db.query_count
+		self.assertEquals(get_count("Event", filters), count)
+		self.assertEquals(frappe.db.query_count, query_count)
+
+		# estimated for large tables
+		frappe.local.conf.count_estimate_threshold = -1
+		try:
+			self.assertEquals(get_count("DocType"), {"count": frappe.db.estimate_count("DocType"),
+				"estimated": 1})
+		finally:
+			del frappe.local.conf["count_estimate_threshold"]
+
+		# permission is checked before the cache
+		get_count("DocType")
+		frappe.set_user("Guest")
+		try:
+			self.assertRaises(frappe.PermissionError, get_count, "DocType")
+		finally:
+			frappe.set_user("Administrator")
+
+	def test_cached_count_of_shared_documents(self):
+		from frappe.desk.reportview import get_cached_count
+
+		event = frappe.get_doc({"doctype": "Event", "subject": "_Test Shared Count Event",
+			"starts_on": "2014-01-01", "event_type": "Private"}).insert()
+		frappe.share.add("Event", event.name, "Guest")
+		frappe.db.commit()
+
+		frappe.set_user("Guest")
+		try:
+			conditions = get_cached_count("Event", ["test shared"], lambda conditions: conditions)
+		finally:
+			frappe.set_user("Administrator")
+			frappe.share.remove("Event", event.name, "Guest")
+			event.delete()
+			frappe.db.commit()
+
+		# the share condition of the user is part of the key and passed to the generator
+		self.assertTrue(event.name in conditions[0])
+		self.assertNotEquals(get_cached_count("Event", ["test shared"], lambda conditions: conditions),
+			conditions)
+
+	def test_query_shape_cache(self):
+		def get_names(user):
+			return DatabaseQuery("User").execute(filters={"name": user, "enabled": 1},
+				fields=["name"], as_list=True)
+
+		self.assertEquals(get_names("Administrator"), [("Administrator",)])
+
+		query_shapes = frappe.get_meta("User")._query_shapes
+		count = len(query_shapes)
+
+		# same shape, different values
+		self.assertEquals(get_names("Guest"), [("Guest",)])
+		self.assertEquals(len(query_shapes), count)
+
+		self.assertEquals(DatabaseQuery("User").execute(filters={"name": ("in", ["Administrator", "Guest"])},
+			fields=["name"], order_by="name asc", as_list=True), [("Administrator",), ("Guest",)])
+		self.assertEquals(len(query_shapes), count + 1)
+
+		# not cached with string filters
+		self.assertEquals(DatabaseQuery("User").execute(filters=["`tabUser`.name like '%Administ%'"],
+			fields=["name"], as_list=True), [("Administrator",)])
+		self.assertEquals(len(query_shapes), count + 1)
+
+		# nor the relevance field of search_widget
+		from frappe.desk.search import search_widget
+		query_shapes = frappe.get_meta("Role").__dict__.setdefault("_query_shapes", OrderedDict())
+		count = len(query_shapes)
+		for txt in ("s", "sy", "sys"):
+			search_widget("Role", txt)
+			self.assertEquals(len(query_shapes), count)
+
+	def test_query_shape_lru(self):
+		def get_names(fields):
+			return DatabaseQuery("User").execute(filters={"name": "Guest"}, fields=fields, as_list=True)
+
+		query_shapes = frappe.get_meta("User").__dict__.setdefault("_query_shapes", OrderedDict())
+		query_shapes.clear()
+		get_names(["name"])
+		for i in xrange(499):
+			query_shapes["shape {0}".format(i)] = frappe._dict()
+
+		# used again, so it is not evicted, the least recently used shape is
+		get_names(["name"])
+		get_names(["name", "email"])
+		self.assertEquals(len(query_shapes), 500)
+		self.assertFalse("shape 0" in query_shapes)
+		self.assertTrue("shape 1" in query_shapes)
+
+		get_names(["name"])
+		self.assertTrue("shape 1" in query_shapes)
@@ -59,6 +59,111 @@ class TestDocument(unittest.TestCase):
 
 		d1 = frappe.get_doc("Event", d.name)
 		self.assertEquals(d1.roles[0].role, "System Manager")
+		return d
+
+	def test_get_docs(self):
+		d1 = self.test_insert_with_child()
+		d2 = self.test_insert()
+
+		docs = frappe.get_docs("Event", [d2.name, d1.name])
+		self.assertEquals([d.name for d in docs], [d2.name, d1.name])
+		self.assertEquals(docs[0].roles, [])
+		self.assertEquals(docs[1].roles[0].role, "System Manager")
+		self.assertEquals(docs[1].as_dict(), frappe.get_doc("Event", d1.name).as_dict())
+
+		self.assertRaises(frappe.DoesNotExistError, frappe.get_docs, "Event", ["_Test Missing Event"])
+
+	def test_get_cached_doc(self):
+		from frappe.model.document import get_document_cache_key, set_cached_doc
+		d = self.test_insert_with_child()
+		key = get_document_cache_key("Event", d.name)
+
+		# not cached in a write transaction
+		frappe.get_cached_doc("Event", d.name)
+		self.assertEquals(frappe.cache().hget("document_cache", key), None)
+
+		frappe.db.commit()
+		cached = frappe.get_cached_doc("Event", d.name)
+		self.assertTrue(frappe.cache().hget("document_cache", key))
+		self.assertEquals(cached.as_dict(), frappe.get_doc("Event", d.name).as_dict())
+		self.assertEquals(cached.roles[0].role, "System Manager")
+
+		# changes to the returned object do not change the cache
+		cached.subject = "changed"
+		self.assertEquals(frappe.get_cached_doc("Event", d.name).subject, "test-doc-test-event 2")
+
+		# cleared on save
+		d.subject = "subject changed"
+		d.save()
+		self.assertEquals(frappe.get_cached_doc("Event", d.name).subject, "subject changed")
+
+		# cleared on db_set
+		d.db_set("subject", "subject changed again")
+		self.assertEquals(frappe.get_cached_doc("Event", d.name).subject, "subject changed again")
+
+		# cleared again on commit, in case another request cached the committed row before it
+		stale = frappe.get_doc("Event", d.name)
+		stale.subject = "stale"
+		set_cached_doc(stale)
+		frappe.db.commit()
+		self.assertEquals(frappe.cache().hget("document_cache", key), None)
+
+		# cleared on delete
+		frappe.delete_doc("Event", d.name)
+		self.assertRaises(frappe.DoesNotExistError, frappe.get_cached_doc, "Event", d.name)
+
+	def test_lazy_load(self):
+		d = self.test_insert()
+		d.description = "<p>long description</p>"
+		d.save()
+
+		lazy = frappe.get_doc("Event", d.name, lazy=True)
+		self.assertTrue("description" not in lazy.__dict__)
+		self.assertEquals(lazy.subject, d.subject)
+		self.assertEquals(lazy.description, d.description)
+
+		lazy = frappe.get_doc("Event", d.name, lazy=True)
+		self.assertEquals(lazy.get("description"), d.description)
+
+		# loaded before save
+		lazy = frappe.get_doc("Event", d.name, lazy=True)
+		lazy.subject = "subject changed"
+		lazy.save()
+		self.assertEquals(frappe.db.get_value("Event", d.name, "description"), d.description)
+
+	def test_partial_load(self):
+		d = self.test_insert_with_child()
+
+		partial = frappe.get_doc("Event", d.name, fields=["subject"])
+		self.assertEquals(partial.subject, d.subject)
+		self.assertEquals(partial.modified, d.modified)
+		self.assertEquals(partial.get("starts_on"), None)
+		self.assertEquals(partial.get("roles"), [])
+
+		self.assertRaises(frappe.ValidationError, partial.save)
+
+	def test_process_meta_cache(self):
+		meta = frappe.get_meta("Event")
+
+		# served from the process cache in the next request
+		frappe.local.cache = {}
+		frappe.local.meta_cache = None
+		self.assertTrue(frappe.get_meta("Event") is meta)
+		self.assertTrue(meta.get_link_fields() is frappe.get_meta("Event").get_link_fields())
+
+		# reloaded if meta is cleared by another process
+		frappe.cache().execute_command("INCR", frappe.cache().make_key("meta_cache_version"))
+		frappe.local.cache = {}
+		frappe.local.meta_cache = None
+		self.assertFalse(frappe.get_meta("Event") is meta)
+
+		# only the cleared doctype is dropped in this process, clients do not reload metadata
+		meta, user_meta = frappe.get_meta("Event"), frappe.get_meta("User")
+		metadata_version = frappe.cache().get_value("metadata_version")
+		frappe.model.meta.clear_cache("Event")
+		self.assertFalse(frappe.get_meta("Event") is meta)
+		self.assertTrue(frappe.get_meta("User") is user_meta)
+		self.assertEquals(frappe.cache().get_value("metadata_version"), metadata_version)
 
 	def test_update(self):
 		d = self.test_insert()
@@ -130,6 +235,31 @@ class TestDocument(unittest.TestCase):
 
 		self.assertEquals(frappe.db.get_value("User", d.name), d.name)
 
+	def test_batched_link_validation(self):
+		d = frappe.get_doc({
+			"doctype":"Event",
+			"subject":"test-doc-test-event 3",
+			"starts_on": "2014-01-01",
+			"event_type": "Public",
+			"roles": [{"role": "system manager"}, {"role": "System Manager"}, {"role": "Guest"}]
+		})
+
+		# once to warm up meta and value caches
+		d._validate_links()
+		d.roles[0].role = "system manager"
+
+		count = frappe.db.query_count
+		d._validate_links()
+
+		# case of the name in the database is preserved
+		self.assertEquals([r.role for r in d.roles], ["System Manager", "System Manager", "Guest"])
+
+		# one query for all roles
+		self.assertEquals(frappe.db.query_count - count, 1)
+
+		d.append("roles", {"role": "_Test Missing Role"})
+		self.assertRaises(frappe.LinkValidationError, d._validate_links)
+
 	def test_validate(self):
 		d = self.test_insert()
 		d.starts_on = "2014-01-01"
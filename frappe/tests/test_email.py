@@ -11,8 +11,10 @@ make_test_records("Email Account")
 
 class TestEmail(unittest.TestCase):
 	def setUp(self):
+		from frappe.email.bulk import clear_unsubscribe_cache
 		frappe.db.sql("""delete from `tabEmail Unsubscribe`""")
 		frappe.db.sql("""delete from `tabBulk Email`""")
+		clear_unsubscribe_cache()
 
 	def test_send(self):
 		from frappe.email import sendmail
@@ -31,6 +33,37 @@ class TestEmail(unittest.TestCase):
 		self.assertTrue('test1@example.com' in [d['recipient'] for d in bulk])
 		self.assertTrue('Unsubscribe' in bulk[0]['message'])
 
+	def test_bulk_render_once(self):
+		import email
+		from frappe.email.bulk import send, get_message
+		frappe.local.conf.bulk_email_render_once = 1
+		try:
+			send(recipients = ['test@example.com', 'test1@example.com'],
+				sender="admin@example.com",
+				reference_doctype='User', reference_name='Administrator',
+				subject='Testing Bulk', message='This is a bulk mail!',
+				attachments=[{"fname": "test.txt", "fcontent": "test attachment"}])
+		finally:
+			del frappe.local.conf["bulk_email_render_once"]
+
+		bulk = frappe.db.sql("""select * from `tabBulk Email` where status='Not Sent'""", as_dict=1)
+		self.assertEquals(len(bulk), 2)
+
+		# one shared message
+		self.assertEquals(len(set(d.bulk_email_message for d in bulk)), 1)
+		self.assertFalse(bulk[0].message)
+
+		for d in bulk:
+			message = email.message_from_string(get_message(d).encode("utf-8"))
+			self.assertEquals(message["To"], d.recipient)
+			self.assertEquals([p.get_content_type() for p in message.walk()],
+				["multipart/mixed", "multipart/alternative", "text/plain", "text/html", "text/plain"])
+
+			html = message.get_payload()[0].get_payload()[1].get_payload(decode=True)
+			self.assertTrue("Unsubscribe" in html)
+			self.assertTrue(d.recipient in html)
+			self.assertEquals(message.get_payload()[1].get_payload(decode=True), "test attachment")
+
 	def test_flush(self):
 		self.test_bulk(send_after = 1)
 		from frappe.email.bulk import flush
@@ -47,6 +80,72 @@ class TestEmail(unittest.TestCase):
 		self.assertTrue('test@example.com' in [d['recipient'] for d in bulk])
 		self.assertTrue('test1@example.com' in [d['recipient'] for d in bulk])
 
+	def test_flush_batches(self):
+		from frappe.email.bulk import send, flush, claim_batch
+		send(recipients = ['test@example.com', 'test1@example.com', 'test2@example.com'],
+			sender="admin@example.com",
+			reference_doctype='User', reference_name='Administrator',
+			subject='Testing Bulk', message='This is a bulk mail!')
+
+		# batches do not overlap
+		first, second = claim_batch(2, auto_commit=False), claim_batch(2, auto_commit=False)
+		self.assertEquals(len(first), 2)
+		self.assertEquals(len(second), 1)
+		self.assertFalse(set(d.name for d in first) & set(d.name for d in second))
+		frappe.db.sql("""update `tabBulk Email` set status='Not Sent', claimed_by=null""")
+
+		frappe.local.conf.bulk_email_batch_size = 2
+		try:
+			flush(from_test=True)
+		finally:
+			del frappe.local.conf["bulk_email_batch_size"]
+
+		bulk = frappe.db.sql("""select * from `tabBulk Email` where status='Sent'""", as_dict=1)
+		self.assertEquals(len(bulk), 3)
+		self.assertEquals(len(set(d.claimed_by for d in bulk)), 2)
+
+	def test_release_stale_batches(self):
+		from frappe.email.bulk import (claim_batch, release_stale_batches, acquire_flusher_slot,
+			release_flusher_slot)
+		self.test_bulk()
+
+		slot, flusher_id = acquire_flusher_slot()
+		try:
+			self.assertTrue(slot)
+			claim_batch(1, auto_commit=False, flusher_id=flusher_id)
+			claim_batch(1, auto_commit=False, flusher_id="_test_stopped_flusher")
+
+			# only the batch of the stopped flusher is queued again
+			release_stale_batches(auto_commit=False)
+			bulk = frappe.db.sql("""select * from `tabBulk Email` where status='Sending'""", as_dict=1)
+			self.assertEquals(len(bulk), 1)
+			self.assertTrue(bulk[0].claimed_by.startswith(flusher_id + ":"))
+
+			# no more slots
+			self.assertEquals(acquire_flusher_slot(), (None, None))
+
+		finally:
+			release_flusher_slot(slot, flusher_id)
+
+	def test_lost_flusher_slot(self):
+		from frappe.email.bulk import claim_batch, send_batch, acquire_flusher_slot, release_flusher_slot
+		self.test_bulk()
+
+		slot, flusher_id = acquire_flusher_slot()
+		try:
+			batch = claim_batch(2, auto_commit=False, flusher_id=flusher_id)
+			self.assertTrue(send_batch(batch[:1], {}, True, False, slot, flusher_id))
+
+			# slot expired and taken by another flusher
+			frappe.cache().execute_command("SET", slot, "_test_other_flusher")
+			self.assertFalse(send_batch(batch[1:], {}, True, False, slot, flusher_id))
+
+			self.assertEquals(frappe.db.get_value("Bulk Email", batch[0].name, "status"), "Sent")
+			self.assertEquals(frappe.db.get_value("Bulk Email", batch[1].name, "status"), "Sending")
+
+		finally:
+			release_flusher_slot(slot, "_test_other_flusher")
+
 	def test_expired(self):
 		self.test_bulk()
 		frappe.db.sql("update `tabBulk Email` set creation='2010-01-01 12:00:00'")
@@ -76,6 +175,38 @@ class TestEmail(unittest.TestCase):
 		self.assertTrue('test1@example.com' in [d['recipient'] for d in bulk])
 		self.assertTrue('Unsubscribe' in bulk[0]['message'])
 
+	def test_unsubscribe_cache(self):
+		from frappe.email.bulk import unsubscribe, get_unsubscribed, check_bulk_limit
+
+		self.assertEquals(get_unsubscribed("User", "Administrator"), set())
+
+		unsubscribe(doctype="User", name="Administrator", email="test@example.com")
+		frappe.get_doc({"doctype": "Email Unsubscribe", "email": "test1@example.com",
+			"global_unsubscribe": 1}).insert(ignore_permissions=True)
+
+		self.assertEquals(get_unsubscribed("User", "Administrator"),
+			set(["test@example.com", "test1@example.com"]))
+		self.assertEquals(get_unsubscribed("User", "Guest"), set(["test1@example.com"]))
+
+		# served from cache
+		query_count = frappe.db.query_count
+		get_unsubscribed("User", "Administrator")
+		self.assertEquals(frappe.db.query_count, query_count)
+
+		# unsubscribed recipients are not counted in the limit
+		check_bulk_limit(["test@example.com"]*1000, "User", "Administrator")
+
+		frappe.delete_doc("Email Unsubscribe", frappe.db.get_value("Email Unsubscribe",
+			{"email": "test1@example.com"}), ignore_permissions=True)
+		self.assertEquals(get_unsubscribed("User", "Guest"), set())
+
+		# cleared again on commit, in case another request cached the unsubscribes before it
+		frappe.get_doc({"doctype": "Email Unsubscribe", "email": "test2@example.com",
+			"global_unsubscribe": 1}).insert(ignore_permissions=True)
+		frappe.cache().set_value("global_unsubscribes", set())
+		frappe.db.commit()
+		self.assertEquals(get_unsubscribed("User", "Guest"), set(["test2@example.com"]))
+
 	def test_bulk_limit(self):
 		from frappe.email.bulk import send, BulkLimitCrossedError
 		self.assertRaises(BulkLimitCrossedError, send,
@@ -84,6 +215,74 @@ class TestEmail(unittest.TestCase):
 			reference_doctype = "User", reference_name="Administrator",
 			subject='Testing Bulk', message='This is a bulk mail!')
 
+	def test_smtp_session_pool(self):
+		from frappe.email.smtp import SMTPSessionPool
+
+		class Session(object):
+			def __init__(self, code=250):
+				self.code, self.closed = code, False
+			def noop(self):
+				return (self.code, "OK")
+			def quit(self):
+				self.closed = True
+
+		pool = SMTPSessionPool()
+		sess = Session()
+		pool.put("account", sess, size=1)
+		self.assertTrue(pool.get("account") is sess)
+		self.assertEquals(pool.get("account"), None)
+
+		# full pool
+		pool.put("account", sess, size=1)
+		extra = Session()
+		pool.put("account", extra, size=1)
+		self.assertTrue(extra.closed)
+		self.assertTrue(pool.get("other account") is None)
+
+		# failed health check
+		sess.code = 421
+		self.assertEquals(pool.get("account"), None)
+		self.assertTrue(sess.closed)
+
+		# idle for too long
+		sess = Session()
+		pool.put("account", sess)
+		self.assertEquals(pool.get("account", max_idle=-1), None)
+		self.assertTrue(sess.closed)
+
+		# cleared by Email Account, of the current site only
+		site = frappe.local.site
+		sess, other, other_site = Session(), Session(), Session()
+		pool.put((site, "smtp.example.com", "_Test Email Account 1"), sess)
+		pool.put((site, "smtp.example.com", "_Test Email Account 2"), other)
+		pool.put(("other.site", "smtp.example.com", "_Test Email Account 1"), other_site)
+		pool.clear("_Test Email Account 1")
+		self.assertTrue(sess.closed)
+		self.assertFalse(other.closed)
+		self.assertFalse(other_site.closed)
+		self.assertTrue(pool.get((site, "smtp.example.com", "_Test Email Account 2")) is other)
+
+	def test_smtp_pool_key(self):
+		from frappe.email.smtp import SMTPServer
+
+		server = SMTPServer(login="support@example.com", password="secret", server="smtp.example.com")
+		server.email_account = frappe._dict({"name": "Support"})
+		key = server.get_pool_key()
+		self.assertFalse("secret" in key)
+
+		# same account name, server and login on another site
+		site = frappe.local.site
+		frappe.local.site = "other.site"
+		try:
+			self.assertNotEquals(server.get_pool_key(), key)
+		finally:
+			frappe.local.site = site
+
+		self.assertEquals(server.get_pool_key(), key)
+
+		# changed password
+		server.password = "changed"
+		self.assertNotEquals(server.get_pool_key(), key)
 
 if __name__=='__main__':
 	frappe.connect()
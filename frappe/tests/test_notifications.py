@@ -0,0 +1,48 @@
+# Copyright (c) 2015, Frappe Technologies Pvt. Ltd. and Contributors
+# MIT License. See license.txt
+from __future__ import unicode_literals
+
+import frappe, unittest
+from frappe.desk.notifications import (get_notification_config, get_notifications_for_doctypes,
+	reconcile_notification_counts)
+
+class TestNotifications(unittest.TestCase):
+	def setUp(self):
+		frappe.local.conf.incremental_notifications = 1
+
+	def tearDown(self):
+		del frappe.local.conf["incremental_notifications"]
+
+	def get_open_count(self):
+		return get_notifications_for_doctypes(get_notification_config(), {})["Scheduler Log"]
+
+	def test_incremental_notification_count(self):
+		reconcile_notification_counts()
+		count = self.get_open_count()
+
+		log = frappe.get_doc({"doctype": "Scheduler Log", "method": "test", "error": "test"}).insert()
+		self.assertEquals(self.get_open_count(), count + 1)
+
+		# not counted from the database
+		query_count = frappe.db.query_count
+		self.get_open_count()
+		self.assertEquals(frappe.db.query_count, query_count)
+
+		log.seen = 1
+		log.save()
+		self.assertEquals(self.get_open_count(), count)
+
+		log.seen = 0
+		log.save()
+		self.assertEquals(self.get_open_count(), count + 1)
+
+		log.delete()
+		self.assertEquals(self.get_open_count(), count)
+
+		# corrected for changes without hooks
+		log = frappe.get_doc({"doctype": "Scheduler Log", "method": "test", "error": "test"}).insert()
+		log.db_set("seen", 1)
+		self.assertEquals(self.get_open_count(), count + 1)
+
+		reconcile_notification_counts()
+		self.assertEquals(self.get_open_count(), count)
@@ -9,6 +9,7 @@ import frappe.defaults
 import unittest
 import json
 import frappe.model.meta
+import frappe.model.db_query
 from frappe.core.page.user_permissions.user_permissions import add, remove, get_permissions
 from frappe.permissions import clear_user_permissions_for_doctype, get_doc_permissions
 
@@ -60,6 +61,25 @@ class TestPermissions(unittest.TestCase):
 		post = frappe.get_doc("Blog Post", "_test-blog-post")
 		self.assertTrue(post.has_permission("read"))
 
+	def test_role_permissions_cache(self):
+		from frappe.permissions import get_role_permissions, get_role_permissions_for_roles
+		meta = frappe.get_meta("Blog Post")
+
+		perms = get_role_permissions(meta, user="test2@example.com")
+		self.assertTrue(perms.get("read"))
+
+		# same object for the same set of roles, in any order
+		roles = frappe.get_roles("test2@example.com")
+		self.assertTrue(get_role_permissions_for_roles(meta, list(reversed(roles))) is perms)
+
+		# shared via redis with other processes
+		del meta._role_permissions
+		self.assertEquals(get_role_permissions_for_roles(meta, roles), perms)
+
+		# cleared with meta
+		frappe.clear_cache(doctype="Blog Post")
+		self.assertEquals(frappe.cache().hkeys("role_permissions:Blog Post"), [])
+
 	def test_user_permissions_in_doc(self):
 		self.set_user_permission_doctypes(["Blog Category"])
 
@@ -87,6 +107,30 @@ class TestPermissions(unittest.TestCase):
 		self.assertTrue("_test-blog-post-1" in names)
 		self.assertFalse("_test-blog-post" in names)
 
+	def test_user_permissions_in_report_with_subquery(self):
+		self.set_user_permission_doctypes(["Blog Category"])
+
+		frappe.permissions.add_user_permission("Blog Category", "_Test Blog Category 1", "test2@example.com")
+
+		frappe.set_user("test2@example.com")
+		frappe.local.conf.permission_subquery_threshold = -1
+		try:
+			names = [d.name for d in frappe.get_list("Blog Post", fields=["name", "blog_category"])]
+		finally:
+			del frappe.local.conf["permission_subquery_threshold"]
+
+		self.assertTrue("_test-blog-post-1" in names)
+		self.assertFalse("_test-blog-post" in names)
+
+		# 0 turns subqueries off
+		frappe.local.conf.permission_subquery_threshold = 0
+		try:
+			self.assertFalse(frappe.model.db_query.use_subquery(10000))
+		finally:
+			del frappe.local.conf["permission_subquery_threshold"]
+
+		self.assertTrue(frappe.model.db_query.use_subquery(10000))
+
 	def test_default_values(self):
 		frappe.permissions.add_user_permission("Blog Category", "_Test Blog Category 1", "test2@example.com")
 
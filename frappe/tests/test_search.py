@@ -0,0 +1,44 @@
+# Copyright (c) 2015, Frappe Technologies Pvt. Ltd. and Contributors
+# MIT License. See license.txt
+from __future__ import unicode_literals
+
+import frappe, unittest
+from frappe.desk.search import search_widget, get_fulltext_query
+from frappe.model.db_schema import DbTable, get_search_index_columns
+
+class TestSearch(unittest.TestCase):
+	def test_fulltext_query(self):
+		self.assertEquals(get_fulltext_query("test event"), "+test* +event*")
+		self.assertEquals(get_fulltext_query("EV-00001"), None)
+		self.assertEquals(get_fulltext_query("%"), None)
+
+	def test_fulltext_search(self):
+		frappe.local.conf.fulltext_search = ["Event"]
+		try:
+			DbTable("Event").sync_search_index()
+			self.assertEquals(get_search_index_columns("Event"), ["name", "subject"])
+
+			event = frappe.get_doc({
+				"doctype": "Event",
+				"subject": "_Test Fulltext Searchable Event",
+				"starts_on": "2014-01-01",
+				"event_type": "Public"
+			}).insert()
+
+			# InnoDB updates the FULLTEXT index on commit
+			frappe.db.commit()
+
+			search_widget("Event", "fulltext searchab")
+			self.assertEquals([r[0] for r in frappe.response["values"]], [event.name])
+
+			search_widget("Event", "searchab unknownword")
+			self.assertEquals(frappe.response["values"], [])
+
+			event.delete()
+
+		finally:
+			del frappe.local.conf["fulltext_search"]
+			DbTable("Event").sync_search_index()
+			frappe.db.commit()
+
+		self.assertEquals(get_search_index_columns("Event"), [])
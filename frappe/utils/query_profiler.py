@@ -0,0 +1,113 @@
+# Copyright (c) 2015, Frappe Technologies Pvt. Ltd. and Contributors
+# MIT License. See license.txt
+
+"""Per request / job query profiler.
+
+`frappe.db` records the count and time of every query executed on it (see `Database.profile_query`).
+Since the database object lives for one request or background job, this module only has to normalize
+queries, summarize the stats and write slow queries to a rotating log.
+
+Site config:
+
+- `slow_query_threshold`: log queries that take longer than these many seconds (disabled if not set)
+- `slow_query_log_file`: path of the log file, default `[site]/slow_query.log`
+- `slow_query_log_max_size`: rotate the log after these many bytes, default 10 MB
+- `query_profiler_top_n`: number of query shapes returned in the summary, default 10
+"""
+
+from __future__ import unicode_literals
+import re
+import logging
+import logging.handlers
+import frappe
+
+# quoted identifiers are matched (and kept) so that values are not replaced inside them
+values_pattern = re.compile(r"""(`[^`]*`)|'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|%(?:\([^)]+\))?s|(?<!\w)-?\d+(?:\.\d+)?\b""")
+value_lists_pattern = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+whitespace_pattern = re.compile(r"\s+")
+
+_slow_query_loggers = {}
+
+def normalize_query(query):
+	"""Returns query with all values replaced by `?` and `in (...)` lists collapsed, so that
+	queries of the same shape can be grouped.
+
+		normalize_query("select name from tabUser where name in ('a', 'b')")
+		# select name from tabUser where name in (?+)
+	"""
+	query = values_pattern.sub(lambda m: m.group(1) or "?", query)
+	query = value_lists_pattern.sub("(?+)", query)
+	return whitespace_pattern.sub(" ", query).strip()
+
+def get_summary(db=None, top_n=None):
+	"""Returns query count, total time and the slowest query shapes (by total time) for the
+	current request or job."""
+	db = db or frappe.db
+	top_n = top_n or frappe.conf.get("query_profiler_top_n") or 10
+
+	slowest = sorted(db.query_stats.iteritems(), key=lambda d: d[1][1], reverse=True)
+
+	return frappe._dict({
+		"count": db.query_count,
+		"time": db.query_time,
+		"value_cache_hits": db.name_value_cache_hits,
+		"value_cache_misses": db.name_value_cache_misses,
+		"slowest": [frappe._dict({
+			"query": query,
+			"count": stats[0],
+			"time": stats[1],
+			"max_time": stats[2]
+		}) for query, stats in slowest[:top_n]]
+	})
+
+def set_response_headers(response):
+	"""Set `X-Frappe-DB-Time` (seconds) and `X-Frappe-Query-Count` headers on the response."""
+	if not frappe.db:
+		return
+
+	response.headers[b"X-Frappe-DB-Time"] = b"{0:.4f}".format(frappe.db.query_time)
+	response.headers[b"X-Frappe-Query-Count"] = str(frappe.db.query_count)
+
+def log_slow_query(query, duration):
+	"""Write query to the slow query log if it took more than `slow_query_threshold` seconds."""
+	threshold = frappe.conf.get("slow_query_threshold")
+	if not threshold or duration < threshold:
+		return
+
+	get_slow_query_logger().warning("{duration:.4f}s site: {site} {source}\n{query}".format(
+		duration=duration, site=frappe.local.site, source=get_query_source(),
+		query=normalize_query(query)))
+
+def get_query_source():
+	"""Returns the method, path or task id that is running the query."""
+	form_dict = getattr(frappe.local, "form_dict", None)
+	request = getattr(frappe.local, "request", None)
+
+	if form_dict and form_dict.cmd:
+		return form_dict.cmd
+	elif request:
+		return request.path
+	else:
+		return frappe.local.task_id or ""
+
+def get_slow_query_logger():
+	path = frappe.conf.get("slow_query_log_file") or frappe.get_site_path("slow_query.log")
+
+	if path not in _slow_query_loggers:
+		logger = logging.getLogger("frappe.slow_query.{0}".format(len(_slow_query_loggers)))
+		logger.setLevel(logging.WARNING)
+		logger.propagate = False
+
+		handler = logging.handlers.RotatingFileHandler(path,
+			maxBytes=frappe.conf.get("slow_query_log_max_size") or 10*1024*1024, backupCount=5)
+		handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+		logger.addHandler(handler)
+
+		_slow_query_loggers[path] = logger
+
+	logger = _slow_query_loggers[path]
+
+	# dictConfig in setup_logging disables loggers created before it
+	logger.disabled = False
+
+	return logger
@@ -117,6 +117,9 @@ class RedisWrapper(redis.Redis):
 			if key in frappe.local.cache:
 				del frappe.local.cache[key]
 
+			# hashes are cached in frappe.local by name, without the prefix
+			frappe.local.cache.pop(cstr(key).split("|", 1)[-1], None)
+
 	def hset(self, name, key, value):
 		if not name in frappe.local.cache:
 			frappe.local.cache[name] = {}
@@ -170,3 +173,11 @@ class RedisWrapper(redis.Redis):
 		except redis.exceptions.ConnectionError:
 			return []
 
+
+	def hgetall(self, name):
+		"""Returns all keys and values of the hash (unpickled)."""
+		try:
+			return {key: pickle.loads(value) for key, value in
+				super(redis.Redis, self).hgetall(self.make_key(name)).iteritems()}
+		except redis.exceptions.ConnectionError:
+			return {}
@@ -42,10 +42,16 @@ def build_response(response_type=None):
 	return response_type_map[frappe.response.get('type') or response_type]()
 
 def as_csv():
-	response = Response()
+	if frappe.response.get('result_file'):
+		# stream the file, it is closed (and deleted if temporary) when the response is closed
+		response = Response(wrap_file(frappe.local.request.environ, frappe.response['result_file']),
+			direct_passthrough=True)
+	else:
+		response = Response()
+		response.data = frappe.response['result']
+
 	response.headers[b"Content-Type"] = b"text/csv; charset: utf-8"
 	response.headers[b"Content-Disposition"] = ("attachment; filename=\"%s.csv\"" % frappe.response['doctype'].replace(' ', '_')).encode("utf-8")
-	response.data = frappe.response['result']
 	return response
 
 def as_raw():